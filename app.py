@@ -1,19 +1,22 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from llm import get_ollama_response, GENERATOR_MODEL_NAME
-from nlu import get_intent_and_entities
+from llm import get_ollama_response, stream_ollama_response, GENERATOR_MODEL_NAME, llm_router
+from nlu import get_intent_and_entities, extract_current_message, get_nlu_stats
+from intent_classifier import YOUTUBE_URL_REGEX
 from integrations import weather, web_search, bible, nextcloud, caldav_calendar, youtube # Import integration modules
 from integrations.autosci import trigger_autosci_discovery # Import the new autosci function
 from problem_solver import solve_with_multi_step_refinement # Updated import
 from verifylib.python.verify import verify_license
-from mcp_client import MCPClient
-import asyncio
-import threading
+from mcp_registry import MCPRegistry
+from task_store import SQLiteTaskStore, AUTOSCI_TASK_TTL_SECONDS, ACTIVE_STATUSES
+from job_scheduler import JobScheduler, JobCancelled, QueueFullError
+from progress_events import ProgressEventBus, FINAL_EVENTS
+from conversation_store import ConversationStore, render_context
+import tracing
 
 import uuid
-from concurrent.futures import ThreadPoolExecutor
-import time # For potential cleanup logic if desired, not strictly used in core logic yet
 import re
+import json
 
 # Verify license
 verified, message = verify_license(pow_list_url="https://github.com/SammyLord/drmixaholic-list/raw/refs/heads/main/pow_list.txt")
@@ -24,135 +27,279 @@ if not verified:
 app = Flask(__name__)
 CORS(app)
 
-# Initialize a ThreadPoolExecutor
-# Adjust max_workers as needed. For very long tasks, a small number is fine.
-executor = ThreadPoolExecutor(max_workers=2) 
-# In-memory store for task statuses and results.
-# WARNING: This is lost if the Flask server restarts. 
-# For persistent tasks, use a database or a proper task queue (Celery/RQ).
-autosci_tasks = {}
+# Bounded scheduler for long-running AutoSCI jobs: admission control, per-client limits,
+# queue positions and cancellation. Tune with the SCHEDULER_* environment variables.
+scheduler = JobScheduler()
+# Persistent store for AutoSCI task statuses and results (SQLite, WAL mode).
+# Survives restarts; finished tasks are evicted after AUTOSCI_TASK_TTL_SECONDS.
+task_store = SQLiteTaskStore()
+# Live AutoSCI progress, pushed to browsers over server-sent events (/autosci_events/<task_id>).
+progress_bus = ProgressEventBus()
+SSE_KEEPALIVE_SECONDS = 15  # Idle streams send a comment this often so proxies keep them open
 MAX_PARALLEL_THEORIES = 3  # Maximum number of theories to generate in parallel
 
-mcp_client = MCPClient()
-mcp_server_process = None
+# Connections to any number of MCP servers, sharing one background event loop. Their tools are
+# exposed to the NLU as `mcp_<server>_<tool>` intents.
+mcp_registry = MCPRegistry()
 
-# In-memory storage for conversation history
-conversation_history = {}
+# Server-side chat history per `session_id`: recent turns verbatim plus a rolling summary of older
+# ones, within a fixed token budget. Tune with the CONVERSATION_* environment variables.
+conversations = ConversationStore()
 
-def run_autosci_in_background(task_id: str, theory_index: int = 0):
-    """Wrapper function to run trigger_autosci_discovery in a background thread and store its result."""
-    print(f"App.py: Background task {task_id} (theory {theory_index}) started for AutoSCI discovery.")
-    try:
-        discovery_result = trigger_autosci_discovery()
-        if 'theories' not in autosci_tasks[task_id]:
-            autosci_tasks[task_id]['theories'] = []
-        autosci_tasks[task_id]['theories'].append({
-            'index': theory_index,
-            'result': discovery_result
-        })
-        
-        # Check if all theories are complete
-        if len(autosci_tasks[task_id]['theories']) == autosci_tasks[task_id]['total_theories']:
-            # Sort theories by index and combine results
-            theories = sorted(autosci_tasks[task_id]['theories'], key=lambda x: x['index'])
-            combined_result = "\n\n---\n\n".join([f"Theory {i+1}:\n{t['result']}" for i, t in enumerate(theories)])
-            autosci_tasks[task_id]['status'] = 'completed'
-            autosci_tasks[task_id]['result'] = combined_result
+def combine_theory_results(results: list[str]) -> str:
+    """Joins per-theory results (already ordered by theory index) into the final AutoSCI answer."""
+    return "\n\n---\n\n".join([f"Theory {i+1}:\n{result}" for i, result in enumerate(results)])
+
+def _on_theory_done(task_id: str, theory_index: int, discovery_result, error):
+    """Stores one theory's outcome in the task store once its scheduled job finishes."""
+    if isinstance(error, JobCancelled):
+        print(f"App.py: Theory {theory_index} for task {task_id} was cancelled.")
+        task_store.transition(task_id, ACTIVE_STATUSES, 'cancelled', error='Cancelled by request.')
+        task_info = task_store.get_task(task_id)
+    elif error is not None:
+        print(f"App.py: Theory {theory_index} for task {task_id} failed: {error}")
+        task_info = task_store.record_theory(task_id, theory_index, error=str(error))
+    else:
+        task_info = task_store.record_theory(task_id, theory_index, result=discovery_result, combine=combine_theory_results)
+        if task_info and task_info['status'] == 'completed':
             print(f"App.py: All theories for task {task_id} completed successfully.")
         print(f"App.py: Theory {theory_index} for task {task_id} completed successfully.")
-    except Exception as e:
-        print(f"App.py: Theory {theory_index} for task {task_id} failed: {e}")
-        if 'theories' not in autosci_tasks[task_id]:
-            autosci_tasks[task_id]['theories'] = []
-        autosci_tasks[task_id]['theories'].append({
-            'index': theory_index,
-            'error': str(e)
-        })
-        # If any theory fails, mark the whole task as failed
-        autosci_tasks[task_id]['status'] = 'failed'
-        autosci_tasks[task_id]['error'] = f"Theory {theory_index} failed: {str(e)}"
+        if task_info:
+            progress_bus.publish(task_id, 'theory_completed', {'theory_index': theory_index, **autosci_progress(task_info)})
+    if task_info:
+        publish_final_event(task_id, task_info)
+
+def publish_final_event(task_id: str, task_info: dict):
+    """Publishes the task's final event (completed, failed or cancelled) once it has finished."""
+    event = final_event(task_info)
+    if event and not progress_bus.is_closed(task_id):
+        progress_bus.publish(task_id, *event)
+
+def final_event(task_info: dict):
+    """Returns (event, data) for a finished task, or None while it is still pending or running."""
+    if task_info['status'] == 'completed':
+        return 'completed', {'result': task_info['result']}
+    if task_info['status'] in FINAL_EVENTS:
+        return task_info['status'], {'error': task_info.get('error') or 'Unknown error occurred'}
+    return None
+
+def submit_autosci_theories(task_id: str, theory_indices: list, client_id: str = None):
+    """
+    Queues one trigger_autosci_discovery job per theory. Raises QueueFullError if the scheduler
+    cannot admit all of them.
+    """
+    def on_start(job):
+        print(f"App.py: Background task {task_id} (theory {theory_indices[job.index]}) started for AutoSCI discovery.")
+        if task_store.transition(task_id, ('pending',), 'running'):
+            progress_bus.publish(task_id, 'running', {})
+
+    def on_progress(job, event, data):
+        progress_bus.publish(task_id, event, {'theory_index': theory_indices[job.index], **data})
+
+    scheduler.submit_group(
+        task_id,
+        [(trigger_autosci_discovery, ()) for _ in theory_indices],
+        client_id=client_id,
+        on_start=on_start,
+        on_progress=on_progress,
+        on_done=lambda job, result, error: _on_theory_done(task_id, theory_indices[job.index], result, error),
+    )
+
+def start_autosci_task(total_theories: int, client_id: str) -> str:
+    """Creates a task and queues its theories. Raises QueueFullError (after removing the task) if rejected."""
+    task_id = str(uuid.uuid4())
+    task_store.evict_expired(AUTOSCI_TASK_TTL_SECONDS)
+    task_store.create_task(task_id, total_theories=total_theories, status='pending')
+    try:
+        submit_autosci_theories(task_id, list(range(total_theories)), client_id=client_id)
+    except QueueFullError:
+        task_store.delete_task(task_id)
+        raise
+    return task_id
+
+def queue_full_reply(error: QueueFullError) -> tuple[dict, int, dict]:
+    return {
+        'error': 'The AutoSCI queue is full. Please try again later.',
+        'retry_after': error.retry_after
+    }, 429, {'Retry-After': str(error.retry_after)}
+
+def queue_full_response(error: QueueFullError):
+    body, status, headers = queue_full_reply(error)
+    return jsonify(body), status, headers
+
+def request_client_id() -> str:
+    """Identifies the caller for per-client concurrency limits."""
+    return request.headers.get('X-Client-Id') or request.remote_addr
+
+def recover_autosci_tasks():
+    """Evicts expired tasks and resubmits the unfinished theories of tasks interrupted by a restart."""
+    evicted = task_store.evict_expired(AUTOSCI_TASK_TTL_SECONDS)
+    if evicted:
+        print(f"App.py: Evicted {evicted} expired AutoSCI tasks.")
+    for task_id, missing_theories in task_store.recover_inflight():
+        print(f"App.py: Recovering AutoSCI task {task_id} (theories {missing_theories}).")
+        try:
+            submit_autosci_theories(task_id, missing_theories, client_id='recovered')
+        except QueueFullError:
+            task_store.transition(task_id, ACTIVE_STATUSES, 'failed', error='Could not be resumed after restart: queue is full.')
+
+def autosci_progress(task_info: dict) -> dict:
+    return {'completed': len(task_info['theories']), 'total': task_info['total_theories']}
+
+def autosci_running_status(task_id: str, task_info: dict) -> dict:
+    """Progress details for an unfinished task, including its place in the scheduler queue."""
+    details = {'progress': autosci_progress(task_info)}
+    position = scheduler.queue_position(task_id)
+    if position is not None:
+        details['queue_position'] = position
+    return details
+
+def stream_chat_response(chunks, on_complete=None, on_done=None):
+    """
+    Wraps a generator of text deltas as a chunked NDJSON response.
+
+    Each line is a JSON object: {"type": "delta", "content": "..."} for every chunk, followed by
+    a final {"type": "done", "response": "<full text>"} so the client can store the complete reply.
+    `on_complete(full_text)` runs once a stream finishes without error; `on_done(done)` may add
+    fields to the final line.
+    """
+    def generate():
+        full_response = []
+        try:
+            for chunk in chunks:
+                full_response.append(chunk)
+                yield json.dumps({'type': 'delta', 'content': chunk}) + "\n"
+        except Exception as e:
+            print(f"App.py: Streaming response failed: {e}")
+            yield json.dumps({'type': 'error', 'error': str(e)}) + "\n"
+        else:
+            if on_complete:
+                on_complete("".join(full_response))
+        done = {'type': 'done', 'response': "".join(full_response)}
+        if on_done:
+            on_done(done)
+        yield json.dumps(done) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    user_message = request.json.get('message')
-    if not user_message:
-        return jsonify({'error': 'No message provided'}), 400
-    
-    # Get the list of tools from the connected MCP server
-    mcp_tools_list = []
-    if mcp_client.session:
-        try:
-            tools = asyncio.run(mcp_client.list_tools())
-            mcp_tools_list = [{'name': tool.name, 'description': tool.description, 'is_mcp': True} for tool in tools]
-        except Exception as e:
-            print(f"Could not fetch MCP tools: {e}")
+def youtube_request(user_message: str):
+    """Returns (video_id, question) for a message containing a YouTube link, or None."""
+    # NLU identifies the intent, but we use regex here for robust extraction of the URL.
+    # Only the current message is searched so links from earlier turns in the history envelope are ignored.
+    current_message = extract_current_message(user_message)
+    match = re.search(YOUTUBE_URL_REGEX, current_message)
+    if not (match and match.group(1)):
+        return None
+    # The question is whatever is not the URL.
+    question = current_message.split(match.group(0))[0].strip()
+    return match.group(1), question or "Summarize this video." # Default action
 
-    # Pass both standard and MCP tools to the NLU
-    intent, entities = get_intent_and_entities(user_message, mcp_tools=mcp_tools_list)
+# Intents answered by an integration rather than by the generator model.
+INTEGRATION_INTENTS = {
+    "autosci_mode", "get_weather", "search_web", "get_bible_verse", "query_youtube_video",
+    "caldav_query", "nextcloud_list_files", "nextcloud_query",
+}
 
-    print(f"Intent: {intent}, Entities: {entities}")
+def is_direct_generation(intent: str, payload: dict) -> bool:
+    """True when the reply comes straight from the generator model (no integration, no evolution)."""
+    return (intent not in INTEGRATION_INTENTS and not intent.startswith('mcp_')
+            and not payload.get('use_evolution_mode', False))
 
-    nextcloud_creds = request.json.get('nextcloud_creds')
-    caldav_creds = request.json.get('caldav_creds')
-    use_evolution = request.json.get('use_evolution_mode', False)
-    num_theories = min(int(request.json.get('num_theories', 1)), MAX_PARALLEL_THEORIES)
+def log_generation_path(intent: str, user_message: str, use_evolution: bool):
+    log_intent_str = f"intent: '{intent}'" if intent else "fallback/general query"
+    if use_evolution:
+        print(f"App.py: {log_intent_str}. Engaging multi-step solver (evolution ON) for: {user_message}")
+    else:
+        print(f"App.py: {log_intent_str}. Using direct generator model (evolution OFF) for: {user_message}")
+
+def conversation_context(payload: dict) -> dict:
+    """History for the request's `session_id` (empty without one), see ConversationStore.build_context."""
+    return conversations.build_context(payload.get('session_id'))
+
+def conversation_llm_kwargs(context: dict) -> dict:
+    """Passes a built context to the llm.py functions: the summary as system message, recent turns as chat history."""
+    system = f"Summary of the earlier conversation with this user:\n{context['summary']}" if context['summary'] else None
+    return {'system': system, 'history': context['messages']}
+
+def remember_exchange(payload: dict, reply: str):
+    """Appends the user's message and the reply to the session's history."""
+    session_id = payload.get('session_id')
+    if session_id and reply:
+        conversations.append_exchange(session_id, extract_current_message(payload['message']), reply)
+
+def finish_chat_trace(chat_trace: tracing.Trace, intent: str, payload: dict, body: dict):
+    """Ends a /chat trace and, if the request asked for `include_timings`, adds its breakdown to `body`."""
+    chat_trace.finish(intent=intent)
+    # One series per MCP tool would grow without bound as servers connect, so they share a label.
+    tracing.chat_duration.observe(chat_trace.duration, intent='mcp' if intent.startswith('mcp_') else intent)
+    if payload.get('include_timings'):
+        body['timings'] = chat_trace.breakdown()
+
+def chat_reply(payload: dict, intent: str, entities: dict, client_id: str, context: dict = None) -> tuple[dict, int, dict]:
+    """
+    Produces the (non-streaming) /chat reply for an already classified message as
+    (body, status, headers). Shared by the Flask route and the ASGI server (asgi.py).
+    `context` is the conversation history built for the request, if any.
+    """
+    context = context or {'summary': "", 'messages': []}
+    # Older clients still wrap the message in a history envelope; the server keeps the history now.
+    user_message = extract_current_message(payload.get('message'))
+    nextcloud_creds = payload.get('nextcloud_creds')
+    caldav_creds = payload.get('caldav_creds')
+    use_evolution = payload.get('use_evolution_mode', False)
+    # Optional per-request overrides for the evolution loop (step cap, time/token budget, convergence).
+    evolution_options = payload.get('evolution_options')
+    num_theories = min(int(payload.get('num_theories', 1)), MAX_PARALLEL_THEORIES)
     
     ai_response = ""
+    response_extras = {}
 
     if intent == "autosci_mode":
-        # Generate a unique task ID for this AutoSCI request
-        task_id = str(uuid.uuid4())
-        autosci_tasks[task_id] = {
-            'status': 'running',
-            'result': None,
-            'total_theories': num_theories,
-            'theories': []
-        }
-        
-        # Start multiple AutoSCI processes in parallel
-        for i in range(num_theories):
-            executor.submit(run_autosci_in_background, task_id, i)
+        # Queue one AutoSCI job per theory; they run in parallel as scheduler workers free up
+        try:
+            task_id = start_autosci_task(num_theories, client_id=client_id)
+        except QueueFullError as e:
+            return queue_full_reply(e)
         
-        return jsonify({
+        return {
             'action': 'autosci_initiate_prompt',
             'task_id': task_id,
+            'queue_position': scheduler.queue_position(task_id),
             'response': f"AutoSCI mode acknowledged. Starting {num_theories} parallel discovery processes in background..."
-        })
+        }, 200, {}
     elif intent == "get_weather":
-        location = entities.get('location')
+        location = entities.get('locations') or entities.get('location') # A list when several places are asked about
         if not location:
             ai_response = "I can get the weather for you, but I need a location. What city are you interested in?"
         else:
-            ai_response = weather.get_weather_data(location=location)
+            with tracing.span('integration.weather', locations=len(location) if isinstance(location, list) else 1):
+                ai_response = weather.get_weather_data(location=location)
     elif intent == "search_web":
-        query = entities.get('query', 'a given topic')
-        ai_response = web_search.search(query)
+        query = entities.get('query_term') or entities.get('query') # The NLU schema names it query_term
+        with tracing.span('integration.web_search'):
+            ai_response = web_search.search_web(query, user_message)
     elif intent == "get_bible_verse":
-        ai_response = bible.get_random_bible_verse()
+        reference = entities.get('reference')
+        with tracing.span('integration.bible', reference=bool(reference)):
+            ai_response = bible.get_specific_bible_verse(reference) if reference else bible.get_random_bible_verse()
     elif intent == "query_youtube_video":
-        # NLU identifies the intent, but we use regex here for robust extraction of the URL.
-        yt_regex = r'(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/(?:[^\/\n\s]+\/\S+\/|(?:v|e(?:mbed)?)\/|\S*?[?&]v=)|youtu\.be\/)([a-zA-Z0-9_-]{11})'
-        match = re.search(yt_regex, user_message)
-        
-        if match and match.group(1):
-            video_id = match.group(1)
-            # The question is whatever is not the URL.
-            question = user_message.split(match.group(0))[0].strip()
-            if not question:
-                question = "Summarize this video." # Default action
-            
-            ai_response = youtube.handle_youtube_query(video_id=video_id, question=question)
+        video = youtube_request(user_message)
+        if video:
+            with tracing.span('integration.youtube'):
+                ai_response = youtube.handle_youtube_query(video_id=video[0], question=video[1])
         else:
             ai_response = "I understood you want to ask about a YouTube video, but I couldn't find a valid YouTube link in your message."
     elif intent == "caldav_query":
         if not caldav_creds or not all(k in caldav_creds for k in ['url', 'user', 'password']):
             ai_response = "It looks like you want to check your calendar, but your CalDAV credentials aren't set. Please configure them in the settings (⚙️ icon)."
         else:
-            ai_response = caldav_calendar.handle_caldav_action(creds=caldav_creds, nlu_data={'intent': intent, 'entities': entities})
+            with tracing.span('integration.caldav'):
+                ai_response = caldav_calendar.handle_caldav_action(creds=caldav_creds, nlu_data={'intent': intent, 'entities': entities})
     elif intent == "nextcloud_list_files" or intent == "nextcloud_query":
         if not nextcloud_creds or not all(k in nextcloud_creds for k in ['url', 'user', 'password']):
             ai_response = "It looks like you want to use Nextcloud, but your credentials aren't set. Please configure them in the settings (⚙️ icon)."
@@ -160,33 +307,77 @@ def chat():
             # Add a default for path in case NLU misses it, making it more robust.
             if 'path' not in entities:
                 entities['path'] = '/'
-            ai_response = nextcloud.handle_nextcloud_action(creds=nextcloud_creds, nlu_data={'intent': intent, 'entities': entities})
-    elif intent.startswith('mcp_'): # Handle MCP tool intents
-        tool_name = intent.replace('mcp_', '', 1)
+            with tracing.span('integration.nextcloud'):
+                ai_response = nextcloud.handle_nextcloud_action(creds=nextcloud_creds, nlu_data={'intent': intent, 'entities': entities})
+    elif intent.startswith('mcp_'): # Handle MCP tool intents (mcp_<server>_<tool>)
         try:
-            ai_response = asyncio.run(mcp_client.call_tool(tool_name, entities))
+            with tracing.span('integration.mcp', tool=intent):
+                ai_response = mcp_registry.call_tool(intent, entities)
         except Exception as e:
-            ai_response = f"Error calling MCP tool '{tool_name}': {e}"
+            ai_response = f"Error calling MCP tool '{intent}': {e}"
     else:  
+        log_generation_path(intent, user_message, use_evolution)
         if use_evolution:
-            log_intent_str = f"intent: '{intent}'" if intent else "fallback/general query"
-            print(f"App.py: {log_intent_str}. Engaging multi-step solver (evolution ON) for: {user_message}")
-            ai_response = solve_with_multi_step_refinement(user_message)
+            with tracing.span('solver'):
+                solver_result = solve_with_multi_step_refinement(render_context(context, user_message), evolution_options=evolution_options, return_details=True)
+            ai_response = solver_result['solution']
+            if solver_result['evolution']:
+                response_extras['evolution'] = solver_result['evolution']
         else:
-            log_intent_str = f"intent: '{intent}'" if intent else "fallback/general query"
-            print(f"App.py: {log_intent_str}. Using direct generator model (evolution OFF) for: {user_message}")
-            ai_response = get_ollama_response(user_message, model_name=GENERATOR_MODEL_NAME)
+            ai_response = get_ollama_response(user_message, model_name=GENERATOR_MODEL_NAME, priority='interactive', **conversation_llm_kwargs(context))
+
+    return {'response': ai_response, **response_extras}, 200, {}
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    payload = request.json
+    user_message = payload.get('message')
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+    
+    # Merged, cached tool catalog of the connected MCP servers (no server round trip unless it is stale)
+    mcp_tools_list = mcp_registry.get_tool_catalog()
+
+    # Spans of this request (NLU, LLM calls, integrations, solver stages) are collected here and
+    # returned as a timing breakdown when the request sets `include_timings`.
+    chat_trace = tracing.Trace('chat')
+    with chat_trace.activated():
+        # Pass both standard and MCP tools to the NLU
+        current_message = extract_current_message(user_message)
+        intent, entities = get_intent_and_entities(current_message, mcp_tools=mcp_tools_list)
+
+        print(f"Intent: {intent}, Entities: {entities}")
+        context = conversation_context(payload)
+        on_complete = lambda reply: remember_exchange(payload, reply)
+        on_done = lambda done: finish_chat_trace(chat_trace, intent, payload, done)
 
-    return jsonify({'response': ai_response})
+        # When true, LLM-backed replies are streamed back as NDJSON deltas instead of one JSON blob.
+        if payload.get('stream', False):
+            if intent == "query_youtube_video":
+                video = youtube_request(current_message)
+                if video:
+                    chunks = youtube.stream_youtube_query(video_id=video[0], question=video[1])
+                    return stream_chat_response(chat_trace.iterate(chunks), on_complete, on_done)
+            elif is_direct_generation(intent, payload):
+                log_generation_path(intent, current_message, use_evolution=False)
+                chunks = stream_ollama_response(current_message, model_name=GENERATOR_MODEL_NAME, priority='interactive',
+                                                **conversation_llm_kwargs(context))
+                return stream_chat_response(chat_trace.iterate(chunks), on_complete, on_done)
+
+        body, status, headers = chat_reply(payload, intent, entities, request_client_id(), context)
+    if status == 200:
+        on_complete(body.get('response'))
+    finish_chat_trace(chat_trace, intent, payload, body)
+    return jsonify(body), status, headers
 
 @app.route('/execute_autosci', methods=['POST'])
 def execute_autosci_route():
     """Endpoint to start the (potentially long) AutoSCI process in the background."""
-    task_id = str(uuid.uuid4())
-    autosci_tasks[task_id] = {'status': 'pending', 'result': None, 'error': None}
-    
-    # Submit the long-running task to the executor
-    executor.submit(run_autosci_in_background, task_id)
+    # Submit the long-running task to the scheduler
+    try:
+        task_id = start_autosci_task(1, client_id=request_client_id())
+    except QueueFullError as e:
+        return queue_full_response(e)
     
     print(f"App.py: /execute_autosci called. Task {task_id} submitted for AutoSCI discovery.")
     return jsonify({
@@ -198,7 +389,7 @@ def execute_autosci_route():
 @app.route('/autosci_task/<task_id>', methods=['GET'])
 def get_autosci_task_status(task_id: str):
     """Endpoint to check the status and result of an AutoSCI task."""
-    task_info = autosci_tasks.get(task_id)
+    task_info = task_store.get_task(task_id)
     if not task_info:
         return jsonify({'error': 'Task not found'}), 404
     
@@ -208,78 +399,227 @@ def get_autosci_task_status(task_id: str):
     }
     if task_info['status'] == 'completed':
         response_data['result'] = task_info['result']
-    elif task_info['status'] == 'failed':
-        response_data['error'] = task_info['error']
+    elif task_info['status'] in ('failed', 'cancelled'):
+        response_data['error'] = task_info.get('error') or 'Unknown error occurred'
+    else:
+        response_data.update(autosci_running_status(task_id, task_info))
     
-    # Optional: Clean up old tasks after they've been retrieved or after a certain time
-    # if task_info['status'] in ['completed', 'failed']:
-    #     # Consider if you want to remove from memory after first fetch of completed/failed status
-    #     # or implement a more sophisticated cleanup mechanism.
-    #     pass
+    # Finished tasks are not removed here; the task store evicts them after AUTOSCI_TASK_TTL_SECONDS.
 
     return jsonify(response_data)
 
 @app.route('/check_autosci_status/<task_id>', methods=['GET'])
 def check_autosci_status(task_id):
     """Check the status of a running AutoSCI task."""
-    if task_id not in autosci_tasks:
+    task_info = task_store.get_task(task_id)
+    if not task_info:
         return jsonify({'error': 'Task not found'}), 404
         
-    task_info = autosci_tasks[task_id]
     if task_info['status'] == 'completed':
         # Clean up the task after sending the result
-        result = task_info['result']
-        del autosci_tasks[task_id]
-        return jsonify({'status': 'completed', 'response': result})
-    elif task_info['status'] == 'failed':
-        error = task_info.get('error', 'Unknown error occurred')
-        del autosci_tasks[task_id]
-        return jsonify({'status': 'failed', 'error': error})
+        task_store.delete_task(task_id)
+        return jsonify({'status': 'completed', 'response': task_info['result']})
+    elif task_info['status'] in ('failed', 'cancelled'):
+        error = task_info.get('error') or 'Unknown error occurred'
+        task_store.delete_task(task_id)
+        return jsonify({'status': task_info['status'], 'error': error})
     else:
-        return jsonify({'status': 'running'})
+        return jsonify({'status': 'running', **autosci_running_status(task_id, task_info)})
 
-def start_mcp_server(server_path):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+@app.route('/autosci_task/<task_id>/cancel', methods=['POST'])
+def cancel_autosci_task(task_id: str):
+    """Cancels a queued or running AutoSCI task. Running theories stop before their next LLM call."""
+    task_info = task_store.get_task(task_id)
+    if not task_info:
+        return jsonify({'error': 'Task not found'}), 404
+    if task_info['status'] not in ACTIVE_STATUSES:
+        return jsonify({'task_id': task_id, 'status': task_info['status']}), 409
+    cancelled_jobs = scheduler.cancel_group(task_id)
+    task_store.transition(task_id, ACTIVE_STATUSES, 'cancelled', error='Cancelled by request.')
+    publish_final_event(task_id, task_store.get_task(task_id))
+    return jsonify({'task_id': task_id, 'status': 'cancelled', 'cancelled_jobs': cancelled_jobs})
+
+def sse_data(payload: dict, event_id=None) -> str:
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}data: {json.dumps(payload)}\n\n"
+
+def format_sse(record: dict) -> str:
+    return sse_data({'event': record['event'], **record['data']}, event_id=record['id'])
+
+def autosci_snapshot(task_id: str, task_info: dict) -> dict:
+    """First event of an AutoSCI event stream: the task's current state."""
+    snapshot = {'event': 'snapshot', 'status': task_info['status'], 'progress': autosci_progress(task_info)}
+    if task_info['status'] in ACTIVE_STATUSES:
+        snapshot.update(autosci_running_status(task_id, task_info))
+    return snapshot
+
+def last_event_id_header(headers) -> int:
     try:
-        loop.run_until_complete(mcp_client.connect(server_path))
-    finally:
-        loop.close()
+        return int(headers.get('Last-Event-ID', 0))
+    except ValueError:
+        return 0
+
+@app.route('/autosci_events/<task_id>', methods=['GET'])
+def autosci_events(task_id: str):
+    """
+    Server-sent event stream of an AutoSCI task's progress: a snapshot of its current state, then
+    every stage event (ideas, prototypes, evolution steps, finished theories) as it happens, ending
+    with a completed, failed or cancelled event. Reconnecting clients resume from Last-Event-ID.
+    """
+    task_info = task_store.get_task(task_id)
+    if not task_info:
+        return jsonify({'error': 'Task not found'}), 404
+    last_event_id = last_event_id_header(request.headers)
+
+    def generate(task_info, last_event_id):
+        yield sse_data(autosci_snapshot(task_id, task_info))
+        while True:
+            event = final_event(task_info)
+            if event:
+                # Finished before (or while) we were listening; the store holds the authoritative outcome.
+                yield sse_data({'event': event[0], **event[1]})
+                return
+            records = progress_bus.wait_for_events(task_id, after_id=last_event_id, timeout=SSE_KEEPALIVE_SECONDS)
+            for record in records:
+                last_event_id = record['id']
+                yield format_sse(record)
+                if record['event'] in FINAL_EVENTS:
+                    return
+            if not records:
+                yield ": keep-alive\n\n"
+            task_info = task_store.get_task(task_id)
+            if not task_info:
+                return
+
+    return Response(
+        stream_with_context(generate(task_info, last_event_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+def service_gauges() -> list:
+    """Queue and memory gauges for /metrics, read from the components' own stats at scrape time."""
+    router_stats = llm_router.stats()
+    scheduler_stats = scheduler.stats()
+    return [
+        ('llm_in_flight', "LLM calls holding a backend slot.", [({}, router_stats['in_flight'])]),
+        ('llm_waiting', "LLM calls waiting for a backend slot, by priority class.",
+         [({'priority': priority_class}, waiting) for priority_class, waiting in router_stats['waiting'].items()]),
+        ('scheduler_jobs', "AutoSCI jobs in the scheduler, by state.",
+         [({'state': 'queued'}, scheduler_stats['queued']), ({'state': 'running'}, scheduler_stats['running'])]),
+        ('conversation_sessions', "Conversation sessions held in memory.", [({}, conversations.stats()['sessions'])]),
+    ]
+
+tracing.metrics.add_gauge_collector(service_gauges)
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text format: latency histograms per span, LLM time to first byte and tokens, queue gauges."""
+    return Response(tracing.metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/llm/stats', methods=['GET'])
+def llm_stats():
+    """Per-model in-flight and waiting calls, and each backend's queue depth, latency and health."""
+    return jsonify(llm_router.stats())
+
+@app.route('/conversation/stats', methods=['GET'])
+def conversation_stats():
+    """Sessions held in memory, their stored turns and bytes, and how many summaries were built."""
+    return jsonify(conversations.stats())
+
+@app.route('/conversation/<session_id>', methods=['DELETE'])
+def clear_conversation(session_id):
+    """Forgets a session's server-side history."""
+    return jsonify({'status': 'cleared' if conversations.clear(session_id) else 'not_found'})
+
+@app.route('/nlu/stats', methods=['GET'])
+def nlu_stats():
+    """Reports which NLU tier (rules, local classifier or LLM) decided each message and how fast."""
+    return jsonify(get_nlu_stats())
+
+@app.route('/weather/stats', methods=['GET'])
+def weather_stats():
+    """Geocode and forecast cache hit rates, lookups coalesced, and open-meteo call latency."""
+    return jsonify(weather.get_weather_stats())
 
 @app.route('/mcp/connect', methods=['POST'])
 def mcp_connect():
-    global mcp_server_process
-    if mcp_server_process and mcp_server_process.is_alive():
-        return jsonify({'status': 'already_connected'})
-
+    """Connects an additional MCP server. `name` defaults to the script's file name."""
     data = request.get_json()
     server_path = data.get('server_path')
     if not server_path:
         return jsonify({'error': 'server_path is required'}), 400
 
-    mcp_server_process = threading.Thread(target=start_mcp_server, args=(server_path,))
-    mcp_server_process.start()
+    try:
+        name = mcp_registry.connect(server_path, name=data.get('name'))
+    except ValueError as e:
+        if 'already connected' in str(e):
+            return jsonify({'status': 'already_connected', 'error': str(e)})
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify({'status': 'connecting', 'server': name})
+
+@app.route('/mcp/disconnect', methods=['POST'])
+def mcp_disconnect():
+    name = (request.get_json() or {}).get('name')
+    if not name:
+        return jsonify({'error': 'name is required'}), 400
+    if not mcp_registry.disconnect(name):
+        return jsonify({'error': f"No MCP server named '{name}'."}), 404
+    return jsonify({'status': 'disconnected', 'server': name})
 
-    return jsonify({'status': 'connecting'})
+@app.route('/mcp/health', methods=['GET'])
+def mcp_health():
+    """Connection state of every MCP server, including reconnect counts and the last successful ping."""
+    return jsonify(mcp_registry.health())
+
+def mcp_tools_response(catalog):
+    """The merged tool list plus each server's health and tool-call latency."""
+    return jsonify({
+        'tools': [{'name': tool['name'], 'description': tool['description'], 'server': tool['server']} for tool in catalog],
+        'servers': mcp_registry.health(),
+    })
 
 @app.route('/mcp/tools', methods=['GET'])
 def mcp_tools():
-    if not mcp_client.session:
-        return jsonify({'error': 'Not connected to an MCP server.'}), 400
+    if not mcp_registry.has_connected_servers():
+        return jsonify({'error': 'Not connected to an MCP server.', 'servers': mcp_registry.health()}), 400
     
     try:
-        tools = asyncio.run(mcp_client.list_tools())
-        tool_list = [{'name': tool.name, 'description': tool.description} for tool in tools]
-        return jsonify({'tools': tool_list})
+        return mcp_tools_response(mcp_registry.get_tool_catalog())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/mcp/tools/refresh', methods=['POST'])
+def mcp_refresh_tools():
+    """Re-fetches every server's tool catalog now instead of waiting for its TTL or a change notification."""
+    if not mcp_registry.has_connected_servers():
+        return jsonify({'error': 'Not connected to an MCP server.'}), 400
+    try:
+        return mcp_tools_response(mcp_registry.refresh_tool_catalogs())
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/mcp/call_tool', methods=['POST'])
 def mcp_call_tool():
-    if not mcp_client.session:
+    """
+    Calls one tool (`tool_name` as `mcp_<server>_<tool>`, plus `arguments`), or several at once
+    with `calls: [{tool_name, arguments}, ...]`, which run concurrently.
+    """
+    if not mcp_registry.has_connected_servers():
         return jsonify({'error': 'Not connected to an MCP server.'}), 400
 
     data = request.get_json()
+    calls = data.get('calls')
+    if calls:
+        if not all(call.get('tool_name') and call.get('arguments') is not None for call in calls):
+            return jsonify({'error': 'every call needs tool_name and arguments'}), 400
+        outcomes = mcp_registry.call_tools([(call['tool_name'], call['arguments']) for call in calls])
+        return jsonify({'results': [
+            {'error': str(outcome)} if isinstance(outcome, Exception) else {'result': outcome}
+            for outcome in outcomes
+        ]})
+
     tool_name = data.get('tool_name')
     arguments = data.get('arguments')
 
@@ -287,14 +627,14 @@ def mcp_call_tool():
         return jsonify({'error': 'tool_name and arguments are required'}), 400
 
     try:
-        result = asyncio.run(mcp_client.call_tool(tool_name, arguments))
+        result = mcp_registry.call_tool(tool_name, arguments)
         return jsonify({'result': result})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/autosci_status/<task_id>')
 def autosci_status(task_id):
-    task_info = autosci_tasks.get(task_id)
+    task_info = task_store.get_task(task_id)
     if not task_info:
         return jsonify({'error': 'Task not found'}), 404
     
@@ -304,16 +644,22 @@ def autosci_status(task_id):
     }
     if task_info['status'] == 'completed':
         response_data['result'] = task_info['result']
-    elif task_info['status'] == 'failed':
-        response_data['error'] = task_info['error']
+    elif task_info['status'] in ('failed', 'cancelled'):
+        response_data['error'] = task_info.get('error') or 'Unknown error occurred'
+    else:
+        response_data.update(autosci_running_status(task_id, task_info))
     
     return jsonify(response_data)
 
+recover_autosci_tasks()
+
 if __name__ == '__main__':
-    # Ensure graceful shutdown of the executor if the app is stopped.
+    # Ensure graceful shutdown of the scheduler if the app is stopped.
     try:
-        app.run(debug=True, use_reloader=False, port=4556) # use_reloader=False is important with ThreadPoolExecutor in debug mode
+        app.run(debug=True, use_reloader=False, port=4556) # use_reloader=False is important with the job scheduler in debug mode
     except KeyboardInterrupt:
-        print("Shutting down executor...")
-        executor.shutdown(wait=True)
-        print("Executor shutdown complete.") 
\ No newline at end of file
+        print("Shutting down scheduler...")
+        scheduler.shutdown(wait=True)
+        print("Scheduler shutdown complete.")
+        mcp_registry.close()
+        conversations.shutdown() 
\ No newline at end of file
@@ -0,0 +1,170 @@
+"""
+ASGI entry point: `uvicorn asgi:app --port 4556`.
+
+`/chat` and the AutoSCI event stream are served by async handlers whose LLM calls await the
+backend instead of blocking a thread, so one process can hold hundreds of slow conversations.
+Every other route, and the integrations that only have sync clients (weather, web search, Bible,
+CalDAV, Nextcloud, MCP, AutoSCI, the evolution solver), run on a bounded thread pool. The routes
+and their JSON contracts are the same as under `python app.py`.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route, request_response
+
+import app as flask_app  # Shares the Flask app's scheduler, task store, event bus and MCP registry
+import http_client
+import tracing
+from integrations import youtube
+from llm import async_get_ollama_response, async_stream_ollama_response, GENERATOR_MODEL_NAME
+from nlu import get_intent_and_entities_async
+from progress_events import FINAL_EVENTS
+
+ASGI_SYNC_WORKERS = int(os.getenv("ASGI_SYNC_WORKERS", "32"))  # Threads for sync integrations and Flask routes
+
+
+def stream_chat_response(chunks, on_complete=None, on_done=None) -> StreamingResponse:
+    """Async counterpart of app.stream_chat_response: NDJSON deltas followed by a final 'done' line."""
+    async def generate():
+        full_response = []
+        try:
+            async for chunk in chunks:
+                full_response.append(chunk)
+                yield json.dumps({'type': 'delta', 'content': chunk}) + "\n"
+        except Exception as e:
+            print(f"ASGI: Streaming response failed: {e}")
+            yield json.dumps({'type': 'error', 'error': str(e)}) + "\n"
+        else:
+            if on_complete:
+                on_complete("".join(full_response))
+        done = {'type': 'done', 'response': "".join(full_response)}
+        if on_done:
+            on_done(done)
+        yield json.dumps(done) + "\n"
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def request_client_id(request) -> str:
+    return request.headers.get('X-Client-Id') or (request.client.host if request.client else 'unknown')
+
+
+async def chat(request):
+    if request.method != 'POST':
+        return JSONResponse({'error': 'Method not allowed'}, status_code=405)
+    try:
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse({'error': 'Request body must be JSON'}, status_code=400)
+    user_message = payload.get('message')
+    if not user_message:
+        return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+    chat_trace = tracing.Trace('chat')  # See app.chat; asyncio.to_thread() carries it into the sync integrations
+    with chat_trace.activated():
+        # May re-fetch a stale MCP catalog, which blocks, so it runs on the thread pool.
+        mcp_tools_list = await asyncio.to_thread(flask_app.mcp_registry.get_tool_catalog)
+        current_message = flask_app.extract_current_message(user_message)
+        intent, entities = await get_intent_and_entities_async(current_message, mcp_tools=mcp_tools_list)
+        print(f"Intent: {intent}, Entities: {entities}")
+        context = flask_app.conversation_context(payload)
+        on_complete = lambda reply: flask_app.remember_exchange(payload, reply)
+        on_done = lambda done: flask_app.finish_chat_trace(chat_trace, intent, payload, done)
+
+        use_streaming = payload.get('stream', False)
+        video = flask_app.youtube_request(current_message) if intent == "query_youtube_video" else None
+        if flask_app.is_direct_generation(intent, payload):
+            flask_app.log_generation_path(intent, current_message, use_evolution=False)
+            llm_kwargs = flask_app.conversation_llm_kwargs(context)
+            if use_streaming:
+                chunks = async_stream_ollama_response(current_message, model_name=GENERATOR_MODEL_NAME, priority='interactive', **llm_kwargs)
+                return stream_chat_response(chat_trace.aiterate(chunks), on_complete, on_done)
+            reply = await async_get_ollama_response(current_message, model_name=GENERATOR_MODEL_NAME, priority='interactive', **llm_kwargs)
+            body, status, headers = {'response': reply}, 200, {}
+        elif video and use_streaming:
+            chunks = youtube.async_stream_youtube_query(video_id=video[0], question=video[1])
+            return stream_chat_response(chat_trace.aiterate(chunks), on_complete, on_done)
+        elif video:
+            with tracing.span('integration.youtube'):
+                reply = await youtube.async_handle_youtube_query(video_id=video[0], question=video[1])
+            body, status, headers = {'response': reply}, 200, {}
+        else:
+            # Everything else goes through the sync integrations on the bounded pool.
+            body, status, headers = await asyncio.to_thread(flask_app.chat_reply, payload, intent, entities, request_client_id(request), context)
+    if status == 200:
+        on_complete(body.get('response'))
+    on_done(body)
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+async def autosci_events(request):
+    """Async /autosci_events/<task_id>: same stream as the Flask route, without holding a thread per subscriber."""
+    task_id = request.path_params['task_id']
+    task_info = await asyncio.to_thread(flask_app.task_store.get_task, task_id)
+    if not task_info:
+        return JSONResponse({'error': 'Task not found'}, status_code=404)
+    last_event_id = flask_app.last_event_id_header(request.headers)
+
+    async def generate(task_info, last_event_id):
+        yield flask_app.sse_data(flask_app.autosci_snapshot(task_id, task_info))
+        while True:
+            event = flask_app.final_event(task_info)
+            if event:
+                yield flask_app.sse_data({'event': event[0], **event[1]})
+                return
+            records = await flask_app.progress_bus.async_wait_for_events(task_id, after_id=last_event_id, timeout=flask_app.SSE_KEEPALIVE_SECONDS)
+            for record in records:
+                last_event_id = record['id']
+                yield flask_app.format_sse(record)
+                if record['event'] in FINAL_EVENTS:
+                    return
+            if records:
+                continue
+            yield ": keep-alive\n\n"
+            task_info = await asyncio.to_thread(flask_app.task_store.get_task, task_id)
+            if not task_info:
+                return
+
+    return StreamingResponse(generate(task_info, last_event_id), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def with_cors(endpoint):
+    """Flask-CORS only covers the mounted Flask app, so the native routes get the same open policy here."""
+    return CORSMiddleware(request_response(endpoint), allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
+
+
+@asynccontextmanager
+async def lifespan(_):
+    # asyncio.to_thread() uses the loop's default executor; bound it so sync work cannot spawn unbounded threads.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASGI_SYNC_WORKERS, thread_name_prefix="asgi-sync")
+    )
+    yield
+    await http_client.close_async_client()
+    flask_app.scheduler.shutdown(wait=False)
+    flask_app.mcp_registry.close()
+    flask_app.conversations.shutdown()
+
+
+app = Starlette(
+    routes=[
+        # No `methods` on these: CORS preflight (OPTIONS) must reach the middleware.
+        Route('/chat', with_cors(chat)),
+        Route('/autosci_events/{task_id}', with_cors(autosci_events)),
+        Mount('/', app=WSGIMiddleware(flask_app.app, workers=ASGI_SYNC_WORKERS)),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=4556)
@@ -0,0 +1,148 @@
+"""
+End-to-end /chat benchmark that needs no GPU or network services.
+
+Starts the stub LLM server and the stub weather/search/Bible APIs, launches the app against them,
+then sends each scenario's request `--requests` times at `--concurrency` and reports per-scenario
+latency percentiles, throughput and the LLM and integration calls it took, as JSON:
+
+    python -m benchmarks.chat_benchmark --requests 20 --concurrency 4 --output bench.json
+
+Scenarios (`--scenarios`, comma-separated): direct, direct_stream, weather, search, bible,
+evolution and autosci. AutoSCI latency is measured until the queued task finishes. The stub
+replies are canned and depend only on the prompt, so the call counts are repeatable and two
+result files can be compared across commits.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.harness import LaunchedApp, StubBackends, git_commit, latency_summary, request_json, stream_chat
+from benchmarks.stub_llm_server import STUB_GENERATION_MS, STUB_PROMPT_EVAL_MS_PER_TOKEN, STUB_TOKENS_PER_SECOND
+from benchmarks.stub_services import STUB_SERVICE_LATENCY_MS
+
+AUTOSCI_POLL_SECONDS = 0.05
+AUTOSCI_FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+# name -> (/chat payload, how the reply is consumed). The messages are picked so the rule and
+# local NLU tiers route them without an LLM call where the intent is obvious.
+SCENARIOS = {
+    'direct': ({'message': "Can you explain how a rainbow forms?"}, 'json'),
+    'direct_stream': ({'message': "Can you explain how a rainbow forms?", 'stream': True}, 'stream'),
+    'weather': ({'message': "What's the weather in Paris?"}, 'json'),
+    'search': ({'message': "Search the web for solid-state batteries"}, 'json'),
+    'bible': ({'message': "Give me a bible verse"}, 'json'),
+    'evolution': ({'message': "How could a small town cut its energy bills?", 'use_evolution_mode': True}, 'json'),
+    'autosci': ({'message': "Start autosci mode", 'num_theories': 1}, 'autosci'),
+}
+
+
+def run_request(base_url: str, payload: dict, mode: str, client_id: str) -> dict:
+    """Sends one /chat request and returns {'ok', 'latency_ms', 'first_delta_ms'}."""
+    headers = {'X-Client-Id': client_id} # Keeps AutoSCI's per-client limit from rejecting the benchmark's own workers
+    start = time.perf_counter()
+    first_delta = None
+    if mode == 'stream':
+        status, first_delta, body = stream_chat(f"{base_url}/chat", payload, headers=headers)
+        ok = status == 200 and body.get('type') == 'done'
+    else:
+        status, body = request_json(f"{base_url}/chat", payload, headers=headers)
+        ok = status == 200 and 'response' in body
+        if ok and mode == 'autosci':
+            ok = wait_for_autosci(base_url, body.get('task_id'))
+    return {
+        'ok': ok,
+        'status': status,
+        'latency_ms': (time.perf_counter() - start) * 1000,
+        'first_delta_ms': first_delta * 1000 if first_delta is not None else None,
+    }
+
+
+def wait_for_autosci(base_url: str, task_id: str) -> bool:
+    while task_id:
+        status, body = request_json(f"{base_url}/autosci_task/{task_id}")
+        if status != 200:
+            return False
+        if body.get('status') in AUTOSCI_FINAL_STATUSES:
+            return body['status'] == 'completed'
+        time.sleep(AUTOSCI_POLL_SECONDS)
+    return False
+
+
+def run_scenario(app: LaunchedApp, backends: StubBackends, name: str, requests: int, concurrency: int, payload_overrides: dict) -> dict:
+    payload, mode = SCENARIOS[name]
+    payload = {**payload, **payload_overrides.get(name, {})}
+    backends.reset_stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda index: run_request(app.base_url, payload, mode, f"bench-{index % concurrency}"), range(requests)))
+    elapsed = time.perf_counter() - start
+    stats = backends.stats()
+
+    ok = [result for result in results if result['ok']]
+    summary = {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': requests - len(ok),
+        'status_codes': {str(code): sum(1 for result in results if result['status'] == code) for code in sorted({result['status'] for result in results})},
+        'throughput_rps': round(len(ok) / elapsed, 3) if elapsed else None,
+        **latency_summary([result['latency_ms'] for result in ok]),
+        'llm_calls': stats['llm']['requests'],
+        'llm_calls_per_request': round(stats['llm']['requests'] / requests, 2),
+        'llm_prompt_tokens': stats['llm']['prompt_tokens'],
+        'llm_completion_tokens': stats['llm']['completion_tokens'],
+        'integration_calls': {service: count for service, count in stats['services'].items() if count},
+    }
+    if mode == 'stream':
+        summary['first_delta'] = latency_summary([result['first_delta_ms'] for result in ok if result['first_delta_ms'] is not None])
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenario names")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight at once")
+    parser.add_argument("--server", choices=('flask', 'asgi'), default='flask', help="Serve the app with Flask (app.py) or uvicorn (asgi.py)")
+    parser.add_argument("--port", type=int, default=4599)
+    parser.add_argument("--llm-latency-ms", type=float, default=STUB_GENERATION_MS, help="Stub LLM fixed latency per completion")
+    parser.add_argument("--tokens-per-second", type=float, default=STUB_TOKENS_PER_SECOND, help="Stub LLM decode speed (0: instant)")
+    parser.add_argument("--prompt-eval-ms-per-token", type=float, default=STUB_PROMPT_EVAL_MS_PER_TOKEN, help="Stub LLM prefill cost per uncached token")
+    parser.add_argument("--service-latency-ms", type=float, default=STUB_SERVICE_LATENCY_MS, help="Stub weather/search/Bible latency")
+    parser.add_argument("--evolution-steps", type=int, default=3, help="max_steps sent with the evolution scenario")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+    payload_overrides = {'evolution': {'evolution_options': {'max_steps': args.evolution_steps}}}
+
+    backends = StubBackends(args.llm_latency_ms, args.tokens_per_second, args.prompt_eval_ms_per_token, args.service_latency_ms)
+    app = LaunchedApp(backends, server=args.server, port=args.port)
+    try:
+        scenarios = {}
+        for name in names:
+            print(f"Benchmark: running '{name}' ({args.requests} requests, concurrency {args.concurrency})...", file=sys.stderr)
+            scenarios[name] = run_scenario(app, backends, name, args.requests, args.concurrency, payload_overrides)
+    finally:
+        app.stop()
+        backends.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'scenarios')},
+        'scenarios': scenarios,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
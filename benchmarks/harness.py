@@ -0,0 +1,165 @@
+"""
+Shared pieces of the /chat benchmarks: starting the stub backends, launching the app against
+them in a subprocess, a small HTTP client and latency summaries.
+
+The app still loads `.env` and runs its license check at startup as usual; everything it calls
+afterwards (LLM, weather, search, Bible) is served by the local stubs.
+"""
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.stub_llm_server import start_stub_server
+from benchmarks.stub_services import service_env, start_stub_services
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_STARTUP_TIMEOUT = 60  # Seconds to wait for a launched app to answer
+# How the launched app is served: the Flask server `python app.py` uses (threaded), or asgi.py under uvicorn.
+SERVER_COMMANDS = {
+    'flask': lambda port: [sys.executable, "-c",
+                           f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True, debug=False, use_reloader=False)"],
+    'asgi': lambda port: [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+}
+
+
+class StubBackends:
+    """The stub LLM server and stub integration APIs, plus the environment that points the app at them."""
+
+    def __init__(self, generation_ms: float, tokens_per_second: float, prompt_eval_ms_per_token: float, service_latency_ms: float):
+        self.llm = start_stub_server(generation_ms=generation_ms, tokens_per_second=tokens_per_second, ms_per_token=prompt_eval_ms_per_token)
+        self.services = start_stub_services(latency_ms=service_latency_ms)
+        self.llm_url = f"http://127.0.0.1:{self.llm.server_address[1]}"
+        self.services_url = f"http://127.0.0.1:{self.services.server_address[1]}"
+
+    def app_env(self, workdir: str) -> dict:
+        return {
+            'OLLAMA_API_URL': self.llm_url,
+            'GEN_MODEL_BACKENDS': self.llm_url,
+            'THINK_MODEL_BACKENDS': self.llm_url,
+            'GEN_MODEL': 'stub-generator',
+            'THINK_MODEL': 'stub-thinker',
+            # Keep benchmark tasks and geocodes out of the real stores; each launch starts with cold caches.
+            'AUTOSCI_DB_PATH': os.path.join(workdir, "autosci_tasks.db"),
+            'WEATHER_GEOCODE_DB_PATH': os.path.join(workdir, "weather_geocode.db"),
+            **service_env(self.services),
+        }
+
+    def reset_stats(self):
+        request_json(f"{self.llm_url}/stats/reset", {})
+        request_json(f"{self.services_url}/stats/reset", {})
+
+    def stats(self) -> dict:
+        return {'llm': request_json(f"{self.llm_url}/stats")[1], 'services': request_json(f"{self.services_url}/stats")[1]}
+
+    def shutdown(self):
+        self.llm.shutdown()
+        self.services.shutdown()
+
+
+class LaunchedApp:
+    """The app running in a subprocess against the stubs. Its output goes to `log_path`."""
+
+    def __init__(self, backends: StubBackends, server: str = 'flask', port: int = 4599, extra_env: dict = None):
+        self.workdir = tempfile.mkdtemp(prefix="samantha-bench-")
+        self.log_path = os.path.join(self.workdir, "app.log")
+        self.base_url = f"http://127.0.0.1:{port}"
+        env = {**os.environ, **backends.app_env(self.workdir), **(extra_env or {})}
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(SERVER_COMMANDS[server](port), cwd=REPO_ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        self._wait_until_ready()
+
+    def _wait_until_ready(self):
+        deadline = time.monotonic() + APP_STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"The app exited with code {self.process.returncode} during startup; see {self.log_path}")
+            try:
+                if request_json(f"{self.base_url}/llm/stats", timeout=2)[0] == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.25)
+        self.stop()
+        raise RuntimeError(f"The app did not answer within {APP_STARTUP_TIMEOUT} s; see {self.log_path}")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._log.close()
+
+
+def request_json(url: str, payload: dict = None, headers: dict = None, timeout: float = 300, method: str = None) -> tuple[int, dict]:
+    """GETs (or POSTs `payload` as JSON) and returns (status, decoded body). HTTP errors are returned, not raised."""
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers={'Content-Type': 'application/json', **(headers or {})})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, _decode(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, _decode(e.read())
+
+
+def stream_chat(url: str, payload: dict, headers: dict = None, timeout: float = 300) -> tuple[int, float, dict]:
+    """POSTs a streaming /chat request and reads the NDJSON reply. Returns (status, seconds to first delta, final line)."""
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), headers={'Content-Type': 'application/json', **(headers or {})})
+    start = time.perf_counter()
+    first_delta, last = None, {}
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            for line in response:
+                if not line.strip():
+                    continue
+                last = json.loads(line)
+                if first_delta is None and last.get('type') == 'delta':
+                    first_delta = time.perf_counter() - start
+            return response.status, first_delta, last
+    except urllib.error.HTTPError as e:
+        return e.code, first_delta, _decode(e.read())
+
+
+def _decode(body: bytes) -> dict:
+    try:
+        return json.loads(body or b"{}")
+    except ValueError:
+        return {'raw': body.decode("utf-8", "replace")}
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies_ms: list) -> dict:
+    values = sorted(latencies_ms)
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'mean_ms': None, 'max_ms': None}
+    return {
+        'p50_ms': round(percentile(values, 0.50), 2),
+        'p95_ms': round(percentile(values, 0.95), 2),
+        'p99_ms': round(percentile(values, 0.99), 2),
+        'mean_ms': round(sum(values) / len(values), 2),
+        'max_ms': round(values[-1], 2),
+    }
+
+
+def git_commit() -> str:
+    """The commit being measured (with a '-dirty' suffix for uncommitted changes), or None outside a checkout."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,258 @@
+"""
+Load generator and capacity report for /chat.
+
+Replays a weighted mix of chat scenarios (see chat_benchmark.SCENARIOS) at a target request rate
+that steps up stage by stage, and reports for each stage the achieved throughput, latency
+percentiles, error rate, client-side concurrency and the server's queue depth (the LLM router and
+AutoSCI scheduler gauges, scraped from `/metrics`). The first stage that misses the offered rate, breaks the p95 objective or exceeds
+the error budget is the saturation point; the stage before it is the sustainable capacity.
+
+Arrivals are open-loop: requests go out on schedule whether or not earlier ones have finished,
+and latency is measured from the scheduled send time, so queueing in front of a saturated server
+shows up in the numbers instead of silently slowing the generator down.
+
+    python -m benchmarks.load_test --rates 1,2,4,8,16 --stage-seconds 20 --mix direct=6,weather=2,search=1,evolution=1
+    python -m benchmarks.load_test --url http://127.0.0.1:4556 ...  # an already running instance
+
+Without `--url` the app is launched against the stub LLM and integration servers (benchmarks/harness.py),
+so the test runs on a CPU-only machine; the stub flags shape the simulated backend.
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.chat_benchmark import SCENARIOS, run_request
+from benchmarks.harness import LaunchedApp, StubBackends, git_commit, latency_summary, request_json
+from benchmarks.stub_llm_server import STUB_GENERATION_MS, STUB_PROMPT_EVAL_MS_PER_TOKEN, STUB_TOKENS_PER_SECOND
+from benchmarks.stub_services import STUB_SERVICE_LATENCY_MS
+from tracing import METRIC_PREFIX
+
+DEFAULT_MIX = "direct=6,direct_stream=2,weather=2,search=1,bible=1"
+MIN_THROUGHPUT_RATIO = 0.9  # A stage is saturated once it completes less than this share of the offered rate
+QUEUE_GAUGES = ('llm_in_flight', 'llm_waiting', 'scheduler_queued', 'scheduler_running')  # Sampled from /metrics
+
+
+def parse_mix(text: str) -> list[tuple[str, float]]:
+    """'direct=6,weather=2' -> [('direct', 6.0), ('weather', 2.0)]."""
+    mix = []
+    for part in text.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in SCENARIOS:
+            raise ValueError(f"unknown scenario '{name}' (choose from {', '.join(SCENARIOS)})")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def scrape_gauges(base_url: str, timeout: float) -> dict:
+    """Reads /metrics and returns the queue gauges, summed over their labels except the scheduler state."""
+    with urllib.request.urlopen(f"{base_url}/metrics", timeout=timeout) as response:
+        text = response.read().decode("utf-8")
+    gauges = dict.fromkeys(QUEUE_GAUGES, 0.0)
+    for line in text.splitlines():
+        if line.startswith("#") or not line.strip():
+            continue
+        series, _, value = line.rpartition(" ")
+        name = series.split("{")[0].removeprefix(METRIC_PREFIX)
+        if name == 'scheduler_jobs':
+            name = 'scheduler_queued' if 'state="queued"' in series else 'scheduler_running'
+        if name in gauges:
+            gauges[name] += float(value)
+    return gauges
+
+
+class QueueSampler:
+    """Scrapes /metrics in the background and keeps the LLM and AutoSCI queue gauges over time."""
+
+    def __init__(self, base_url: str, interval: float):
+        self.base_url = base_url
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="queue-sampler")
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.samples.append(scrape_gauges(self.base_url, timeout=self.interval * 4))
+            except (OSError, ValueError):
+                continue # A saturated server may not answer the scrape in time; skip the sample
+
+    def stop(self) -> dict:
+        """Mean and max of each gauge over the stage, e.g. {'llm_waiting_mean': 1.5, 'llm_waiting_max': 4}."""
+        self._stop.set()
+        self._thread.join()
+        summary = {}
+        for name in QUEUE_GAUGES:
+            values = [sample[name] for sample in self.samples]
+            summary[f"{name}_mean"] = round(sum(values) / len(values), 2) if values else None
+            summary[f"{name}_max"] = max(values) if values else None
+        return summary
+
+
+def run_stage(base_url: str, rate: float, seconds: float, mix: list, rng: random.Random, args) -> dict:
+    """Sends requests at `rate` per second for `seconds`, waits for them to finish and summarises the stage."""
+    names, weights = zip(*mix)
+    count = max(1, int(rate * seconds))
+    results = []
+    lock = threading.Lock()
+    in_flight = [0, 0]  # current, peak
+
+    def send(index: int, name: str, scheduled: float):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+        payload, mode = SCENARIOS[name]
+        try:
+            result = run_request(base_url, payload, mode, f"load-{index % args.clients}")
+        except OSError as e: # Connection refused/reset or timeout: the server is past its limit
+            result = {'ok': False, 'status': type(e).__name__}
+        finished = time.perf_counter()
+        with lock:
+            in_flight[0] -= 1
+            results.append({**result, 'scenario': name, 'latency_ms': (finished - scheduled) * 1000, 'finished': finished})
+
+    sampler = QueueSampler(base_url, args.sample_interval)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.max_in_flight) as pool:
+        next_send = start
+        for index in range(count):
+            delay = next_send - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, index, rng.choices(names, weights)[0], next_send)
+            next_send += rng.expovariate(rate) if args.arrivals == 'poisson' else 1 / rate
+    queue = sampler.stop()
+
+    ok = [result for result in results if result['ok']]
+    # Completions over at least the stage length, so a lucky early burst cannot read above the offered rate.
+    window = max(seconds, max(result['finished'] for result in results) - start)
+    errors = len(results) - len(ok)
+    return {
+        'offered_rps': rate,
+        'requests': len(results),
+        'achieved_rps': round(len(ok) / window, 3),
+        'error_rate': round(errors / len(results), 4),
+        'errors_by_status': {str(status): sum(1 for result in results if not result['ok'] and result['status'] == status)
+                             for status in sorted({str(result['status']) for result in results if not result['ok']})},
+        **latency_summary([result['latency_ms'] for result in ok]),
+        'client_in_flight_peak': in_flight[1],
+        **queue,
+        'by_scenario': {
+            name: {'requests': sum(1 for result in results if result['scenario'] == name),
+                   **latency_summary([result['latency_ms'] for result in ok if result['scenario'] == name])}
+            for name in names if any(result['scenario'] == name for result in results)
+        },
+    }
+
+
+def saturation_reason(stage: dict, args) -> str:
+    """Why the stage counts as saturated, or None if the server kept up."""
+    if stage['error_rate'] > args.max_error_rate:
+        return f"error rate {stage['error_rate']:.1%} > {args.max_error_rate:.1%}"
+    if stage['p95_ms'] is None or stage['p95_ms'] > args.slo_p95_ms:
+        return f"p95 {stage['p95_ms']} ms > {args.slo_p95_ms:.0f} ms"
+    if stage['achieved_rps'] is None or stage['achieved_rps'] < MIN_THROUGHPUT_RATIO * stage['offered_rps']:
+        return f"throughput {stage['achieved_rps']} rps < {MIN_THROUGHPUT_RATIO:.0%} of {stage['offered_rps']} rps offered"
+    return None
+
+
+def _cell(value) -> str:
+    return '-' if value is None else f"{value:g}"
+
+
+def print_curve(stages: list):
+    print(f"{'offered':>8} {'achieved':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7} {'in flight':>9} {'llm wait':>9} {'jobs queued':>11}", file=sys.stderr)
+    for stage in stages:
+        cells = [f"{stage['offered_rps']:>8.2f}", f"{stage['achieved_rps'] or 0:>9.2f}"]
+        cells += [f"{stage[key]:>9.0f}" if stage[key] is not None else f"{'-':>9}" for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        cells += [f"{stage['error_rate']:>7.1%}", f"{stage['client_in_flight_peak']:>9}", f"{_cell(stage['llm_waiting_mean']):>9}", f"{_cell(stage['scheduler_queued_mean']):>11}"]
+        print(" ".join(cells) + ("  <- saturated: " + stage['saturated'] if stage['saturated'] else ""), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", help="Base URL of a running instance; omit to launch one against the stub backends")
+    parser.add_argument("--server", choices=('flask', 'asgi'), default='flask', help="How a launched instance is served")
+    parser.add_argument("--port", type=int, default=4599, help="Port of a launched instance")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Weighted scenarios, e.g. direct=6,weather=2,evolution=1")
+    parser.add_argument("--rates", default="1,2,4,8,16,32", help="Offered requests per second for each stage")
+    parser.add_argument("--stage-seconds", type=float, default=20)
+    parser.add_argument("--arrivals", choices=('uniform', 'poisson'), default='poisson')
+    parser.add_argument("--seed", type=int, default=1, help="Seeds the scenario mix and Poisson arrivals")
+    parser.add_argument("--max-in-flight", type=int, default=512, help="Client-side cap on concurrent requests")
+    parser.add_argument("--clients", type=int, default=64, help="Distinct X-Client-Id values the requests are spread over")
+    parser.add_argument("--slo-p95-ms", type=float, default=5000, help="p95 latency objective")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Seconds between /metrics scrapes")
+    parser.add_argument("--keep-going", action="store_true", help="Run every stage instead of stopping at saturation")
+    parser.add_argument("--llm-latency-ms", type=float, default=STUB_GENERATION_MS)
+    parser.add_argument("--tokens-per-second", type=float, default=STUB_TOKENS_PER_SECOND)
+    parser.add_argument("--prompt-eval-ms-per-token", type=float, default=STUB_PROMPT_EVAL_MS_PER_TOKEN)
+    parser.add_argument("--service-latency-ms", type=float, default=STUB_SERVICE_LATENCY_MS)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    try:
+        mix = parse_mix(args.mix)
+        rates = [float(rate) for rate in args.rates.split(",")]
+    except ValueError as e:
+        parser.error(str(e))
+
+    backends = app = None
+    base_url = args.url.rstrip("/") if args.url else None
+    if not base_url:
+        backends = StubBackends(args.llm_latency_ms, args.tokens_per_second, args.prompt_eval_ms_per_token, args.service_latency_ms)
+        app = LaunchedApp(backends, server=args.server, port=args.port)
+        base_url = app.base_url
+
+    rng = random.Random(args.seed)
+    stages = []
+    try:
+        for rate in rates:
+            print(f"Load test: {rate} req/s for {args.stage_seconds:.0f} s...", file=sys.stderr)
+            stage = run_stage(base_url, rate, args.stage_seconds, mix, rng, args)
+            stage['saturated'] = saturation_reason(stage, args)
+            stages.append(stage)
+            if stage['saturated'] and not args.keep_going:
+                break
+    finally:
+        if app:
+            app.stop()
+            backends.shutdown()
+
+    saturated = next((stage for stage in stages if stage['saturated']), None)
+    sustained = stages[:stages.index(saturated)] if saturated else stages
+    summary = {
+        'max_sustained_rps': sustained[-1]['achieved_rps'] if sustained else None,
+        'p95_ms_at_max_sustained': sustained[-1]['p95_ms'] if sustained else None,
+        'saturation_offered_rps': saturated['offered_rps'] if saturated else None,
+        'saturation_reason': saturated['saturated'] if saturated else None,
+    }
+    print_curve(stages)
+    if saturated:
+        sustained_text = f"max sustained {summary['max_sustained_rps']} req/s" if sustained else "already at the first stage; lower --rates"
+        print(f"Load test: saturated at {saturated['offered_rps']:g} req/s offered ({saturated['saturated']}); {sustained_text}", file=sys.stderr)
+    else:
+        print(f"Load test: no saturation up to {stages[-1]['offered_rps']:g} req/s; raise --rates to find the limit", file=sys.stderr)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        'target': args.url or f"launched ({args.server}, stub backends)",
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'url')},
+        'summary': summary,
+        'stages': stages,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
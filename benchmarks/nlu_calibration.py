@@ -0,0 +1,110 @@
+"""
+Calibrates the local NLU tier (intent_classifier.LocalIntentClassifier): scores a labeled set of
+held-out messages, none of which are INTENT_DEFINITIONS examples, and reports for each confidence
+threshold how many messages the local tier would answer without the LLM, and how many of those it
+would get wrong. NLU_LOCAL_CONFIDENCE_THRESHOLD defaults to the lowest threshold with no wrong
+answers on this set.
+
+    python -m benchmarks.nlu_calibration
+
+Run it from the repository root (nlu.py imports llm.py, which loads `.env`).
+"""
+import argparse
+
+from intent_classifier import LOCAL_CONFIDENCE_THRESHOLD, LOCAL_MIN_MARGIN, LocalIntentClassifier
+from nlu import INTENT_DEFINITIONS
+
+# (message, the intent it should get). Only entity-less intents can be answered locally; every
+# other message must escalate, so a local answer for it counts as wrong whatever the intent.
+LABELED_MESSAGES = [
+    ("hi how are you", "casual_chat"),
+    ("What is your name?", "casual_chat"),
+    ("hello there, how's it going?", "casual_chat"),
+    ("thanks a lot!", "casual_chat"),
+    ("who are you exactly?", "casual_chat"),
+    ("good night samantha", "casual_chat"),
+    ("how are you doing this evening?", "casual_chat"),
+    ("pleased to meet you", "casual_chat"),
+    ("good morning, how are you", "casual_chat"),
+    ("what's up", "casual_chat"),
+    ("who made you?", "casual_chat"),
+    ("thanks for the help", "casual_chat"),
+    ("hey samantha, how are you?", "casual_chat"),
+    ("tell me a bit about yourself", "casual_chat"),
+    ("are you a robot?", "casual_chat"),
+    ("good evening", "casual_chat"),
+    ("how is your day going?", "casual_chat"),
+    ("I appreciate it, thanks", "casual_chat"),
+    ("what are you able to do?", "casual_chat"),
+    ("thank you, that helped", "casual_chat"),
+    ("Who is the CEO of Apple?", "search_web"),
+    ("What is a neural network?", "search_web"),
+    ("how are neural networks trained?", "search_web"),
+    ("What is the capital of France?", "search_web"),
+    ("What is the name of the largest ocean?", "search_web"),
+    ("Who are the Beatles?", "search_web"),
+    ("who won the world cup in 2018?", "search_web"),
+    ("Search for cheap flights to Rome", "search_web"),
+    ("How are you supposed to cook rice?", "search_web"),
+    ("Tell me something interesting about octopuses.", "search_web"),
+    ("What is your opinion on nuclear power?", "search_web"),
+    ("what are good names for a cat?", "search_web"),
+    ("Thanks to inflation, what should I invest in?", "search_web"),
+    ("How do I convert a list to a dict in Python?", "search_web"),
+    ("What's the weather like in Berlin tomorrow?", "get_weather"),
+    ("good morning! what's the weather in Oslo?", "get_weather"),
+    ("Do I have any meetings on Friday?", "get_calendar_events"),
+    ("What's on my calendar this week?", "get_calendar_events"),
+    ("list my files on nextcloud", "nextcloud_list_files"),
+    ("Read me a verse from the bible", "get_bible_verse"),
+    ("let's make a scientific discovery about black holes", "autosci_mode"),
+    ("activate autosci", "autosci_mode"),
+]
+
+
+def calibrate(classifier: LocalIntentClassifier, messages: list, thresholds: list, margin: float) -> list[dict]:
+    """For each threshold, the messages the local tier would answer and how many of those are wrong."""
+    scored = []
+    for message, expected in messages:
+        intent, confidence, intent_margin = classifier.predict(message)
+        local_ok = intent in classifier.local_intents and intent_margin >= margin
+        scored.append((intent if local_ok else None, confidence, expected))
+    rows = []
+    for threshold in thresholds:
+        answered = [(intent, expected) for intent, confidence, expected in scored if intent and confidence >= threshold]
+        rows.append({
+            'threshold': threshold,
+            'answered': len(answered),
+            'wrong': sum(1 for intent, expected in answered if intent != expected),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--margin", type=float, default=LOCAL_MIN_MARGIN, help="Minimum margin over the runner-up intent")
+    parser.add_argument("--verbose", action="store_true", help="Print the prediction for every message")
+    args = parser.parse_args()
+
+    classifier = LocalIntentClassifier(INTENT_DEFINITIONS)
+    if args.verbose:
+        for message, expected in LABELED_MESSAGES:
+            intent, confidence, margin = classifier.predict(message)
+            print(f"{expected:22} {intent or '-':22} {confidence:.3f} {margin:.3f}  {message}")
+        print()
+
+    local_messages = sum(1 for _, expected in LABELED_MESSAGES if expected in classifier.local_intents)
+    thresholds = [round(0.30 + 0.05 * step, 2) for step in range(14)]
+    rows = calibrate(classifier, LABELED_MESSAGES, thresholds, args.margin)
+    print(f"{len(LABELED_MESSAGES)} messages, {local_messages} answerable locally, margin {args.margin}")
+    print(f"{'threshold':>9} {'answered':>8} {'wrong':>5}")
+    for row in rows:
+        print(f"{row['threshold']:>9.2f} {row['answered']:>8} {row['wrong']:>5}")
+    safe = [row for row in rows if not row['wrong']]
+    if safe:
+        print(f"Lowest threshold with no wrong answers: {safe[0]['threshold']:.2f} "
+              f"({safe[0]['answered']}/{local_messages} answered locally); configured: {LOCAL_CONFIDENCE_THRESHOLD}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Prompt-prefix benchmark: compares the prompt-eval time of the old single-message prompts with the
+stable system prefix + short user message layout, against the local stub server in
+benchmarks/stub_llm_server.py.
+
+The workload interleaves NLU classifications with evolution steps, as live chat traffic does
+while an evolution run is in progress. The stub reports how many prompt tokens it could serve from
+its simulated KV cache and how long the rest took to evaluate.
+
+    python -m benchmarks.prompt_prefix --steps 42
+
+Run it from the repository root: llm.py still loads `.env`, but the backend URL is pointed at
+the stub (models default to stub names if GEN_MODEL / THINK_MODEL are unset).
+"""
+import argparse
+import os
+import statistics
+import time
+
+from benchmarks.stub_llm_server import PromptCacheSimulator, start_stub_server
+
+SAMPLE_MESSAGES = [
+    "Can you remind me what we talked about yesterday?",
+    "What's a good way to learn the cello as an adult?",
+    "Summarize the plot of Moby Dick in two sentences.",
+    "Do I have anything on my calendar this afternoon?",
+    "Find me recent research on solid-state batteries.",
+    "Write a haiku about autumn rain.",
+    "How do I convert a list of tuples to a dict in Python?",
+    "Tell me something interesting about octopuses.",
+]
+
+SAMPLE_QUERY = "Design a low-cost way to keep a small greenhouse warm through a northern winter."
+SAMPLE_APPROACH = "Store daytime solar heat in thermal mass and release it at night."
+
+
+def legacy_nlu_prompt(system_prompt: str, user_prompt: str) -> str:
+    """The pre-prefix layout: instructions, then the message, then a closing instruction, in one user message."""
+    return f"{system_prompt}\n---\n{user_prompt}\n---\n\nNow, provide the JSON output based on the user's message.\n"
+
+
+def legacy_evolution_prompt(user_query: str, selected_approach: str, current_solution: str) -> str:
+    """The pre-prefix evolution prompt, with the instructions after the changing solution."""
+    return (
+        f"The user's original query is: \"{user_query}\".\n"
+        f"The overall guiding approach is: \"{selected_approach}\".\n"
+        f"The current version of the proposed solution/answer is:\n\"{current_solution}\"\n\n"
+        f"Please critically evaluate and refine this current version to make it a more complete, accurate, and helpful final answer to the user's original query. "
+        f"Incorporate any necessary details, improve clarity, and ensure it fully addresses the query. "
+        f"Your output should be the new, improved version of the solution/answer."
+    )
+
+
+def run_workload(base_url: str, layout: str, steps: int) -> list[float]:
+    """Runs `steps` rounds of one NLU call plus one evolution step. Returns per-call latencies in ms."""
+    import http_client
+    import nlu
+    import problem_solver
+    from llm import _chat_payload, THINKER_MODEL_NAME
+
+    nlu_system, _ = nlu._get_llm_nlu_request([], nlu._sync_intent_set([]))
+    evolution_system = problem_solver._evolution_system_prompt(SAMPLE_QUERY, SAMPLE_APPROACH)
+    solution = SAMPLE_APPROACH
+    latencies = []
+
+    def post(prompt: str, system: str = None) -> str:
+        payload = _chat_payload(prompt, THINKER_MODEL_NAME, stream=False, system=system)
+        if layout == 'legacy':
+            payload.pop('keep_alive') # The old payloads relied on the backend's default
+        start = time.perf_counter()
+        response = http_client.post_json(f"{base_url}/chat/completions", payload)
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+        return response.json()['choices'][0]['message']['content']
+
+    for step in range(steps):
+        user_prompt = nlu._build_llm_nlu_prompt(SAMPLE_MESSAGES[step % len(SAMPLE_MESSAGES)])
+        evolution_prompt = f"The current version of the proposed solution/answer is:\n\"{solution}\""
+        if layout == 'legacy':
+            post(legacy_nlu_prompt(nlu_system, user_prompt))
+            solution = post(legacy_evolution_prompt(SAMPLE_QUERY, SAMPLE_APPROACH, solution))
+        else:
+            post(user_prompt, system=nlu_system)
+            solution = post(evolution_prompt, system=evolution_system)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--steps", type=int, default=42, help="Evolution steps (each paired with one NLU call)")
+    args = parser.parse_args()
+
+    stub = start_stub_server()
+    base_url = f"http://127.0.0.1:{stub.server_address[1]}"
+    # llm.py reads these at import; load_dotenv() does not override variables that are already set.
+    os.environ['OLLAMA_API_URL'] = base_url
+    os.environ['GEN_MODEL_BACKENDS'] = base_url
+    os.environ['THINK_MODEL_BACKENDS'] = base_url
+    os.environ.setdefault('GEN_MODEL', 'stub-generator')
+    os.environ.setdefault('THINK_MODEL', 'stub-thinker')
+
+    results = {}
+    for layout in ('legacy', 'prefix'):
+        stub.simulator = PromptCacheSimulator() # Fresh, empty cache for each layout
+        latencies = run_workload(base_url, layout, args.steps)
+        results[layout] = (dict(stub.simulator.stats), latencies)
+
+    print(f"{'layout':<8} {'calls':>6} {'prompt tok':>11} {'cached':>7} {'prompt eval ms':>15} {'eval ms/call':>13} {'p50 ms':>8}")
+    for layout, (stats, latencies) in results.items():
+        cached_share = stats['cached_tokens'] / stats['prompt_tokens'] if stats['prompt_tokens'] else 0.0
+        print(f"{layout:<8} {stats['requests']:>6} {stats['prompt_tokens']:>11} {cached_share:>6.0%} "
+              f"{stats['prompt_eval_ms']:>15.0f} {stats['prompt_eval_ms'] / max(1, stats['requests']):>13.1f} "
+              f"{statistics.median(latencies):>8.1f}")
+    before, after = results['legacy'][0]['prompt_eval_ms'], results['prefix'][0]['prompt_eval_ms']
+    if after:
+        print(f"Prompt-eval time: {before / after:.1f}x less with the stable prefix layout.")
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
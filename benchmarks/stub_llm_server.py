@@ -0,0 +1,239 @@
+"""
+A local OpenAI-compatible `/chat/completions` stub for benchmarks.
+
+It does not run a model. Instead it simulates the cost that matters for prompt layout: like
+Ollama/llama.cpp it keeps the KV cache of the last few prompts (one per slot) and only "evaluates"
+the part of a new prompt that does not share a prefix with one of them, sleeping
+STUB_PROMPT_EVAL_MS_PER_TOKEN for each uncached token. A slot is dropped once the model's
+`keep_alive` expires, as if the model had been unloaded. Decoding costs STUB_GENERATION_MS plus
+one token per 1/STUB_TOKENS_PER_SECOND (streamed deltas are paced the same way). Cumulative
+counters are served at `GET /stats` and cleared with `POST /stats/reset`.
+
+Replies are canned and depend only on the prompt, so runs are repeatable: schema-shaped JSON for
+NLU, numbered lists for the idea and prototype prompts, "1" for judge and score prompts, and a
+revision for anything else.
+
+Run standalone with `python -m benchmarks.stub_llm_server --port 11500`.
+"""
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_PROMPT_EVAL_MS_PER_TOKEN = float(os.getenv("STUB_PROMPT_EVAL_MS_PER_TOKEN", "0.5"))  # Simulated prefill cost
+STUB_GENERATION_MS = float(os.getenv("STUB_GENERATION_MS", "20"))  # Simulated fixed decode overhead per completion
+STUB_TOKENS_PER_SECOND = float(os.getenv("STUB_TOKENS_PER_SECOND", "0"))  # Simulated decode throughput; 0 means instant
+STUB_CACHE_SLOTS = int(os.getenv("STUB_CACHE_SLOTS", "4"))  # Prompts whose KV cache is kept (cf. OLLAMA_NUM_PARALLEL)
+STUB_DEFAULT_KEEP_ALIVE = 300  # Seconds, Ollama's default when a request sends no keep_alive
+CHARS_PER_TOKEN = 4
+
+
+def parse_keep_alive(value) -> float:
+    """Ollama accepts seconds as a number or a duration string such as '30m'."""
+    if value is None:
+        return STUB_DEFAULT_KEEP_ALIVE
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"\s*(-?\d+(?:\.\d+)?)\s*([smh]?)\s*", str(value))
+    if not match:
+        return STUB_DEFAULT_KEEP_ALIVE
+    return float(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[match.group(2)]
+
+
+def render_messages(messages: list) -> str:
+    """Flattens a chat the way a chat template would, so message order decides what is a prefix."""
+    return "".join(f"<|{message.get('role', 'user')}|>\n{message.get('content', '')}\n" for message in messages)
+
+
+def common_prefix_length(a: str, b: str) -> int:
+    limit = min(len(a), len(b))
+    index = 0
+    while index < limit and a[index] == b[index]:
+        index += 1
+    return index
+
+
+class PromptCacheSimulator:
+    """Per-model prompt cache slots with keep_alive expiry, plus prompt-eval counters."""
+
+    def __init__(self, slots: int = STUB_CACHE_SLOTS, ms_per_token: float = STUB_PROMPT_EVAL_MS_PER_TOKEN):
+        self.slots = slots
+        self.ms_per_token = ms_per_token
+        self._lock = threading.Lock()
+        self._cache = {}  # model -> list of (rendered prompt, expires_at), most recent last
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'prompt_eval_ms': 0.0, 'completion_tokens': 0}
+
+    def evaluate(self, model: str, rendered: str, keep_alive: float) -> tuple[int, int, float]:
+        """Returns (prompt_tokens, cached_tokens, prompt_eval_ms) and stores the prompt in a slot."""
+        now = time.monotonic()
+        with self._lock:
+            entries = [entry for entry in self._cache.get(model, []) if entry[1] > now]
+            cached_chars = max((common_prefix_length(rendered, prompt) for prompt, _ in entries), default=0)
+            entries = [entry for entry in entries if entry[0] != rendered]
+            entries.append((rendered, now + keep_alive))
+            self._cache[model] = entries[-self.slots:]
+
+            prompt_tokens = max(1, len(rendered) // CHARS_PER_TOKEN)
+            cached_tokens = min(prompt_tokens, cached_chars // CHARS_PER_TOKEN)
+            eval_ms = (prompt_tokens - cached_tokens) * self.ms_per_token
+            self.stats['requests'] += 1
+            self.stats['prompt_tokens'] += prompt_tokens
+            self.stats['cached_tokens'] += cached_tokens
+            self.stats['prompt_eval_ms'] += eval_ms
+        return prompt_tokens, cached_tokens, eval_ms
+
+
+# Distinct words for list items, so the prototype de-duplication keeps them apart.
+LIST_ITEM_WORDS = (
+    "thermal", "modular", "solar", "insulated", "layered", "passive", "automated", "compact", "hybrid", "reclaimed",
+    "portable", "seasonal", "buried", "reflective", "zoned", "vented", "stacked", "sealed", "mirrored", "tiered",
+)
+
+
+def numbered_list(count: int, label: str) -> str:
+    words = LIST_ITEM_WORDS
+    return "\n".join(
+        f"{index}. {label} {index}: {words[index % len(words)]} and {words[(index * 7 + 3) % len(words)]} variant"
+        for index in range(1, count + 1)
+    )
+
+
+def stub_classification(text: str) -> dict:
+    """NLU answer for the quoted user message: web searches are recognised, everything else is small talk."""
+    match = re.search(r'User message: "(.*)"', text, re.DOTALL)
+    message = match.group(1) if match else ""
+    search = re.search(r"\bsearch\b(?: the web)?(?: for)?\s+(.+)", message, re.IGNORECASE)
+    if search:
+        return {'intent': 'search_web', 'entities': {'query_term': search.group(1).strip(" ?.!")}}
+    return {'intent': 'casual_chat', 'entities': {}}
+
+
+def stub_reply(messages: list, constrained: bool) -> str:
+    """A canned answer shaped like what the caller asked for. Depends only on the messages."""
+    text = " ".join(message.get('content', '') for message in messages)
+    if "JSON" in text:
+        classification = stub_classification(text)
+        if constrained:
+            return json.dumps(classification)
+        # Unconstrained models tend to add fields nobody asked for.
+        return ('Here is the JSON: ' + json.dumps({**classification, 'confidence': 0.9,
+                'reasoning': "The message matched the intent's description and no other intent."}))
+    ideas = re.search(r"brainstorm (\d+) distinct", text)
+    if ideas:
+        return numbered_list(int(ideas.group(1)), "Idea")
+    prototypes = re.search(r"generate (\d+) prototypes", text)
+    if prototypes:
+        return numbered_list(int(prototypes.group(1)), "Prototype")
+    if "ONLY the number" in text:
+        return "1"
+    revision = zlib.crc32(messages[-1].get('content', '').encode("utf-8")) % 10000 if messages else 0
+    return f"Revision {revision}: " + "A refined, more complete answer to the query. " * 16
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    server_version = "StubLLM/1.0"
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark output readable
+
+    def _send_json(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.simulator._lock:
+                self._send_json(dict(self.server.simulator.stats))
+        elif self.path.rstrip("/").endswith("/models"):
+            self._send_json({'object': 'list', 'data': []}) # Answers the LLM router's health probe
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/").endswith("/stats/reset"):
+            self.server.simulator.reset_stats()
+            self._send_json({'status': 'reset'})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json({'error': 'not found'}, 404)
+            return
+
+        messages = payload.get('messages') or []
+        model = payload.get('model') or 'stub'
+        prompt_tokens, cached_tokens, eval_ms = self.server.simulator.evaluate(
+            model, render_messages(messages), parse_keep_alive(payload.get('keep_alive'))
+        )
+        content = stub_reply(messages, bool(payload.get('response_format')))
+        completion_tokens = max(1, len(content) // CHARS_PER_TOKEN)
+        with self.server.simulator._lock:
+            self.server.simulator.stats['completion_tokens'] += completion_tokens
+        token_seconds = 1 / self.server.tokens_per_second if self.server.tokens_per_second > 0 else 0.0
+        time.sleep((eval_ms + self.server.generation_ms) / 1000)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens},
+        }
+        if payload.get('stream'):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            try:
+                for piece in re.findall(r"\S+\s*", content): # Roughly one token per delta
+                    time.sleep(token_seconds)
+                    chunk = {'choices': [{'delta': {'content': piece}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass # The client stopped reading early
+            return
+        time.sleep(completion_tokens * token_seconds)
+        self._send_json({
+            'object': 'chat.completion',
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': usage,
+        })
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, generation_ms: float = STUB_GENERATION_MS,
+                      tokens_per_second: float = STUB_TOKENS_PER_SECOND, ms_per_token: float = STUB_PROMPT_EVAL_MS_PER_TOKEN) -> ThreadingHTTPServer:
+    """Starts the stub on a daemon thread (port 0 picks a free port) and returns the server."""
+    server = ThreadingHTTPServer((host, port), StubLLMHandler)
+    server.daemon_threads = True
+    server.generation_ms = generation_ms
+    server.tokens_per_second = tokens_per_second
+    server.simulator = PromptCacheSimulator(ms_per_token=ms_per_token)
+    threading.Thread(target=server.serve_forever, daemon=True, name="stub-llm").start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="OpenAI-compatible LLM stub with a simulated prompt cache.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--generation-ms", type=float, default=STUB_GENERATION_MS)
+    parser.add_argument("--tokens-per-second", type=float, default=STUB_TOKENS_PER_SECOND)
+    parser.add_argument("--prompt-eval-ms-per-token", type=float, default=STUB_PROMPT_EVAL_MS_PER_TOKEN)
+    args = parser.parse_args()
+    stub = start_stub_server(args.host, args.port, args.generation_ms, args.tokens_per_second, args.prompt_eval_ms_per_token)
+    print(f"Stub LLM server listening on http://{args.host}:{stub.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
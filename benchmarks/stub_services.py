@@ -0,0 +1,162 @@
+"""
+Local stand-ins for the HTTP APIs behind the weather, web search and Bible integrations, for
+benchmarks. Every route answers with a fixed, well-formed payload after STUB_SERVICE_LATENCY_MS:
+
+    /geocoding/v1/search   open-meteo geocoding       (GEOCODING_API_URL)
+    /forecast/v1/forecast  open-meteo forecast        (WEATHER_API_URL)
+    /duckduckgo/           DuckDuckGo instant answers (DUCKDUCKGO_API_URL)
+    /bible/<reference>     bible-api.com             (BIBLE_API_URL)
+
+service_env() returns those variables for a running stub. Request counts per service are served
+at `GET /stats` and cleared with `POST /stats/reset`.
+
+Run standalone with `python -m benchmarks.stub_services --port 11600`.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_SERVICE_LATENCY_MS = float(os.getenv("STUB_SERVICE_LATENCY_MS", "30"))  # Simulated upstream latency per request
+SERVICES = ('geocoding', 'forecast', 'duckduckgo', 'bible')
+
+
+def geocoding_reply(query: dict) -> dict:
+    name = (query.get('name') or ["Nowhere"])[0]
+    # Deterministic coordinates per name, so distinct cities get distinct forecasts.
+    seed = sum(ord(char) for char in name.lower())
+    return {'results': [{
+        'name': name.title(),
+        'latitude': round(-60 + seed % 120 + 0.1234, 4),
+        'longitude': round(-170 + (seed * 7) % 340 + 0.5678, 4),
+        'country': "Stubland",
+        'admin1': "Benchmark Province",
+    }]}
+
+
+def _values(query: dict, name: str) -> list[str]:
+    return ",".join(query.get(name) or ["0"]).split(",")
+
+
+def forecast_reply(query: dict) -> dict | list:
+    """Answers one coordinate pair with an object and comma-separated coordinates with a list, like open-meteo."""
+    latitudes, longitudes = _values(query, 'latitude'), _values(query, 'longitude')
+    replies = [
+        {
+            'latitude': float(latitude),
+            'longitude': float(longitude),
+            'current_weather': {'temperature': round(12.5 + float(latitude) % 10, 1), 'windspeed': 11.2, 'weathercode': 2, 'is_day': 1},
+        }
+        for latitude, longitude in zip(latitudes, longitudes)
+    ]
+    return replies[0] if len(replies) == 1 else replies
+
+
+def duckduckgo_reply(query: dict) -> dict:
+    term = (query.get('q') or [""])[0]
+    return {
+        'Type': 'A',
+        'Heading': term.title(),
+        'AbstractText': f"{term.capitalize()} is a topic with a short stub abstract used for benchmarking.",
+        'AbstractURL': "https://example.invalid/abstract",
+        'Answer': "",
+        'AnswerType': "",
+        'Definition': "",
+        'RelatedTopics': [],
+    }
+
+
+def bible_reply(reference: str) -> dict:
+    return {
+        'reference': reference,
+        'text': "In the beginning was the Word, and the Word was with God, and the Word was God.\n",
+        'translation_name': "King James Version",
+    }
+
+
+class StubServiceHandler(BaseHTTPRequestHandler):
+    server_version = "StubServices/1.0"
+
+    def log_message(self, format, *args):
+        pass # Keep benchmark output readable
+
+    def _send_json(self, body, status: int = 200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        service, _, rest = url.path.lstrip("/").partition("/")
+        if service == 'stats':
+            with self.server.lock:
+                self._send_json(dict(self.server.counts))
+            return
+        if service not in SERVICES:
+            self._send_json({'error': 'not found'}, 404)
+            return
+
+        with self.server.lock:
+            self.server.counts[service] += 1
+        time.sleep(self.server.latency_ms / 1000)
+        if service == 'geocoding':
+            self._send_json(geocoding_reply(query))
+        elif service == 'forecast':
+            self._send_json(forecast_reply(query))
+        elif service == 'duckduckgo':
+            self._send_json(duckduckgo_reply(query))
+        else:
+            self._send_json(bible_reply(urllib.parse.unquote(rest)))
+
+    def do_POST(self):
+        if self.path.rstrip("/").endswith("/stats/reset"):
+            with self.server.lock:
+                self.server.counts = dict.fromkeys(SERVICES, 0)
+            self._send_json({'status': 'reset'})
+        else:
+            self._send_json({'error': 'not found'}, 404)
+
+
+def start_stub_services(host: str = "127.0.0.1", port: int = 0, latency_ms: float = STUB_SERVICE_LATENCY_MS) -> ThreadingHTTPServer:
+    """Starts the stub services on a daemon thread (port 0 picks a free port) and returns the server."""
+    server = ThreadingHTTPServer((host, port), StubServiceHandler)
+    server.daemon_threads = True
+    server.latency_ms = latency_ms
+    server.lock = threading.Lock()
+    server.counts = dict.fromkeys(SERVICES, 0)
+    threading.Thread(target=server.serve_forever, daemon=True, name="stub-services").start()
+    return server
+
+
+def service_env(server: ThreadingHTTPServer) -> dict:
+    """The integration URL variables that point the app at this stub."""
+    base_url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    return {
+        'GEOCODING_API_URL': f"{base_url}/geocoding/v1/search",
+        'WEATHER_API_URL': f"{base_url}/forecast/v1/forecast",
+        'DUCKDUCKGO_API_URL': f"{base_url}/duckduckgo/",
+        'BIBLE_API_URL': f"{base_url}/bible/",
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stub weather, search and Bible APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11600)
+    parser.add_argument("--latency-ms", type=float, default=STUB_SERVICE_LATENCY_MS)
+    args = parser.parse_args()
+    stub = start_stub_services(args.host, args.port, args.latency_ms)
+    print("Stub services listening. Point the app at them with:")
+    for name, value in service_env(stub).items():
+        print(f"  export {name}={value}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.shutdown()
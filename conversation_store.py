@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from llm import get_ollama_response, GENERATOR_MODEL_NAME
+
+CONVERSATION_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "2048"))  # Prompt budget for history (summary + recent turns)
+CONVERSATION_RECENT_TOKENS = int(os.getenv("CONVERSATION_RECENT_TOKENS", "1024"))  # Newest turns kept verbatim; older ones get summarized
+CONVERSATION_SUMMARY_BATCH_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_BATCH_TOKENS", "256"))  # Fold older turns once this much piles up
+CONVERSATION_SUMMARY_WORDS = int(os.getenv("CONVERSATION_SUMMARY_WORDS", "200"))  # Length the rolling summary is asked to stay under
+CONVERSATION_MAX_SESSION_BYTES = int(os.getenv("CONVERSATION_MAX_SESSION_BYTES", "262144"))  # Stored turn data per session
+CONVERSATION_MAX_SESSIONS = int(os.getenv("CONVERSATION_MAX_SESSIONS", "1000"))  # Least recently used sessions beyond this are dropped
+CONVERSATION_IDLE_TTL_SECONDS = float(os.getenv("CONVERSATION_IDLE_TTL_SECONDS", "3600"))  # Sessions idle this long are evicted
+CONVERSATION_SUMMARY_TURN_CHARS = 4000  # Longer messages are cut to this when fed to the summarizer
+CONVERSATION_COMPRESS_MIN_BYTES = 256  # Shorter turns are stored as plain UTF-8; zlib would not shrink them
+CHARS_PER_TOKEN = 4  # Same rough estimate the rest of the code uses when the backend reports nothing
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class _Turn:
+    """One stored message. The text is kept as (optionally zlib-compressed) bytes."""
+    __slots__ = ('index', 'role', 'data', 'compressed', 'tokens')
+
+    def __init__(self, index: int, role: str, content: str):
+        self.index = index
+        self.role = role
+        raw = content.encode("utf-8")
+        self.compressed = len(raw) >= CONVERSATION_COMPRESS_MIN_BYTES
+        self.data = zlib.compress(raw) if self.compressed else raw
+        self.tokens = estimate_tokens(content)
+
+    @property
+    def content(self) -> str:
+        return (zlib.decompress(self.data) if self.compressed else self.data).decode("utf-8")
+
+    def as_message(self) -> dict:
+        return {'role': self.role, 'content': self.content}
+
+
+class _Session:
+    def __init__(self):
+        self.turns = deque()  # Append-only log; only the oldest turns are ever dropped
+        self.next_index = 0
+        self.stored_bytes = 0
+        self.summary = ""  # Rolling summary of every turn with index < summarized_through
+        self.summarized_through = 0
+        self.summarizing = False
+        self.last_active = time.monotonic()
+
+
+class ConversationStore:
+    """
+    Server-side chat history per session.
+
+    Turns are appended to a compact per-session log. The prompt context for a new message keeps the
+    newest turns verbatim and replaces everything older with a rolling summary, so its size stays
+    within CONVERSATION_CONTEXT_TOKENS however long the conversation gets. Summaries are folded in
+    batches on a background thread and cached on the session. A session's stored turns are capped
+    at CONVERSATION_MAX_SESSION_BYTES (already summarized turns go first), and sessions are evicted
+    after CONVERSATION_IDLE_TTL_SECONDS of inactivity or when more than CONVERSATION_MAX_SESSIONS exist.
+    """
+
+    def __init__(self, summarize=None, context_tokens: int = CONVERSATION_CONTEXT_TOKENS, recent_tokens: int = CONVERSATION_RECENT_TOKENS,
+                 max_session_bytes: int = CONVERSATION_MAX_SESSION_BYTES, max_sessions: int = CONVERSATION_MAX_SESSIONS,
+                 idle_ttl_seconds: float = CONVERSATION_IDLE_TTL_SECONDS):
+        self.summarize = summarize or summarize_turns
+        self.context_tokens = context_tokens
+        self.recent_tokens = min(recent_tokens, context_tokens)
+        self.max_session_bytes = max_session_bytes
+        self.max_sessions = max_sessions
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._sessions = OrderedDict()  # session_id -> _Session, least recently used first
+        self._lock = threading.Lock()
+        self._summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+        self._summaries_built = 0
+
+    def _session_locked(self, session_id: str, create: bool = False):
+        self._evict_locked()
+        session = self._sessions.get(session_id)
+        if session is None and create:
+            session = self._sessions[session_id] = _Session()
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        if session is not None:
+            session.last_active = time.monotonic()
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def _evict_locked(self):
+        cutoff = time.monotonic() - self.idle_ttl_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_active > cutoff:
+                break
+            del self._sessions[session_id]
+
+    def append(self, session_id: str, role: str, content: str):
+        """Appends one message ('user' or 'assistant') and schedules summarization if older turns piled up."""
+        with self._lock:
+            session = self._session_locked(session_id, create=True)
+            turn = _Turn(session.next_index, role, content)
+            session.next_index += 1
+            session.turns.append(turn)
+            session.stored_bytes += len(turn.data)
+            self._trim_locked(session)
+            batch = self._claim_summary_batch_locked(session)
+        if batch:
+            self._summarizer.submit(self._fold_summary, session_id, session, *batch)
+
+    def append_exchange(self, session_id: str, user_message: str, reply: str):
+        self.append(session_id, 'user', user_message)
+        self.append(session_id, 'assistant', reply)
+
+    def _trim_locked(self, session: _Session):
+        """Enforces the per-session byte cap, dropping the oldest turns (summarized ones come first in the log)."""
+        while session.stored_bytes > self.max_session_bytes and len(session.turns) > 1:
+            dropped = session.turns.popleft()
+            session.stored_bytes -= len(dropped.data)
+            if dropped.index >= session.summarized_through:
+                # Never summarized: it falls out of the context rather than holding memory.
+                session.summarized_through = dropped.index + 1
+
+    def _recent_start_locked(self, session: _Session) -> int:
+        """Index of the oldest turn inside the verbatim window of recent turns."""
+        budget, start = self.recent_tokens, session.next_index
+        for turn in reversed(session.turns):
+            if turn.tokens > budget:
+                break
+            budget -= turn.tokens
+            start = turn.index
+        return start
+
+    def _claim_summary_batch_locked(self, session: _Session):
+        """Returns (previous summary, turns to fold) once enough turns have aged out of the recent window."""
+        if session.summarizing:
+            return None
+        recent_start = self._recent_start_locked(session)
+        pending = [turn for turn in session.turns if session.summarized_through <= turn.index < recent_start]
+        if sum(turn.tokens for turn in pending) < CONVERSATION_SUMMARY_BATCH_TOKENS:
+            return None
+        session.summarizing = True
+        return session.summary, pending
+
+    def _fold_summary(self, session_id: str, session: _Session, previous_summary: str, turns: list):
+        try:
+            summary = self.summarize(previous_summary, [turn.as_message() for turn in turns])
+        except Exception as e:
+            print(f"Conversation Store: Summarizing session {session_id} failed: {e}")
+            summary = None
+        with self._lock:
+            session.summarizing = False
+            if summary:
+                session.summary = summary
+                session.summarized_through = max(session.summarized_through, turns[-1].index + 1)
+                self._summaries_built += 1
+            # More turns may have aged out while this batch was being summarized.
+            batch = self._claim_summary_batch_locked(session) if summary and self._sessions.get(session_id) is session else None
+        if batch:
+            self._summarizer.submit(self._fold_summary, session_id, session, *batch)
+
+    def build_context(self, session_id: str) -> dict:
+        """
+        Returns {'summary': str, 'messages': [{'role', 'content'}, ...]}: the rolling summary of
+        older turns and the newest unsummarized turns, oldest first, within the token budget.
+        """
+        with self._lock:
+            session = self._session_locked(session_id) if session_id else None
+            if session is None:
+                return {'summary': "", 'messages': []}
+            summary = session.summary
+            budget = self.context_tokens - (estimate_tokens(summary) if summary else 0)
+            recent = []
+            for turn in reversed(session.turns):
+                if turn.index < session.summarized_through or turn.tokens > budget:
+                    break
+                budget -= turn.tokens
+                recent.append(turn)
+        return {'summary': summary, 'messages': [turn.as_message() for turn in reversed(recent)]}
+
+    def clear(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._evict_locked()
+            return {
+                'sessions': len(self._sessions),
+                'stored_turns': sum(len(session.turns) for session in self._sessions.values()),
+                'stored_bytes': sum(session.stored_bytes for session in self._sessions.values()),
+                'summaries_built': self._summaries_built,
+            }
+
+    def shutdown(self):
+        self._summarizer.shutdown(wait=False)
+
+
+def summarize_turns(previous_summary: str, turns: list) -> str:
+    """Folds a batch of turns into the running summary with the generator model."""
+    transcript = "\n".join(f"{turn['role'].capitalize()}: {turn['content'][:CONVERSATION_SUMMARY_TURN_CHARS]}" for turn in turns)
+    system_prompt = (
+        "You maintain a running summary of a conversation between a user and an AI assistant named Samantha. "
+        "Merge the new messages into the existing summary. Keep facts, names, preferences, decisions and open questions "
+        "the assistant may need later; drop small talk. "
+        f"Write plain prose under {CONVERSATION_SUMMARY_WORDS} words and output only the updated summary."
+    )
+    prompt = f"Existing summary:\n{previous_summary or '(none yet)'}\n\nNew messages:\n{transcript}"
+    summary = get_ollama_response(prompt, model_name=GENERATOR_MODEL_NAME, priority='background', system=system_prompt)
+    if summary.startswith("Sorry, ") and "my brain (" in summary:
+        raise RuntimeError(summary) # get_ollama_response reports failures as an apology instead of raising
+    return summary
+
+
+def render_context(context: dict, current_message: str) -> str:
+    """Flattens a built context plus the new message into one prompt, for callers that take a single string."""
+    parts = []
+    if context['summary']:
+        parts.append(f"Summary of the earlier conversation:\n{context['summary']}")
+    if context['messages']:
+        parts.append("Recent messages:\n" + "\n".join(f"{message['role'].capitalize()}: {message['content']}" for message in context['messages']))
+    if not parts:
+        return current_message
+    return "\n\n".join(parts) + f"\n\nThe user now asks:\n{current_message}"
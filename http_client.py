@@ -0,0 +1,146 @@
+import asyncio
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Connection pool settings shared by every outbound HTTP call that goes through this module.
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))  # Max keep-alive connections kept per host
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))  # Seconds to establish a TCP/TLS connection
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "300"))  # Seconds to wait for bytes from the server
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))  # Retries on connection resets and transient 5xx
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))  # Sleeps 0.5s, 1s, 2s, ... between retries
+RETRY_STATUS_CODES = (500, 502, 503, 504)
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "200"))  # Concurrent requests of the ASGI server's client
+
+_adapters = {}  # read retries -> shared HTTPAdapter
+_adapter_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+def _build_retry(read_retries: int) -> Retry:
+    """
+    Retry policy for transient failures: connection errors and 5xx answers. Read timeouts and
+    resets are only retried when `read_retries` allows it: a POST that timed out while reading has
+    already been accepted, so resending an LLM completion would generate it again on the backend.
+    """
+    return Retry(
+        total=HTTP_MAX_RETRIES,
+        connect=HTTP_MAX_RETRIES,
+        read=read_retries,
+        status=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset({"GET", "POST"}),
+        raise_on_status=False,  # Hand the final 5xx back to the caller so raise_for_status() reports it
+        respect_retry_after_header=True,
+    )
+
+
+def _get_adapter(read_retries: int) -> HTTPAdapter:
+    """Returns the process-wide adapter for a read-retry policy. Its urllib3 pool manager is thread-safe and shared by all sessions."""
+    adapter = _adapters.get(read_retries)
+    if adapter is None:
+        with _adapter_lock:
+            adapter = _adapters.get(read_retries)
+            if adapter is None:
+                adapter = _adapters[read_retries] = HTTPAdapter(
+                    pool_connections=HTTP_POOL_SIZE,
+                    pool_maxsize=HTTP_POOL_SIZE,
+                    pool_block=False,
+                    max_retries=_build_retry(read_retries),
+                )
+    return adapter
+
+
+def get_session(retry_reads: bool = True) -> requests.Session:
+    """
+    Returns a keep-alive session for the calling thread. `retry_reads=False` gives one that does not
+    resend a request after a read timeout or reset (used for POSTs, see _build_retry).
+
+    requests.Session objects are not fully thread-safe (cookies, hooks), so each thread gets its own
+    Session, but they all mount the shared HTTPAdapters and therefore share their connection pools.
+    """
+    name = "session" if retry_reads else "post_session"
+    session = getattr(_thread_local, name, None)
+    if session is None:
+        session = requests.Session()
+        adapter = _get_adapter(HTTP_MAX_RETRIES if retry_reads else 0)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        setattr(_thread_local, name, session)
+    return session
+
+
+def default_timeout() -> tuple[float, float]:
+    """The (connect, read) timeout tuple used when a caller does not pass one."""
+    return (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+
+def post_json(url: str, payload: dict, timeout=None, stream: bool = False) -> requests.Response:
+    """POSTs a JSON payload over the pooled session with connect/5xx retries (no read retries) and a bounded timeout."""
+    return get_session(retry_reads=False).post(
+        url,
+        json=payload,
+        headers={"Content-Type": "application/json"},
+        timeout=timeout or default_timeout(),
+        stream=stream,
+    )
+
+
+def get(url: str, params: dict = None, timeout=None) -> requests.Response:
+    """GETs a URL over the pooled session with retries and a bounded timeout."""
+    return get_session().get(url, params=params, timeout=timeout or default_timeout())
+
+
+# --- Async client (used by the ASGI server, see asgi.py) ---
+
+_async_client = None
+
+
+def _httpx_timeout(timeout):
+    import httpx
+    connect, read = timeout or default_timeout()
+    return httpx.Timeout(read, connect=connect)
+
+
+def get_async_client():
+    """
+    Returns the shared httpx.AsyncClient. Like the sync adapter it keeps a keep-alive pool, but
+    a waiting request holds no thread, so one process can have hundreds of LLM calls in flight.
+    Connection failures are retried by the transport; transient 5xx by async_post_json().
+    """
+    global _async_client
+    if _async_client is None:
+        import httpx  # Only needed when serving over ASGI
+        limits = httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_POOL_SIZE)
+        _async_client = httpx.AsyncClient(
+            timeout=_httpx_timeout(None),
+            limits=limits,
+            transport=httpx.AsyncHTTPTransport(retries=HTTP_MAX_RETRIES, limits=limits),
+        )
+    return _async_client
+
+
+async def async_post_json(url: str, payload: dict, timeout=None):
+    """Async POST of a JSON payload with the same retry-with-backoff policy as post_json()."""
+    client = get_async_client()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        response = await client.post(url, json=payload, timeout=_httpx_timeout(timeout))
+        if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+            return response
+        await asyncio.sleep(HTTP_RETRY_BACKOFF * (2 ** attempt))
+
+
+def async_stream_post_json(url: str, payload: dict, timeout=None):
+    """Async streaming POST. Use as `async with async_stream_post_json(...) as response:`."""
+    return get_async_client().stream("POST", url, json=payload, timeout=_httpx_timeout(timeout))
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
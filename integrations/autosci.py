@@ -1,5 +1,7 @@
 from llm import get_ollama_response, THINKER_MODEL_NAME
 from problem_solver import solve_with_multi_step_refinement
+from job_scheduler import report_progress
+from llm_router import llm_priority
 
 def trigger_autosci_discovery() -> str:
     """
@@ -20,6 +22,9 @@ def trigger_autosci_discovery() -> str:
 
     print("AutoSCI: Initiating multi-step refinement for creative discovery.")
     # The solve_with_multi_step_refinement function will handle using the GENERATOR and THINKER models.
-    discovery_narrative = solve_with_multi_step_refinement(initial_autosci_prompt)
+    # Stage events are forwarded to the job scheduler so clients can follow progress live.
+    # Its hundreds of LLM calls run as background work so they never delay a chat reply.
+    with llm_priority('background'):
+        discovery_narrative = solve_with_multi_step_refinement(initial_autosci_prompt, progress_callback=report_progress)
     
     return f"Initiating AutoSCI Discovery Protocol...\n\n{discovery_narrative}" 
@@ -1,11 +1,31 @@
+import os
 import requests
 import random # Keep for fallback or if API fails
 import urllib.parse
 
-BIBLE_API_URL = "https://bible-api.com/"
+from integrations import bible_index
+
+BIBLE_API_URL = os.getenv("BIBLE_API_URL", "https://bible-api.com/") # Must end with '/'; overridable for benchmarks
+BIBLE_TRANSLATION = os.getenv("BIBLE_TRANSLATION", "kjv").lower() # KJV is served from the local index when built; others from bible-api.com
+BIBLE_MAX_PASSAGE_VERSES = int(os.getenv("BIBLE_MAX_PASSAGE_VERSES", "200")) # Longer local passages are cut off here
+
+def _local_index():
+    """The local KJV index if it is built and the configured translation is KJV, else None."""
+    return bible_index.get_index() if BIBLE_TRANSLATION == "kjv" else None
+
+def _format_local_passage(index, reference: str, first: int, last: int) -> str:
+    translation = "King James Version"
+    if last - first + 1 > BIBLE_MAX_PASSAGE_VERSES:
+        last = first + BIBLE_MAX_PASSAGE_VERSES - 1
+        translation += f", first {BIBLE_MAX_PASSAGE_VERSES} verses"
+    return f"{reference} ({translation}):\n{index.text(first, last)}"
 
 def get_random_bible_verse() -> str:
-    """Fetches a random Bible verse using a predefined list for randomness, then fetching that specific verse."""
+    """Returns a verse drawn uniformly from the whole local KJV canon, or fetches one of a few well-known verses from bible-api.com."""
+    index = _local_index()
+    if index:
+        reference, verse_id = index.random_verse()
+        return _format_local_passage(index, reference, verse_id, verse_id)
     # For true randomness with an API that fetches specific verses, we need a list to pick from.
     # This list can be expanded.
     common_verses = [
@@ -16,14 +36,23 @@ def get_random_bible_verse() -> str:
     return get_specific_bible_verse(verse_reference)
 
 def get_specific_bible_verse(verse_reference: str) -> str:
-    """Fetches a specific Bible verse using bible-api.com."""
+    """Looks up a verse or passage in the local KJV index, falling back to bible-api.com for references it cannot parse."""
     if not verse_reference:
         return "Please provide a Bible verse reference (e.g., John 3:16)."
-    
+
+    index = _local_index()
+    if index:
+        try:
+            passage = index.resolve(verse_reference)
+        except ValueError as e:
+            return f"Sorry, I couldn't find '{verse_reference}': {e}."
+        if passage:
+            return _format_local_passage(index, *passage)
+
     try:
         # Sanitize and encode the reference
         encoded_reference = urllib.parse.quote(verse_reference.strip())
-        url = f"{BIBLE_API_URL}{encoded_reference}?translation=kjv" # Default to KJV, can be parameterized
+        url = f"{BIBLE_API_URL}{encoded_reference}?translation={urllib.parse.quote(BIBLE_TRANSLATION)}"
         
         response = requests.get(url)
         response.raise_for_status()
@@ -55,6 +84,5 @@ def _get_placeholder_verse(prefix_message="") -> str:
     ]
     return f"{prefix_message} {random.choice(placeholder_verses)} (Placeholder)"
 
-# We might also want to adjust nlu.py if the user can ask for specific verses.
-# For now, get_random_bible_verse is the primary entry point from app.py.
-# If NLU can extract a verse_reference entity, app.py could call get_specific_bible_verse.
\ No newline at end of file
+# app.py calls get_specific_bible_verse when the NLU extracts a `reference` entity, and
+# get_random_bible_verse otherwise.
\ No newline at end of file
@@ -0,0 +1,296 @@
+"""
+Local KJV verse store: the verse text in one UTF-8 file and a compact binary index of book,
+chapter and verse offsets into it, both memory-mapped. Any reference or range resolves to a
+contiguous byte slice with a few table lookups, and a random verse is a uniform draw over all
+31,102 verses, so get_bible_verse needs no network round trip.
+
+Build the two files once from a verse-per-row CSV (columns b, c, v, t: book number 1-66, chapter,
+verse, text, as in the public-domain `t_kjv.csv` of the bible_databases project):
+
+    python -m integrations.bible_index --source t_kjv.csv
+
+Index layout (little-endian): a header (magic, book, chapter and verse counts, text size), then
+per book (first chapter, chapter count), per chapter (first verse, verse count, book), the byte
+offset of every verse plus the end of the text, and the chapter of every verse.
+"""
+import argparse
+import array
+import csv
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import threading
+
+BIBLE_KJV_PATH = os.getenv("BIBLE_KJV_PATH", "data/kjv")  # Prefix of the built files: <prefix>.txt and <prefix>.idx
+
+INDEX_MAGIC = b"KJVIDX01"
+_HEADER = struct.Struct("<8sIIII")  # magic, books, chapters, verses, text bytes
+
+BOOKS = (
+    "Genesis", "Exodus", "Leviticus", "Numbers", "Deuteronomy", "Joshua", "Judges", "Ruth",
+    "1 Samuel", "2 Samuel", "1 Kings", "2 Kings", "1 Chronicles", "2 Chronicles", "Ezra",
+    "Nehemiah", "Esther", "Job", "Psalms", "Proverbs", "Ecclesiastes", "Song of Solomon", "Isaiah",
+    "Jeremiah", "Lamentations", "Ezekiel", "Daniel", "Hosea", "Joel", "Amos", "Obadiah", "Jonah",
+    "Micah", "Nahum", "Habakkuk", "Zephaniah", "Haggai", "Zechariah", "Malachi",
+    "Matthew", "Mark", "Luke", "John", "Acts", "Romans", "1 Corinthians", "2 Corinthians",
+    "Galatians", "Ephesians", "Philippians", "Colossians", "1 Thessalonians", "2 Thessalonians",
+    "1 Timothy", "2 Timothy", "Titus", "Philemon", "Hebrews", "James", "1 Peter", "2 Peter",
+    "1 John", "2 John", "3 John", "Jude", "Revelation",
+)
+# Common names that are not a prefix of the canonical one, or whose prefix is ambiguous.
+_BOOK_ALIASES = {
+    "psalm": "Psalms", "songofsongs": "Song of Solomon", "canticles": "Song of Solomon",
+    "qoheleth": "Ecclesiastes", "phil": "Philippians", "phlm": "Philemon", "jn": "John",
+    "jdg": "Judges", "jas": "James", "revelations": "Revelation",
+}
+# Book names (or prefixes) that are also everyday words: "verse number 7" is not Numbers 7. They only
+# count as a book when capitalized or followed by chapter:verse.
+_AMBIGUOUS_BOOK_WORDS = {
+    "act", "acts", "am", "co", "da", "de", "es", "ex", "ga", "he", "ho", "is", "jam", "job", "judge",
+    "judges", "la", "lame", "lament", "lu", "mar", "mark", "mat", "mi", "na", "ne", "number", "numbers",
+    "ob", "pro", "prove", "re", "ro", "rut", "so", "son", "song", "ti",
+}
+_ORDINALS = {"i": "1", "ii": "2", "iii": "3", "first": "1", "second": "2", "third": "3"}
+
+_REFERENCE_REGEX = re.compile(
+    r"^\s*(?P<book>(?:[1-3]|i{1,3}|first|second|third)?\s*[a-z][a-z. ]*?)\.?\s*(?P<chapter>\d+)"
+    r"(?:\s*:\s*(?P<verse>\d+))?(?:\s*[-–]\s*(?:(?P<end_chapter>\d+)\s*:\s*)?(?P<end>\d+))?\s*$",
+    re.IGNORECASE,
+)
+
+# A book-like word followed by a chapter, for spotting a reference inside a sentence. The lookahead
+# yields overlapping candidates, so 'verse 1 Cor 13:4' still reaches '1 Cor 13:4'.
+_REFERENCE_SEARCH_REGEX = re.compile(
+    r"(?=\b((?:(?:[1-3]|i{1,3}|first|second|third)\s*)?[a-z][a-z.]*(?:\s+of\s+[a-z]+)?\s+\d+(?:\s*:\s*\d+)?"
+    r"(?:\s*[-–]\s*\d+(?:\s*:\s*\d+)?)?))",
+    re.IGNORECASE,
+)
+
+
+def _book_key(name: str) -> str:
+    words = name.lower().replace(".", " ").split()
+    if len(words) > 1 and words[0] in _ORDINALS:
+        words[0] = _ORDINALS[words[0]]
+    return "".join(words)
+
+
+def _book_lookup() -> dict:
+    """Normalized name -> book number, for full names, aliases and every unambiguous prefix of two or more letters."""
+    keys = [_book_key(name) for name in BOOKS]
+    prefixes = {}
+    for number, key in enumerate(keys):
+        for length in range(2, len(key) + 1):
+            prefixes.setdefault(key[:length], set()).add(number)
+    lookup = {prefix: numbers.pop() for prefix, numbers in prefixes.items() if len(numbers) == 1}
+    lookup.update({key: number for number, key in enumerate(keys)})
+    lookup.update({alias: BOOKS.index(name) for alias, name in _BOOK_ALIASES.items()})
+    return lookup
+
+_BOOK_LOOKUP = _book_lookup()
+
+
+def find_reference(text: str):
+    """The first span of `text` that names a book followed by a chapter (e.g. 'John 3:16'), or None."""
+    for match in _REFERENCE_SEARCH_REGEX.finditer(text or ""):
+        reference = _REFERENCE_REGEX.match(match.group(1))
+        if not reference:
+            continue
+        book = reference.group("book").strip()
+        key = _book_key(book)
+        if key not in _BOOK_LOOKUP:
+            continue
+        if key in _AMBIGUOUS_BOOK_WORDS and not book[0].isupper() and reference.group("verse") is None:
+            continue
+        return match.group(1).strip()
+    return None
+
+
+def _uint_table(buffer, offset: int, count: int, typecode: str):
+    """A zero-copy view of `count` little-endian integers in `buffer` (a swapped copy on big-endian hosts)."""
+    size = array.array(typecode).itemsize
+    view = memoryview(buffer)[offset:offset + count * size]
+    if sys.byteorder == "little":
+        return view.cast(typecode)
+    table = array.array(typecode, view.tobytes())
+    table.byteswap()
+    return table
+
+
+class VerseIndex:
+    """Read-only view over a built text/index pair. Safe to share between threads."""
+
+    def __init__(self, prefix: str = BIBLE_KJV_PATH):
+        with open(f"{prefix}.txt", "rb") as text_file, open(f"{prefix}.idx", "rb") as index_file:
+            self._text = mmap.mmap(text_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, book_count, chapter_count, verse_count, text_size = _HEADER.unpack_from(self._index)
+        if magic != INDEX_MAGIC or book_count != len(BOOKS) or text_size != len(self._text):
+            raise ValueError(f"{prefix}.idx does not match {prefix}.txt; rebuild it with `python -m integrations.bible_index`")
+        offset = _HEADER.size
+        self._books = _uint_table(self._index, offset, 2 * book_count, "I")
+        offset += 8 * book_count
+        self._chapters = _uint_table(self._index, offset, 3 * chapter_count, "I")
+        offset += 12 * chapter_count
+        self._offsets = _uint_table(self._index, offset, verse_count + 1, "I")
+        offset += 4 * (verse_count + 1)
+        self._verse_chapters = _uint_table(self._index, offset, verse_count, "H")
+        self.verse_count = verse_count
+
+    def _chapter(self, book: int, chapter: int) -> int:
+        """Global chapter number of `chapter` (1-based) in `book`, or ValueError if the book has no such chapter."""
+        first_chapter, chapter_count = self._books[2 * book], self._books[2 * book + 1]
+        if not 1 <= chapter <= chapter_count:
+            raise ValueError(f"{BOOKS[book]} has {chapter_count} chapters")
+        return first_chapter + chapter - 1
+
+    def _verse(self, book: int, chapter: int, verse: int = None) -> int:
+        """Global verse number; no verse stands for the last verse of the chapter."""
+        row = 3 * self._chapter(book, chapter)
+        first_verse, verse_count = self._chapters[row], self._chapters[row + 1]
+        if verse is None:
+            verse = verse_count
+        if not 1 <= verse <= verse_count:
+            raise ValueError(f"{BOOKS[book]} {chapter} has {verse_count} verses")
+        return first_verse + verse - 1
+
+    def location(self, verse_id: int) -> tuple[str, int, int]:
+        """(book name, chapter, verse) of a global verse number."""
+        chapter = self._verse_chapters[verse_id]
+        first_verse, book = self._chapters[3 * chapter], self._chapters[3 * chapter + 2]
+        return BOOKS[book], chapter - self._books[2 * book] + 1, verse_id - first_verse + 1
+
+    def resolve(self, reference: str):
+        """
+        Parses a reference such as 'John 3:16', 'Ps 23', '1 Cor 13:4-7' or 'Genesis 1:31-2:3' into
+        (canonical reference, first verse, last verse). Returns None if it does not name a book;
+        raises ValueError if it does but the chapter or verse does not exist.
+        """
+        match = _REFERENCE_REGEX.match(reference or "")
+        book = _BOOK_LOOKUP.get(_book_key(match.group("book"))) if match else None
+        if book is None:
+            return None
+        name = BOOKS[book]
+        chapter, verse, end_chapter, end = (int(value) if value else None for value in match.group("chapter", "verse", "end_chapter", "end"))
+        if verse is None and self._books[2 * book + 1] == 1:
+            chapter, verse = 1, chapter  # 'Jude 3' is a verse of a one-chapter book
+        if verse is None and end_chapter:
+            verse = 1  # 'Psalms 23-24:2'
+        if verse is None:
+            # Whole chapters: 'Psalms 23' or 'Psalms 23-24'
+            last_chapter = end or chapter
+            label = f"{name} {chapter}" + (f"-{last_chapter}" if end else "")
+            first, last = self._verse(book, chapter, 1), self._verse(book, last_chapter)
+        elif end is None:
+            label = f"{name} {chapter}:{verse}"
+            first = last = self._verse(book, chapter, verse)
+        else:
+            last_chapter = end_chapter or chapter
+            label = f"{name} {chapter}:{verse}-" + (f"{last_chapter}:{end}" if end_chapter else f"{end}")
+            first, last = self._verse(book, chapter, verse), self._verse(book, last_chapter, end)
+        if last < first:
+            raise ValueError(f"'{reference}' ends before it starts")
+        return label, first, last
+
+    def text(self, first: int, last: int) -> str:
+        """Text of verses first..last, one verse per line; a single slice of the mapped file."""
+        return self._text[self._offsets[first]:self._offsets[last + 1]].decode("utf-8").rstrip("\n")
+
+    def random_verse(self, rng=random) -> tuple[str, int]:
+        """A verse drawn uniformly from the whole canon, as (reference, verse number)."""
+        verse_id = rng.randrange(self.verse_count)
+        name, chapter, verse = self.location(verse_id)
+        return f"{name} {chapter}:{verse}", verse_id
+
+
+_index = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+def get_index():
+    """The shared VerseIndex, opened on first use, or None if it has not been built."""
+    global _index, _index_loaded
+    if not _index_loaded:
+        with _index_lock:
+            if not _index_loaded:
+                try:
+                    _index = VerseIndex()
+                except FileNotFoundError:
+                    print(f"Bible: No local verse index at {BIBLE_KJV_PATH}.idx; using bible-api.com")
+                except ValueError as e:
+                    print(f"Bible: Ignoring local verse index: {e}")
+                _index_loaded = True
+    return _index
+
+
+def build_index(rows, prefix: str = BIBLE_KJV_PATH) -> int:
+    """
+    Writes <prefix>.txt and <prefix>.idx from (book number, chapter, verse, text) rows in canonical
+    order. Chapters and verses must be complete and consecutive. Returns the number of verses.
+    """
+    books = [[0, 0] for _ in BOOKS]
+    chapters, offsets, verse_chapters = [], [], []
+    text_parts, size = [], 0
+    previous = (0, 0, 0)
+    for book, chapter, verse, text in rows:
+        if not 1 <= book <= len(BOOKS):
+            raise ValueError(f"Book number {book} is outside the {len(BOOKS)}-book canon")
+        if (book, chapter, verse) not in ((previous[0], previous[1], previous[2] + 1), (previous[0], previous[1] + 1, 1), (previous[0] + 1, 1, 1)):
+            raise ValueError(f"Expected the verse after {previous}, got {(book, chapter, verse)}")
+        if verse == 1:
+            if chapter == 1:
+                books[book - 1][0] = len(chapters)
+            books[book - 1][1] += 1
+            chapters.append([len(offsets), 0, book - 1])
+        chapters[-1][1] += 1
+        offsets.append(size)
+        verse_chapters.append(len(chapters) - 1)
+        data = (" ".join(text.split()) + "\n").encode("utf-8")
+        text_parts.append(data)
+        size += len(data)
+        previous = (book, chapter, verse)
+    if previous[0] != len(BOOKS):
+        raise ValueError(f"The source stops at book {previous[0]} of {len(BOOKS)}")
+    offsets.append(size)
+
+    tables = [array.array("I", [value for pair in books for value in pair]), array.array("I", [value for row in chapters for value in row]),
+              array.array("I", offsets), array.array("H", verse_chapters)]
+    if sys.byteorder != "little":
+        for table in tables:
+            table.byteswap()
+    directory = os.path.dirname(prefix)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write both files aside and swap them in, so a running process never maps a half-written pair.
+    with open(f"{prefix}.txt.tmp", "wb") as f:
+        f.writelines(text_parts)
+    with open(f"{prefix}.idx.tmp", "wb") as f:
+        f.write(_HEADER.pack(INDEX_MAGIC, len(BOOKS), len(chapters), len(verse_chapters), size))
+        for table in tables:
+            f.write(table.tobytes())
+    os.replace(f"{prefix}.txt.tmp", f"{prefix}.txt")
+    os.replace(f"{prefix}.idx.tmp", f"{prefix}.idx")
+    return len(verse_chapters)
+
+
+def read_csv_rows(path: str):
+    """Rows of a verse-per-row CSV with b/c/v/t (or book/chapter/verse/text) columns, sorted canonically."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        rows = []
+        for row in csv.DictReader(f):
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            rows.append((int(row.get("b") or row["book"]), int(row.get("c") or row["chapter"]),
+                         int(row.get("v") or row["verse"]), row.get("t") or row.get("text") or ""))
+    rows.sort(key=lambda row: row[:3])
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the local KJV verse index.")
+    parser.add_argument("--source", required=True, help="Verse-per-row CSV with b, c, v, t columns (e.g. t_kjv.csv)")
+    parser.add_argument("--output", default=BIBLE_KJV_PATH, help="Prefix of the files to write (default: %(default)s)")
+    args = parser.parse_args()
+    count = build_index(read_csv_rows(args.source), args.output)
+    print(f"Bible: Indexed {count} verses into {args.output}.txt and {args.output}.idx")
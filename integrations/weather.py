@@ -1,61 +1,344 @@
+import contextvars
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
-GEOCODING_API_URL = "https://geocoding-api.open-meteo.com/v1/search"
-WEATHER_API_URL = "https://api.open-meteo.com/v1/forecast"
+import http_client
+import tracing
+from single_flight import SingleFlight
+from ttl_cache import TTLCache
 
-def get_weather_data(location: str) -> str:
-    """Placeholder for fetching weather data."""
+# Overridable so benchmarks can point the integration at a local stub (benchmarks/stub_services.py).
+GEOCODING_API_URL = os.getenv("GEOCODING_API_URL", "https://geocoding-api.open-meteo.com/v1/search")
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "https://api.open-meteo.com/v1/forecast")
+WEATHER_GEOCODE_DB_PATH = os.getenv("WEATHER_GEOCODE_DB_PATH", "weather_geocode.db")  # Persistent location name -> coordinates cache
+WEATHER_GEOCODE_TTL_SECONDS = float(os.getenv("WEATHER_GEOCODE_TTL_SECONDS", "2592000"))  # Re-geocode a name after 30 days
+WEATHER_FORECAST_TTL_SECONDS = float(os.getenv("WEATHER_FORECAST_TTL_SECONDS", "300"))  # Current weather is reused this long
+WEATHER_FORECAST_CACHE_SIZE = int(os.getenv("WEATHER_FORECAST_CACHE_SIZE", "1024"))
+WEATHER_COORDINATE_DECIMALS = int(os.getenv("WEATHER_COORDINATE_DECIMALS", "2"))  # Forecasts are cached per ~1 km grid cell
+WEATHER_MAX_LOCATIONS = int(os.getenv("WEATHER_MAX_LOCATIONS", "10"))  # Places answered in one multi-location request
+WEATHER_HTTP_TIMEOUT = (5, 15)  # (connect, read) seconds for the open-meteo APIs
+
+weather_cache_lookups = tracing.metrics.counter(
+    "weather_cache_lookups_total", "Weather cache lookups by cache (geocode or forecast) and result (hit, miss or coalesced).", ("cache", "result")
+)
+
+
+class GeocodeCache:
+    """
+    SQLite-backed map of normalized location names to coordinates and display names. Coordinates
+    of a place do not change, so entries live for WEATHER_GEOCODE_TTL_SECONDS and survive restarts.
+    """
+
+    def __init__(self, db_path: str = WEATHER_GEOCODE_DB_PATH, ttl_seconds: float = WEATHER_GEOCODE_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._thread_local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS geocodes (
+                name TEXT PRIMARY KEY,
+                latitude REAL NOT NULL,
+                longitude REAL NOT NULL,
+                display_name TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._thread_local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._thread_local.conn = conn
+        return conn
+
+    def get(self, name: str):
+        """Returns {'latitude', 'longitude', 'name'} for a normalized name, or None if unknown or expired."""
+        row = self._connection().execute(
+            "SELECT latitude, longitude, display_name FROM geocodes WHERE name = ? AND updated_at >= ?",
+            (name, time.time() - self.ttl_seconds),
+        ).fetchone()
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return {'latitude': row[0], 'longitude': row[1], 'name': row[2]} if row else None
+
+    def set(self, name: str, place: dict):
+        self._connection().execute(
+            "INSERT OR REPLACE INTO geocodes (name, latitude, longitude, display_name, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (name, place['latitude'], place['longitude'], place['name'], time.time()),
+        )
+
+    def stats(self) -> dict:
+        entries = self._connection().execute("SELECT COUNT(*) FROM geocodes").fetchone()[0]
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_geocode_cache = None
+_geocode_cache_lock = threading.Lock()
+
+def _get_geocode_cache() -> GeocodeCache:
+    """Opens the geocode cache on first use, so importing this module does not create the database."""
+    global _geocode_cache
+    with _geocode_cache_lock:
+        if _geocode_cache is None:
+            _geocode_cache = GeocodeCache()
+        return _geocode_cache
+
+# Current weather keyed on rounded (latitude, longitude).
+_forecast_cache = TTLCache(max_size=WEATHER_FORECAST_CACHE_SIZE, ttl_seconds=WEATHER_FORECAST_TTL_SECONDS)
+# Simultaneous lookups of the same name or grid cell share one upstream call.
+_geocode_calls = SingleFlight()
+_forecast_calls = SingleFlight()
+
+# Upstream (open-meteo) calls and their latency, per endpoint.
+_upstream_stats = {endpoint: {'calls': 0, 'errors': 0, 'total_latency_ms': 0.0} for endpoint in ('geocode', 'forecast')}
+_upstream_stats_lock = threading.Lock()
+
+def normalize_location(location: str) -> str:
+    """Cache key for a location name: case-folded, punctuation and extra whitespace removed."""
+    words = re.sub(r"[^\w\s,'-]", " ", location.casefold()).split()
+    return re.sub(r"\s*,\s*", ", ", " ".join(words)).strip(" ,")
+
+def _fetch_json(endpoint: str, url: str, params: dict):
+    """GETs an open-meteo endpoint, timing it as a `weather.<endpoint>` span and in the upstream stats."""
+    start = time.perf_counter()
+    error = False
+    try:
+        with tracing.span(f"weather.{endpoint}"):
+            response = http_client.get(url, params=params, timeout=WEATHER_HTTP_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+    except Exception:
+        error = True
+        raise
+    finally:
+        with _upstream_stats_lock:
+            stats = _upstream_stats[endpoint]
+            stats['calls'] += 1
+            stats['errors'] += error
+            stats['total_latency_ms'] += (time.perf_counter() - start) * 1000
+
+def _geocode_upstream(key: str, location: str):
+    geo_params = {"name": location, "count": 1, "language": "en", "format": "json"}
+    geo_data = _fetch_json('geocode', GEOCODING_API_URL, geo_params)
+    if not geo_data.get("results"):
+        return None
+    result = geo_data["results"][0]
+    display_name = result.get("name", location)
+    country = result.get("country", "")
+    admin1 = result.get("admin1", "")
+    place = {
+        'latitude': result["latitude"],
+        'longitude': result["longitude"],
+        'name': f"{display_name}{f', {admin1}' if admin1 and admin1 != display_name else ''}{f', {country}' if country else ''}",
+    }
+    _get_geocode_cache().set(key, place)
+    return place
+
+def geocode(location: str):
+    """Returns {'latitude', 'longitude', 'name'} for a location name, or None if open-meteo does not know it."""
+    key = normalize_location(location)
+    place = _get_geocode_cache().get(key)
+    if place:
+        weather_cache_lookups.inc(cache='geocode', result='hit')
+        return place
+    place, shared = _geocode_calls.do(key, lambda: _geocode_upstream(key, location))
+    weather_cache_lookups.inc(cache='geocode', result='coalesced' if shared else 'miss')
+    return place
+
+def _forecast_upstream(key: tuple):
+    weather_params = {
+        "latitude": key[0],
+        "longitude": key[1],
+        "current_weather": "true",
+        "temperature_unit": "celsius", # Or fahrenheit
+        "windspeed_unit": "kmh",
+        "precipitation_unit": "mm",
+        "timezone": "auto"
+    }
+    current = _fetch_json('forecast', WEATHER_API_URL, weather_params).get("current_weather")
+    if current:
+        _forecast_cache.set(key, current)
+    return current
+
+def get_current_weather(latitude: float, longitude: float):
+    """Returns open-meteo's `current_weather` for the coordinates' grid cell, reusing it for WEATHER_FORECAST_TTL_SECONDS."""
+    key = (round(latitude, WEATHER_COORDINATE_DECIMALS), round(longitude, WEATHER_COORDINATE_DECIMALS))
+    current = _forecast_cache.get(key)
+    if current:
+        weather_cache_lookups.inc(cache='forecast', result='hit')
+        return current
+    current, shared = _forecast_calls.do(key, lambda: _forecast_upstream(key))
+    weather_cache_lookups.inc(cache='forecast', result='coalesced' if shared else 'miss')
+    return current
+
+def _forecast_upstream_batch(keys: list) -> dict:
+    """Fetches several grid cells in one open-meteo request with comma-separated coordinates."""
+    if len(keys) == 1:
+        return {keys[0]: _forecast_upstream(keys[0])}
+    weather_params = {
+        "latitude": ",".join(str(key[0]) for key in keys),
+        "longitude": ",".join(str(key[1]) for key in keys),
+        "current_weather": "true",
+        "temperature_unit": "celsius",
+        "windspeed_unit": "kmh",
+        "precipitation_unit": "mm",
+        "timezone": "auto"
+    }
+    replies = _fetch_json('forecast', WEATHER_API_URL, weather_params)
+    if isinstance(replies, dict):
+        replies = [replies] # Some deployments answer a single object when every coordinate is the same cell
+    currents = {}
+    for key, reply in zip(keys, replies):
+        currents[key] = reply.get("current_weather")
+        if currents[key]:
+            _forecast_cache.set(key, currents[key])
+    return currents
+
+def get_current_weather_batch(coordinates: list) -> list:
+    """
+    get_current_weather for several (latitude, longitude) pairs: cached grid cells are reused,
+    cells another lookup is already fetching are joined, and the rest are fetched in one request.
+    Returns the `current_weather` dicts (or None) in the order given.
+    """
+    keys = [(round(latitude, WEATHER_COORDINATE_DECIMALS), round(longitude, WEATHER_COORDINATE_DECIMALS)) for latitude, longitude in coordinates]
+    currents = {key: _forecast_cache.get(key) for key in dict.fromkeys(keys)}
+    missing = [key for key, current in currents.items() if not current]
+    for _ in range(len(currents) - len(missing)):
+        weather_cache_lookups.inc(cache='forecast', result='hit')
+    if missing:
+        fetched, shared = _forecast_calls.do_many(missing, _forecast_upstream_batch)
+        for key in missing:
+            weather_cache_lookups.inc(cache='forecast', result='coalesced' if key in shared else 'miss')
+        currents.update(fetched)
+    return [currents[key] for key in keys]
+
+def get_weather_stats() -> dict:
+    """Hit rates of the geocode and forecast caches, calls saved by coalescing, and open-meteo latency."""
+    with _upstream_stats_lock:
+        upstream = {
+            endpoint: {
+                'calls': data['calls'],
+                'errors': data['errors'],
+                'avg_latency_ms': round(data['total_latency_ms'] / data['calls'], 3) if data['calls'] else 0.0,
+            }
+            for endpoint, data in _upstream_stats.items()
+        }
+    return {
+        'geocode_cache': {**_get_geocode_cache().stats(), 'coalesced': _geocode_calls.coalesced},
+        'forecast_cache': {**_forecast_cache.stats(), 'coalesced': _forecast_calls.coalesced},
+        'upstream': upstream,
+    }
+
+def _describe_weather(current: dict) -> str:
+    temp = current.get("temperature")
+    windspeed = current.get("windspeed")
+    weather_code = current.get("weathercode")
+    # See get_weather_description for the WMO weather codes open-meteo reports
+    return f"{get_weather_description(weather_code)}, Temperature: {temp}°C, Windspeed: {windspeed} km/h"
+
+def get_weather_for_locations(locations: list) -> str:
+    """
+    Current weather for several places in one answer: the names are geocoded concurrently and the
+    forecasts fetched in a single multi-coordinate request. Up to WEATHER_MAX_LOCATIONS places.
+    """
+    unique, seen = [], set()
+    for location in locations:
+        key = normalize_location(location or "")
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(location.strip())
+    if len(unique) <= 1:
+        return get_weather_data(unique[0] if unique else None)
+    dropped = unique[WEATHER_MAX_LOCATIONS:]
+    unique = unique[:WEATHER_MAX_LOCATIONS]
+
+    # Each worker runs in a copy of this context, so its geocode spans land in the request's trace.
+    with ThreadPoolExecutor(max_workers=len(unique), thread_name_prefix="weather-geocode") as pool:
+        futures = [pool.submit(contextvars.copy_context().run, geocode, location) for location in unique]
+    lines = {}
+    places = []
+    for location, future in zip(unique, futures):
+        try:
+            place = future.result()
+        except requests.exceptions.RequestException as e:
+            print(f"Error geocoding {location}: {e}")
+            lines[location] = f"- {location}: Sorry, I'm having trouble looking this place up right now."
+            continue
+        except (AttributeError, KeyError, TypeError, sqlite3.Error) as e:
+            print(f"Error processing geocode for {location}: {e}")
+            lines[location] = f"- {location}: Sorry, there was an issue processing the location information for this place."
+            continue
+        if place:
+            places.append((location, place))
+        else:
+            lines[location] = f"- {location}: Sorry, I couldn't find geographic coordinates for this place."
+
+    try:
+        currents = get_current_weather_batch([(place['latitude'], place['longitude']) for _, place in places]) if places else []
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching weather data for {', '.join(unique)}: {e}")
+        return f"Sorry, I'm having trouble fetching the weather for {', '.join(unique)} right now."
+    except (AttributeError, KeyError, TypeError) as e:
+        print(f"Error parsing weather data for {', '.join(unique)}: {e}")
+        return f"Sorry, there was an issue processing the weather information for {', '.join(unique)}."
+    for (location, place), current in zip(places, currents):
+        if current:
+            lines[location] = f"- {place['name']}: {_describe_weather(current)}."
+        else:
+            lines[location] = f"- {place['name']}: Sorry, I couldn't get current weather data for this place."
+
+    answer = "The current weather:\n" + "\n".join(lines[location] for location in unique)
+    if dropped:
+        answer += f"\n(I can look up {WEATHER_MAX_LOCATIONS} places at a time, so I skipped {', '.join(dropped)}.)"
+    return answer
+
+def get_weather_data(location) -> str:
+    """
+    Current weather for a location name, from the geocode and forecast caches where possible. A
+    list of names is answered together by get_weather_for_locations.
+    """
+    if isinstance(location, (list, tuple)):
+        return get_weather_for_locations(list(location))
     if not location:
         return "I can get the weather for you, but I need a location!"
 
     try:
         # 1. Geocode location to latitude/longitude
-        geo_params = {"name": location, "count": 1, "language": "en", "format": "json"}
-        geo_response = requests.get(GEOCODING_API_URL, params=geo_params)
-        geo_response.raise_for_status()
-        geo_data = geo_response.json()
-
-        if not geo_data.get("results"):
+        place = geocode(location)
+        if not place:
             return f"Sorry, I couldn't find geographic coordinates for '{location}'."
-
-        lat = geo_data["results"][0]["latitude"]
-        lon = geo_data["results"][0]["longitude"]
-        display_name = geo_data["results"][0].get("name", location)
-        country = geo_data["results"][0].get("country", "")
-        admin1 = geo_data["results"][0].get("admin1", "")
-        full_loc_name = f"{display_name}{f', {admin1}' if admin1 and admin1 != display_name else ''}{f', {country}' if country else ''}"
+        full_loc_name = place['name']
 
         # 2. Get weather for the coordinates
-        weather_params = {
-            "latitude": lat,
-            "longitude": lon,
-            "current_weather": "true",
-            "temperature_unit": "celsius", # Or fahrenheit
-            "windspeed_unit": "kmh",
-            "precipitation_unit": "mm",
-            "timezone": "auto"
-        }
-        weather_response = requests.get(WEATHER_API_URL, params=weather_params)
-        weather_response.raise_for_status()
-        weather_data = weather_response.json()
-
-        current = weather_data.get("current_weather")
+        current = get_current_weather(place['latitude'], place['longitude'])
         if not current:
             return f"Sorry, I found '{full_loc_name}' but couldn't get current weather data for it."
 
-        temp = current.get("temperature")
-        windspeed = current.get("windspeed")
-        weather_code = current.get("weathercode")
-        # You can add a mapping for weather_code to description
-        # (e.g., 0: Clear sky, 1: Mainly clear, etc. - See Open-Meteo docs)
-        weather_desc = get_weather_description(weather_code)
-        
-        return f"The current weather in {full_loc_name} is: {weather_desc}, Temperature: {temp}°C, Windspeed: {windspeed} km/h."
+        return f"The current weather in {full_loc_name} is: {_describe_weather(current)}."
 
     except requests.exceptions.RequestException as e:
         print(f"Error fetching weather data for {location}: {e}")
         return f"Sorry, I'm having trouble fetching the weather for {location} right now."
-    except (KeyError, IndexError) as e:
+    except (KeyError, IndexError, sqlite3.Error) as e:
         print(f"Error parsing weather data for {location}: {e}")
         return f"Sorry, there was an issue processing the weather information for {location}."
 
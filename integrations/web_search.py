@@ -1,9 +1,10 @@
+import os
 import requests
 import urllib.parse
 import json
 import re
 
-DUCKDUCKGO_API_URL = "https://api.duckduckgo.com/"
+DUCKDUCKGO_API_URL = os.getenv("DUCKDUCKGO_API_URL", "https://api.duckduckgo.com/") # Overridable for benchmarks
 
 def search_web(query: str, full_user_message: str = "") -> str:
     """Action for performing a web search."""
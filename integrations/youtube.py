@@ -1,7 +1,8 @@
+import asyncio
 from youtube_transcript_api import YouTubeTranscriptApi
 from youtube_transcript_api._errors import TranscriptsDisabled, NoTranscriptFound
 from xml.etree.ElementTree import ParseError
-from llm import get_ollama_response, GENERATOR_MODEL_NAME
+from llm import get_ollama_response, stream_ollama_response, async_get_ollama_response, async_stream_ollama_response, GENERATOR_MODEL_NAME
 
 def get_transcript(video_id: str) -> (str, str):
     """Fetches the transcript for a given YouTube video ID."""
@@ -17,6 +18,21 @@ def get_transcript(video_id: str) -> (str, str):
         print(f"YouTube Transcript Error: {e}")
         return None, f"An unexpected error occurred while fetching the transcript: {e}"
 
+def _build_youtube_prompt(transcript: str, question: str) -> str:
+    """Builds the transcript-grounded Q&A prompt sent to the generator model."""
+    return f'''
+Context: The following is the transcript of a YouTube video.
+---
+{transcript}
+---
+Based SOLELY on the transcript provided, answer the following question.
+Do not use any external knowledge. If the answer is not in the transcript, say "The answer is not mentioned in the video transcript."
+
+Question: "{question}"
+
+Answer:
+'''
+
 def handle_youtube_query(video_id: str, question: str) -> str:
     """
     Handles a user's question about a YouTube video by fetching its transcript
@@ -30,20 +46,49 @@ def handle_youtube_query(video_id: str, question: str) -> str:
         return "Sorry, I couldn't retrieve the transcript to answer your question."
 
     # Use the LLM to answer the question using the transcript as context.
-    prompt = f'''
-Context: The following is the transcript of a YouTube video.
----
-{transcript}
----
-Based SOLELY on the transcript provided, answer the following question.
-Do not use any external knowledge. If the answer is not in the transcript, say "The answer is not mentioned in the video transcript."
-
-Question: "{question}"
-
-Answer:
-'''
+    prompt = _build_youtube_prompt(transcript, question)
     
     print(f"YouTube Integration: Sending prompt to LLM for video ID {video_id}.")
-    llm_response = get_ollama_response(prompt, model_name=GENERATOR_MODEL_NAME)
+    llm_response = get_ollama_response(prompt, model_name=GENERATOR_MODEL_NAME, priority='interactive')
     
-    return llm_response 
\ No newline at end of file
+    return llm_response
+
+def stream_youtube_query(video_id: str, question: str):
+    """Streaming variant of handle_youtube_query; yields the answer in chunks as the model produces it."""
+    transcript, error = get_transcript(video_id)
+    if error:
+        yield error
+        return
+
+    if not transcript:
+        yield "Sorry, I couldn't retrieve the transcript to answer your question."
+        return
+
+    print(f"YouTube Integration: Streaming LLM answer for video ID {video_id}.")
+    yield from stream_ollama_response(_build_youtube_prompt(transcript, question), model_name=GENERATOR_MODEL_NAME, priority='interactive')
+
+
+async def async_handle_youtube_query(video_id: str, question: str) -> str:
+    """handle_youtube_query for the ASGI server. The transcript library is sync, so it runs in the default (bounded) executor."""
+    transcript, error = await asyncio.to_thread(get_transcript, video_id)
+    if error:
+        return error
+    if not transcript:
+        return "Sorry, I couldn't retrieve the transcript to answer your question."
+
+    print(f"YouTube Integration: Sending prompt to LLM for video ID {video_id}.")
+    return await async_get_ollama_response(_build_youtube_prompt(transcript, question), model_name=GENERATOR_MODEL_NAME, priority='interactive')
+
+async def async_stream_youtube_query(video_id: str, question: str):
+    """stream_youtube_query for the ASGI server, as an async generator."""
+    transcript, error = await asyncio.to_thread(get_transcript, video_id)
+    if error:
+        yield error
+        return
+    if not transcript:
+        yield "Sorry, I couldn't retrieve the transcript to answer your question."
+        return
+
+    print(f"YouTube Integration: Streaming LLM answer for video ID {video_id}.")
+    async for delta in async_stream_ollama_response(_build_youtube_prompt(transcript, question), model_name=GENERATOR_MODEL_NAME, priority='interactive'):
+        yield delta
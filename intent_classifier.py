@@ -0,0 +1,176 @@
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+from integrations.bible_index import find_reference
+
+# Confidence the local statistical tier needs before its answer is trusted over the LLM. 0.60 is the
+# lowest value with no wrong answers on the held-out set of benchmarks/nlu_calibration.py.
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("NLU_LOCAL_CONFIDENCE_THRESHOLD", "0.60"))
+# Minimum gap between the best and the runner-up intent, so near-ties still escalate to the LLM.
+LOCAL_MIN_MARGIN = float(os.getenv("NLU_LOCAL_MIN_MARGIN", "0.15"))
+
+YOUTUBE_URL_REGEX = r'(?:https?:\/\/)?(?:www\.)?(?:youtube\.com\/(?:[^\/\n\s]+\/\S+\/|(?:v|e(?:mbed)?)\/|\S*?[?&]v=)|youtu\.be\/)([a-zA-Z0-9_-]{11})'
+
+# Time words around the place in a weather question. The location capture stops before them, so
+# "London tomorrow" is not geocoded as a place.
+_TIME_PHRASE = (
+    r"(?:today|tonight|tomorrow(?:\s+(?:morning|afternoon|evening|night))?|(?:right\s+)?now|currently|later(?:\s+today)?"
+    r"|at\s+the\s+moment|this\s+(?:morning|afternoon|evening|week|weekend)|next\s+week|over\s+the\s+weekend"
+    r"|on\s+(?:monday|tuesday|wednesday|thursday|friday|saturday|sunday))"
+)
+_WEATHER_REGEX = re.compile(
+    rf"\bweather\b(?:\s+(?:like|forecast))?(?:\s+{_TIME_PHRASE})?\s+(?:in|for|at)\s+(?P<location>[^?!.]+?)"
+    rf"(?:\s*,?\s+{_TIME_PHRASE})?(?:\s*,?\s+please)?\s*[?!.]*$",
+    re.IGNORECASE,
+)
+# Words that do not belong in a place name: a location containing one has more of the sentence in it
+# ("London tomorrow and Friday", "Paris is it raining"), so the rule leaves the message to the next tier.
+_NOT_PLACE_REGEX = re.compile(
+    rf"\b(?:{_TIME_PHRASE}|week|weekend|morning|afternoon|evening|night|tonight|will|should|would|is|are|was|do|does|did"
+    r"|going|need|i|me|my|you|it|if|so|but|because|please|what|how|when|like)\b",
+    re.IGNORECASE,
+)
+_MAX_PLACE_WORDS = 5
+# "London, Paris and Tokyo": a list is only assumed when it contains "and" or "&", so "Portland, Oregon" stays one place.
+_LOCATION_LIST_REGEX = re.compile(r"\band\b|&", re.IGNORECASE)
+_LOCATION_SEPARATOR_REGEX = re.compile(r"\s*(?:,|&|\band\b)\s*", re.IGNORECASE)
+_BIBLE_REGEX = re.compile(r"\bbible\b.*\bverses?\b|\bverses?\b.*\bbible\b|\bscripture\b", re.IGNORECASE)
+# Only a command starts AutoSCI (a background job of many LLM calls); questions about it fall through.
+_AUTOSCI_REGEX = re.compile(r"\b(?:activate|start|run|launch|enable|begin|turn\s+on)\s+(?:the\s+)?auto[\s-]?sci\b", re.IGNORECASE)
+_GREETING_REGEX = re.compile(
+    r"^\s*(?:hi|hello|hey|yo|howdy|good\s+(?:morning|afternoon|evening)|thanks|thank\s+you)"
+    r"(?:\s+(?:there|samantha))?[\s!.,]*$",
+    re.IGNORECASE,
+)
+_TOKEN_REGEX = re.compile(r"[a-z0-9']+")
+# "what's your name" and "what is your name" should share their tokens.
+_CONTRACTIONS = (
+    (re.compile(r"\b(he|she|it|that|there|what|who|where|how)'s\b"), r"\1 is"),
+    (re.compile(r"'re\b"), " are"),
+    (re.compile(r"'m\b"), " am"),
+    (re.compile(r"'ll\b"), " will"),
+    (re.compile(r"'ve\b"), " have"),
+    (re.compile(r"n't\b"), " not"),
+)
+# Intents only the rules tier may return: a near match must not start a background AutoSCI job.
+RULES_ONLY_INTENTS = {"autosci_mode"}
+
+
+def classify_with_rules(message: str):
+    """
+    Deterministic first tier. Returns (intent, entities) for messages whose intent is unambiguous
+    from their surface form, or None to fall through to the next tier.
+    """
+    yt_match = re.search(YOUTUBE_URL_REGEX, message)
+    if yt_match:
+        question = " ".join(message.replace(yt_match.group(0), " ").split())
+        return "query_youtube_video", {
+            "video_id": yt_match.group(1),
+            "question": question or "Summarize this video.",
+        }
+
+    if _AUTOSCI_REGEX.search(message):
+        return "autosci_mode", {}
+
+    weather_match = _WEATHER_REGEX.search(message)
+    if weather_match:
+        location = weather_match.group("location").strip(" ,")
+        if location and _is_place_name(location):
+            if _LOCATION_LIST_REGEX.search(location):
+                locations = [part for part in _LOCATION_SEPARATOR_REGEX.split(location) if part]
+                if len(locations) > 1:
+                    return "get_weather", {"locations": locations}
+            return "get_weather", {"location": location}
+
+    if _BIBLE_REGEX.search(message):
+        reference = find_reference(message)
+        return "get_bible_verse", {"reference": reference} if reference else {}
+
+    if _GREETING_REGEX.match(message):
+        return "casual_chat", {}
+
+    return None
+
+
+def _is_place_name(location: str) -> bool:
+    """False when the captured location carries more of the sentence than the place (or places) itself."""
+    if _NOT_PLACE_REGEX.search(location):
+        return False
+    return all(len(part.split()) <= _MAX_PLACE_WORDS for part in _LOCATION_SEPARATOR_REGEX.split(location))
+
+
+def _tokenize(text: str) -> list[str]:
+    text = text.lower().replace("\u2019", "'")
+    for pattern, replacement in _CONTRACTIONS:
+        text = pattern.sub(replacement, text)
+    return _TOKEN_REGEX.findall(text)
+
+
+class LocalIntentClassifier:
+    """
+    A small TF-IDF nearest-example classifier trained from the `examples` in INTENT_DEFINITIONS.
+
+    It is the second tier: cheap enough to run on every message, and only trusted for intents that
+    need no entity extraction, because it cannot pull slot values out of the message (and never for
+    RULES_ONLY_INTENTS). benchmarks/nlu_calibration.py calibrates its confidence threshold.
+    """
+
+    def __init__(self, intent_definitions: dict):
+        self.examples = []  # (intent, tf-idf vector, vector norm)
+        self.idf = {}
+        self.unknown_idf = 1.0  # Weight for words never seen in training; they count against confidence
+        self.local_intents = {
+            name for name, details in intent_definitions.items() if not details.get("entities") and name not in RULES_ONLY_INTENTS
+        }
+        self._fit(intent_definitions)
+
+    def _fit(self, intent_definitions: dict):
+        documents = []
+        for name, details in intent_definitions.items():
+            for example in details.get("examples", []):
+                documents.append((name, _tokenize(example)))
+
+        document_frequency = Counter()
+        for _, tokens in documents:
+            document_frequency.update(set(tokens))
+        num_documents = len(documents) or 1
+        self.idf = {token: math.log((1 + num_documents) / (1 + df)) + 1 for token, df in document_frequency.items()}
+        self.unknown_idf = math.log(1 + num_documents) + 1
+
+        for name, tokens in documents:
+            vector = self._vectorize(tokens)
+            norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+            if norm:
+                self.examples.append((name, vector, norm))
+
+    def _vectorize(self, tokens: list[str]) -> dict:
+        counts = Counter(tokens)
+        return {token: count * self.idf.get(token, self.unknown_idf) for token, count in counts.items()}
+
+    def predict(self, message: str) -> tuple[str, float, float]:
+        """Returns (best_intent, confidence, margin_over_runner_up). Confidence is a cosine similarity in [0, 1]."""
+        vector = self._vectorize(_tokenize(message))
+        norm = math.sqrt(sum(weight * weight for weight in vector.values()))
+        if not norm:
+            return None, 0.0, 0.0
+
+        best_by_intent = defaultdict(float)
+        for name, example_vector, example_norm in self.examples:
+            dot = sum(weight * example_vector.get(token, 0.0) for token, weight in vector.items())
+            best_by_intent[name] = max(best_by_intent[name], dot / (norm * example_norm))
+
+        ranked = sorted(best_by_intent.items(), key=lambda item: item[1], reverse=True)
+        best_intent, best_score = ranked[0]
+        runner_up_score = ranked[1][1] if len(ranked) > 1 else 0.0
+        return best_intent, best_score, best_score - runner_up_score
+
+    def classify(self, message: str):
+        """Returns (intent, entities, confidence) when confident enough to skip the LLM, otherwise None."""
+        intent, confidence, margin = self.predict(message)
+        if intent is None or intent not in self.local_intents:
+            return None
+        if confidence < LOCAL_CONFIDENCE_THRESHOLD or margin < LOCAL_MIN_MARGIN:
+            return None
+        return intent, {}, confidence
@@ -0,0 +1,284 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+SCHEDULER_MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", "2"))  # Jobs running at once
+SCHEDULER_MAX_QUEUE_SIZE = int(os.getenv("SCHEDULER_MAX_QUEUE_SIZE", "20"))  # Jobs allowed to wait; more are rejected
+SCHEDULER_PER_CLIENT_LIMIT = int(os.getenv("SCHEDULER_PER_CLIENT_LIMIT", "3"))  # Jobs one client may run at once
+SCHEDULER_EXECUTOR = os.getenv("SCHEDULER_EXECUTOR", "thread")  # 'thread' or 'process'
+SCHEDULER_DEFAULT_RETRY_AFTER = 30  # Seconds suggested to rejected clients before any job duration is known
+
+# (job_id, cancel_event, progress_channel) of the job being run. A context variable rather than a
+# thread-local so that work the job fans out with contextvars.copy_context() (e.g. the problem
+# solver's prototype threads) still sees the job's cancel flag and progress channel.
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be admitted because the queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full. Retry in about {retry_after} seconds.")
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job at its next cancellation checkpoint after it was cancelled."""
+
+
+def raise_if_cancelled():
+    """
+    Cancellation checkpoint. Long-running code (e.g. every LLM call) calls this so a cancelled job
+    stops between steps. Outside a scheduled job it does nothing.
+    """
+    job = _current_job.get()
+    if job is not None and job[1].is_set():
+        raise JobCancelled("Job was cancelled.")
+
+
+def report_progress(event: str, **data):
+    """
+    Publishes a progress event for the job running in this thread (or child process). The
+    scheduler forwards it to the job's `on_progress` callback in the parent process. Outside a
+    scheduled job it does nothing.
+    """
+    job = _current_job.get()
+    if job is not None:
+        job_id, _, channel = job
+        channel.put((job_id, event, data))
+
+
+def _run_job(fn, args, kwargs, job_id, cancel_event, progress_channel):
+    """Runs a job with its cancel event and progress channel bound to the executing thread (or child process)."""
+    token = _current_job.set((job_id, cancel_event, progress_channel))
+    try:
+        raise_if_cancelled()
+        return fn(*args, **kwargs)
+    finally:
+        _current_job.reset(token)
+
+
+class _DirectProgressChannel:
+    """Progress channel for thread workers: delivers events synchronously in the worker thread."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    def put(self, item):
+        self.scheduler._deliver_progress(*item)
+
+
+class Job:
+    def __init__(self, group: str, index: int, fn, args: tuple, kwargs: dict, client_id: str, priority: int, sequence: int, on_start, on_done, on_progress, cancel_event):
+        self.job_id = str(uuid.uuid4())
+        self.group = group
+        self.index = index  # Position of this job within its group's submission
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.client_id = client_id
+        self.priority = priority
+        self.sequence = sequence
+        self.on_start = on_start
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event
+        self.status = 'queued'
+        self.started_at = None
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class JobScheduler:
+    """
+    A bounded job scheduler for long-running background work.
+
+    Jobs wait in a priority queue (lower `priority` runs first, FIFO within a priority) and are
+    dispatched to a thread or process pool while respecting a global worker limit and a per-client
+    concurrency limit. Submissions beyond the queue bound raise QueueFullError with a retry hint.
+    Jobs are organised in groups (e.g. all theories of one AutoSCI task) that can be cancelled and
+    asked for their queue position together.
+
+    Callbacks run in the parent process: `on_start(job)` when a job is dispatched,
+    `on_progress(job, event, data)` for every report_progress() call made by the job, and
+    `on_done(job, result, error)` when it finishes, where `error` is None, an exception, or a
+    JobCancelled instance.
+    """
+
+    def __init__(self, max_workers: int = SCHEDULER_MAX_WORKERS, max_queue_size: int = SCHEDULER_MAX_QUEUE_SIZE,
+                 per_client_limit: int = SCHEDULER_PER_CLIENT_LIMIT, executor_type: str = SCHEDULER_EXECUTOR):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.per_client_limit = per_client_limit
+        self.executor_type = executor_type
+        if executor_type == 'process':
+            # Child processes cannot see threading.Events, so cancel flags go through a manager.
+            import multiprocessing
+            self._manager = multiprocessing.Manager()
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+            # Progress from child processes arrives on one shared queue drained by a parent thread.
+            self._progress_channel = self._manager.Queue()
+            threading.Thread(target=self._drain_progress, daemon=True, name="job-progress").start()
+        else:
+            self._manager = None
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+            self._progress_channel = _DirectProgressChannel(self)
+        self._lock = threading.Lock()
+        self._queue = []  # heap of queued Jobs
+        self._running = {}  # job_id -> Job
+        self._running_per_client = {}
+        self._sequence = itertools.count()
+        self._completed_jobs = 0
+        self._total_run_seconds = 0.0
+
+    def _drain_progress(self):
+        while True:
+            try:
+                item = self._progress_channel.get()
+            except (EOFError, OSError):
+                return # Manager shut down
+            self._deliver_progress(*item)
+
+    def _deliver_progress(self, job_id: str, event: str, data: dict):
+        with self._lock:
+            job = self._running.get(job_id)
+        if job is not None and job.on_progress:
+            try:
+                job.on_progress(job, event, data)
+            except Exception as e:
+                print(f"Job Scheduler: on_progress callback for job {job_id} failed: {e}")
+
+    def _new_cancel_event(self):
+        return self._manager.Event() if self._manager else threading.Event()
+
+    def submit_group(self, group: str, calls: list, client_id: str = None, priority: int = 0, on_start=None, on_done=None, on_progress=None) -> list:
+        """
+        Admits a list of (fn, args) calls as one group, all or nothing. Returns their Jobs, whose
+        `index` is their position in `calls`. Raises QueueFullError if the queue cannot hold every call.
+        """
+        with self._lock:
+            if len(self._queue) + len(calls) > self.max_queue_size:
+                raise QueueFullError(self._retry_after_locked())
+            jobs = []
+            for index, (fn, args) in enumerate(calls):
+                job = Job(group, index, fn, tuple(args), {}, client_id, priority, next(self._sequence), on_start, on_done, on_progress, self._new_cancel_event())
+                heapq.heappush(self._queue, job)
+                jobs.append(job)
+        self._dispatch()
+        return jobs
+
+    def submit(self, group: str, fn, *args, client_id: str = None, priority: int = 0, on_start=None, on_done=None, on_progress=None) -> Job:
+        """Admits a single call. Raises QueueFullError if the queue is full."""
+        return self.submit_group(group, [(fn, args)], client_id=client_id, priority=priority,
+                                 on_start=on_start, on_done=on_done, on_progress=on_progress)[0]
+
+    def _dispatch(self):
+        """
+        Starts queued jobs while workers are free, skipping clients that are at their limit.
+        Jobs are claimed under the lock but launched outside it, because a job that finishes
+        immediately runs its done-callback (which takes the lock) in this thread.
+        """
+        to_launch, deferred = [], []
+        with self._lock:
+            while self._queue and len(self._running) < self.max_workers:
+                job = heapq.heappop(self._queue)
+                if self._running_per_client.get(job.client_id, 0) >= self.per_client_limit:
+                    deferred.append(job)
+                    continue
+                job.status = 'running'
+                job.started_at = time.monotonic()
+                self._running[job.job_id] = job
+                self._running_per_client[job.client_id] = self._running_per_client.get(job.client_id, 0) + 1
+                to_launch.append(job)
+            for job in deferred:
+                heapq.heappush(self._queue, job)
+        for job in to_launch:
+            self._launch(job)
+
+    def _launch(self, job: Job):
+        if job.on_start:
+            try:
+                job.on_start(job)
+            except Exception as e:
+                print(f"Job Scheduler: on_start callback for job {job.job_id} failed: {e}")
+        future = self._executor.submit(_run_job, job.fn, job.args, job.kwargs, job.job_id, job.cancel_event, self._progress_channel)
+        future.add_done_callback(lambda f, job=job: self._finish(job, f))
+
+    def _finish(self, job: Job, future):
+        error, result = None, None
+        try:
+            result = future.result()
+        except Exception as e:
+            error = e
+        with self._lock:
+            self._running.pop(job.job_id, None)
+            self._running_per_client[job.client_id] -= 1
+            if not self._running_per_client[job.client_id]:
+                del self._running_per_client[job.client_id]
+            self._completed_jobs += 1
+            self._total_run_seconds += time.monotonic() - job.started_at
+            job.status = 'cancelled' if isinstance(error, JobCancelled) else ('failed' if error else 'completed')
+        self._call_on_done(job, result, error)
+        self._dispatch()
+
+    def _call_on_done(self, job: Job, result, error):
+        if job.on_done:
+            try:
+                job.on_done(job, result, error)
+            except Exception as e:
+                print(f"Job Scheduler: on_done callback for job {job.job_id} failed: {e}")
+
+    def cancel_group(self, group: str) -> int:
+        """
+        Cancels every job in a group. Queued jobs are dropped immediately; running jobs stop at their
+        next cancellation checkpoint (between LLM calls). Returns how many jobs were cancelled.
+        """
+        with self._lock:
+            dropped = [job for job in self._queue if job.group == group]
+            self._queue = [job for job in self._queue if job.group != group]
+            heapq.heapify(self._queue)
+            running = [job for job in self._running.values() if job.group == group]
+            for job in running:
+                job.cancel_event.set()
+        for job in dropped:
+            job.status = 'cancelled'
+            self._call_on_done(job, None, JobCancelled("Job was cancelled before it started."))
+        return len(dropped) + len(running)
+
+    def queue_position(self, group: str):
+        """1-based position of the group's first queued job, or None if nothing in the group is waiting."""
+        with self._lock:
+            ordered = sorted(self._queue)
+        for position, job in enumerate(ordered, start=1):
+            if job.group == group:
+                return position
+        return None
+
+    def _retry_after_locked(self) -> int:
+        if not self._completed_jobs:
+            return SCHEDULER_DEFAULT_RETRY_AFTER
+        average_run_seconds = self._total_run_seconds / self._completed_jobs
+        # Roughly one queue slot frees up every average_run_seconds / max_workers.
+        return max(1, int(average_run_seconds / max(1, self.max_workers)))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'queued': len(self._queue),
+                'running': len(self._running),
+                'max_workers': self.max_workers,
+                'max_queue_size': self.max_queue_size,
+                'completed_jobs': self._completed_jobs,
+                'avg_run_seconds': round(self._total_run_seconds / self._completed_jobs, 2) if self._completed_jobs else None,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+        if self._manager:
+            self._manager.shutdown()
@@ -1,7 +1,13 @@
 import requests
 import json
 import os
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
+import http_client
+import tracing
+from llm_router import LLMRouter, current_priority
+from job_scheduler import raise_if_cancelled
 
 if not load_dotenv():
     print("Error loading .env file. Ensure it contains OLLAMA_API_URL, POW, PRIVATE_KEY, GEN_MODEL, and THINK_MODEL.")
@@ -12,37 +18,296 @@ OLLAMA_API_URL = os.getenv("OLLAMA_API_URL")
 GENERATOR_MODEL_NAME = os.getenv("GEN_MODEL")
 # Advanced model for critical thinking, evaluation, and complex tasks
 THINKER_MODEL_NAME = os.getenv("THINK_MODEL")
+# (connect, read) timeouts for LLM calls. The read timeout bounds a single completion so a hung
+# backend can no longer pin an executor worker forever.
+OLLAMA_TIMEOUT = (
+    float(os.getenv("OLLAMA_CONNECT_TIMEOUT", str(http_client.HTTP_CONNECT_TIMEOUT))),
+    float(os.getenv("OLLAMA_READ_TIMEOUT", str(http_client.HTTP_READ_TIMEOUT))),
+)
+# How long Ollama keeps a model, and with it the KV cache of the last prompt prefix, loaded after a
+# call. Sending the same value every time avoids reloads that would throw the cached prefix away.
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
 
-def get_ollama_response(prompt: str, model_name: str = GENERATOR_MODEL_NAME) -> str:
-    """Gets a response from the Ollama API, allowing model selection."""
-    response = None # Initialize response to None to handle cases where the request itself fails early
+# Routes each model's calls across its backends (GEN_MODEL_BACKENDS / THINK_MODEL_BACKENDS, default
+# OLLAMA_API_URL) by least outstanding requests, with failing-node ejection and per-model
+# concurrency caps (GEN_MODEL_MAX_CONCURRENCY / THINK_MODEL_MAX_CONCURRENCY).
+llm_router = LLMRouter.from_env(OLLAMA_API_URL, {'GEN_MODEL': GENERATOR_MODEL_NAME, 'THINK_MODEL': THINKER_MODEL_NAME})
+
+def _is_backend_failure(error: Exception) -> bool:
+    """Connection errors, timeouts and 5xx count against a backend's health; 4xx are the request's fault."""
+    response = getattr(error, 'response', None)
+    return response is None or response.status_code >= 500
+
+def get_ollama_response(prompt: str, model_name: str = GENERATOR_MODEL_NAME, priority: str = None, system: str = None, history: list = None) -> str:
+    """
+    Gets a response from the Ollama API, allowing model selection. `priority` ('interactive',
+    'normal' or 'background') orders the call when the backends are busy; it defaults to the
+    class set with llm_priority().
+
+    `system` is sent as a separate system message ahead of `prompt`. Callers put the part of a
+    prompt that repeats across calls there, so the backend can reuse its cached prefix and only
+    evaluate the short variable user message. `history` holds earlier conversation turns
+    ({'role', 'content'} dicts) sent between the two.
+    """
+    content, _ = get_ollama_completion(prompt, model_name=model_name, priority=priority, system=system, history=history)
+    return content
+
+def _usage_from_response(data: dict, prompt: str, content: str) -> dict:
+    """Token usage reported by the backend, estimated at ~4 characters per token if it reports none."""
+    usage = data.get('usage') or {}
+    prompt_tokens = usage.get('prompt_tokens', len(prompt) // 4)
+    completion_tokens = usage.get('completion_tokens', len(content) // 4)
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': usage.get('total_tokens', prompt_tokens + completion_tokens),
+    }
+
+@contextmanager
+def _llm_span(model_name: str, priority: str, stream: bool):
+    """
+    Traces one LLM call as an 'llm' span. Callers add queue_ms (time waiting for a backend slot)
+    and pass the usage to _record_llm_usage(). Started with start_span() because a streamed call
+    stays open across yields.
+    """
+    call_span = tracing.start_span('llm', model=model_name, priority=priority or current_priority(), stream=stream)
     try:
-        response = requests.post(
-            f"{OLLAMA_API_URL}/chat/completions",
-            json={
-                "model": model_name,
-                "messages": [{"role": "user", "content": prompt}],
-                "stream": False, 
-            },
-            headers={"Content-Type": "application/json"}
-        )
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
-        data = response.json() # This is where JSONDecodeError can occur
-        return data['choices'][0]['message']['content'].strip()
-    except requests.exceptions.JSONDecodeError as e: # Specific catch for JSON decoding errors
-        print(f"JSONDecodeError: Failed to decode Ollama response (model: {model_name}). Error: {e}")
-        if response is not None:
-            print(f"Ollama raw response text: {response.text}")
-        return f"Sorry, I received a malformed response from my brain ({model_name}). Check logs for details."
-    except requests.exceptions.RequestException as e: # For other network/HTTP errors (e.g., connection, timeout, non-200 status if raise_for_status hits)
-        print(f"RequestException: Error communicating with Ollama (model: {model_name}): {e}")
-        if response is not None: # If response exists, it might have useful info despite the exception
-            print(f"Ollama response status code: {response.status_code}")
-            print(f"Ollama response text (on RequestException): {response.text}")
-        return f"Sorry, I'm having trouble connecting to my brain ({model_name}) right now."
-    except (KeyError, IndexError) as e: # For issues with expected response structure AFTER successful JSON parsing
-        print(f"DataStructureError: Error parsing Ollama response structure (model: {model_name}): {e}")
-        # It might also be useful to print response.text here if parsing the structure fails
-        if response is not None and hasattr(response, 'text'):
-             print(f"Ollama raw response text (for structure error): {response.text}")
-        return f"Sorry, I received an unexpected response structure from my brain ({model_name})." 
\ No newline at end of file
+        yield call_span
+    except Exception as e:
+        call_span.fail(e)
+        raise
+    finally:
+        call_span.end()
+        tracing.llm_duration.observe(call_span.duration, model=model_name)
+
+def _record_llm_usage(call_span, model_name: str, usage: dict, first_byte_seconds: float):
+    call_span.set(prompt_tokens=usage['prompt_tokens'], completion_tokens=usage['completion_tokens'])
+    tracing.llm_tokens.inc(usage['prompt_tokens'], model=model_name, kind='prompt')
+    tracing.llm_tokens.inc(usage['completion_tokens'], model=model_name, kind='completion')
+    if first_byte_seconds is not None:
+        call_span.set(ttfb_ms=round(first_byte_seconds * 1000, 3))
+        tracing.llm_time_to_first_byte.observe(first_byte_seconds, model=model_name)
+
+def _prompt_text(prompt: str, system: str = None, history: list = None) -> str:
+    """Everything sent as the prompt, for token estimates."""
+    return (system or "") + "".join(turn.get('content', '') for turn in history or []) + prompt
+
+def _chat_payload(prompt: str, model_name: str, stream: bool, system: str = None, response_format: dict = None, history: list = None) -> dict:
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.extend(history or []) # Earlier {'role', 'content'} turns of the conversation, oldest first
+    messages.append({"role": "user", "content": prompt})
+    payload = {
+        "model": model_name,
+        "messages": messages,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    }
+    if response_format:
+        payload["response_format"] = response_format # e.g. a JSON schema the backend constrains decoding to
+    return payload
+
+def _parse_stream_line(line: str):
+    """
+    Parses one line of an OpenAI-style SSE stream. Returns (done, delta): `done` is True at the
+    `data: [DONE]` terminator, and `delta` is the content chunk or None for lines without one.
+    """
+    if not line or not line.startswith("data:"):
+        return False, None # Skip keep-alive blank lines and SSE comments
+    data_str = line[len("data:"):].strip()
+    if data_str == "[DONE]":
+        return True, None
+    chunk = json.loads(data_str)
+    if not chunk.get('choices'):
+        return False, None
+    return False, chunk['choices'][0].get('delta', {}).get('content')
+
+def get_ollama_completion(prompt: str, model_name: str = GENERATOR_MODEL_NAME, priority: str = None, system: str = None, history: list = None) -> tuple[str, dict]:
+    """
+    Like get_ollama_response, but also returns the token usage of the call as a dict with
+    `prompt_tokens`, `completion_tokens` and `total_tokens` (all zero if the call failed).
+    """
+    raise_if_cancelled() # Lets a cancelled background job stop between LLM calls
+    empty_usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+    response = None # Initialize response to None to handle cases where the request itself fails early
+    with _llm_span(model_name, priority, stream=False) as call_span, llm_router.lease(model_name, priority=priority) as lease:
+        call_span.set(queue_ms=call_span.elapsed_ms())
+        try:
+            sent = time.perf_counter()
+            response = http_client.post_json(
+                f"{lease.url}/chat/completions",
+                _chat_payload(prompt, model_name, stream=False, system=system, history=history),
+                timeout=OLLAMA_TIMEOUT,
+            )
+            response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+            data = response.json() # This is where JSONDecodeError can occur
+            content = data['choices'][0]['message']['content'].strip()
+            usage = _usage_from_response(data, _prompt_text(prompt, system, history), content)
+            _record_llm_usage(call_span, model_name, usage, time.perf_counter() - sent)
+            return content, usage
+        except requests.exceptions.JSONDecodeError as e: # Specific catch for JSON decoding errors
+            print(f"JSONDecodeError: Failed to decode Ollama response (model: {model_name}). Error: {e}")
+            call_span.fail(e)
+            if response is not None:
+                print(f"Ollama raw response text: {response.text}")
+            return f"Sorry, I received a malformed response from my brain ({model_name}). Check logs for details.", empty_usage
+        except requests.exceptions.RequestException as e: # For other network/HTTP errors (e.g., connection, timeout, non-200 status if raise_for_status hits)
+            print(f"RequestException: Error communicating with Ollama (model: {model_name}): {e}")
+            call_span.fail(e)
+            if _is_backend_failure(e):
+                lease.mark_failed()
+            if response is not None: # If response exists, it might have useful info despite the exception
+                print(f"Ollama response status code: {response.status_code}")
+                print(f"Ollama response text (on RequestException): {response.text}")
+            return f"Sorry, I'm having trouble connecting to my brain ({model_name}) right now.", empty_usage
+        except (KeyError, IndexError) as e: # For issues with expected response structure AFTER successful JSON parsing
+            print(f"DataStructureError: Error parsing Ollama response structure (model: {model_name}): {e}")
+            call_span.fail(e)
+            # It might also be useful to print response.text here if parsing the structure fails
+            if response is not None and hasattr(response, 'text'):
+                 print(f"Ollama raw response text (for structure error): {response.text}")
+            return f"Sorry, I received an unexpected response structure from my brain ({model_name}).", empty_usage
+
+
+def stream_ollama_response(prompt: str, model_name: str = GENERATOR_MODEL_NAME, priority: str = None, system: str = None, response_format: dict = None, history: list = None):
+    """
+    Streams a response from the Ollama API, yielding content deltas as they arrive.
+
+    Uses the OpenAI-compatible `/chat/completions` endpoint with `"stream": True`, which replies with
+    server-sent events of the form `data: {...}` terminated by `data: [DONE]`. On failure a single
+    apology string is yielded, mirroring the error contract of get_ollama_response. Closing the
+    generator early ends the request and frees the backend slot.
+    """
+    response = None
+    streamed, first_byte = [], None
+    with _llm_span(model_name, priority, stream=True) as call_span, llm_router.lease(model_name, priority=priority) as lease:
+        call_span.set(queue_ms=call_span.elapsed_ms())
+        try:
+            sent = time.perf_counter()
+            response = http_client.post_json(
+                f"{lease.url}/chat/completions",
+                _chat_payload(prompt, model_name, stream=True, system=system, response_format=response_format, history=history),
+                timeout=OLLAMA_TIMEOUT,
+                stream=True,
+            )
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                done, delta = _parse_stream_line(line)
+                if done:
+                    break
+                if delta:
+                    if first_byte is None:
+                        first_byte = time.perf_counter() - sent
+                    streamed.append(delta)
+                    yield delta
+        except json.JSONDecodeError as e:
+            print(f"JSONDecodeError: Failed to decode Ollama stream chunk (model: {model_name}). Error: {e}")
+            call_span.fail(e)
+            yield f"Sorry, I received a malformed response from my brain ({model_name}). Check logs for details."
+        except requests.exceptions.RequestException as e:
+            print(f"RequestException: Error streaming from Ollama (model: {model_name}): {e}")
+            call_span.fail(e)
+            if _is_backend_failure(e):
+                lease.mark_failed()
+            if response is not None:
+                print(f"Ollama response status code: {response.status_code}")
+            yield f"Sorry, I'm having trouble connecting to my brain ({model_name}) right now."
+        except (KeyError, IndexError) as e:
+            print(f"DataStructureError: Error parsing Ollama stream chunk structure (model: {model_name}): {e}")
+            call_span.fail(e)
+            yield f"Sorry, I received an unexpected response structure from my brain ({model_name})."
+        finally:
+            if response is not None:
+                response.close() # Return the connection to the pool even if the consumer stops early
+            # Streams carry no usage block; estimate from what was sent and what arrived before any early stop.
+            _record_llm_usage(call_span, model_name, _usage_from_response({}, _prompt_text(prompt, system, history), "".join(streamed)), first_byte)
+
+
+# --- Async variants for the ASGI server. Same contracts, but waiting on the backend holds no thread. ---
+
+async def async_get_ollama_response(prompt: str, model_name: str = GENERATOR_MODEL_NAME, priority: str = None, system: str = None, history: list = None) -> str:
+    content, _ = await async_get_ollama_completion(prompt, model_name=model_name, priority=priority, system=system, history=history)
+    return content
+
+async def async_get_ollama_completion(prompt: str, model_name: str = GENERATOR_MODEL_NAME, priority: str = None, system: str = None, history: list = None) -> tuple[str, dict]:
+    """Async get_ollama_completion over the shared httpx client."""
+    import httpx  # Only needed when serving over ASGI; the Flask-only install does not have it
+    empty_usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+    response = None
+    with _llm_span(model_name, priority, stream=False) as call_span:
+        async with llm_router.async_lease(model_name, priority=priority) as lease:
+            call_span.set(queue_ms=call_span.elapsed_ms())
+            try:
+                sent = time.perf_counter()
+                response = await http_client.async_post_json(
+                    f"{lease.url}/chat/completions",
+                    _chat_payload(prompt, model_name, stream=False, system=system, history=history),
+                    timeout=OLLAMA_TIMEOUT,
+                )
+                response.raise_for_status()
+                data = response.json()
+                content = data['choices'][0]['message']['content'].strip()
+                usage = _usage_from_response(data, _prompt_text(prompt, system, history), content)
+                _record_llm_usage(call_span, model_name, usage, time.perf_counter() - sent)
+                return content, usage
+            except json.JSONDecodeError as e:
+                print(f"JSONDecodeError: Failed to decode Ollama response (model: {model_name}). Error: {e}")
+                call_span.fail(e)
+                if response is not None:
+                    print(f"Ollama raw response text: {response.text}")
+                return f"Sorry, I received a malformed response from my brain ({model_name}). Check logs for details.", empty_usage
+            except httpx.HTTPError as e:
+                print(f"HTTPError: Error communicating with Ollama (model: {model_name}): {e}")
+                call_span.fail(e)
+                if _is_backend_failure(e):
+                    lease.mark_failed()
+                if response is not None:
+                    print(f"Ollama response status code: {response.status_code}")
+                    print(f"Ollama response text (on HTTPError): {response.text}")
+                return f"Sorry, I'm having trouble connecting to my brain ({model_name}) right now.", empty_usage
+            except (KeyError, IndexError) as e:
+                print(f"DataStructureError: Error parsing Ollama response structure (model: {model_name}): {e}")
+                call_span.fail(e)
+                if response is not None:
+                     print(f"Ollama raw response text (for structure error): {response.text}")
+                return f"Sorry, I received an unexpected response structure from my brain ({model_name}).", empty_usage
+
+async def async_stream_ollama_response(prompt: str, model_name: str = GENERATOR_MODEL_NAME, priority: str = None, system: str = None, response_format: dict = None, history: list = None):
+    """Async stream_ollama_response: an async generator of content deltas."""
+    import httpx
+    streamed, first_byte = [], None
+    with _llm_span(model_name, priority, stream=True) as call_span:
+        async with llm_router.async_lease(model_name, priority=priority) as lease:
+            call_span.set(queue_ms=call_span.elapsed_ms())
+            try:
+                sent = time.perf_counter()
+                async with http_client.async_stream_post_json(
+                    f"{lease.url}/chat/completions",
+                    _chat_payload(prompt, model_name, stream=True, system=system, response_format=response_format, history=history),
+                    timeout=OLLAMA_TIMEOUT,
+                ) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        done, delta = _parse_stream_line(line)
+                        if done:
+                            break
+                        if delta:
+                            if first_byte is None:
+                                first_byte = time.perf_counter() - sent
+                            streamed.append(delta)
+                            yield delta
+            except json.JSONDecodeError as e:
+                print(f"JSONDecodeError: Failed to decode Ollama stream chunk (model: {model_name}). Error: {e}")
+                call_span.fail(e)
+                yield f"Sorry, I received a malformed response from my brain ({model_name}). Check logs for details."
+            except httpx.HTTPError as e:
+                print(f"HTTPError: Error streaming from Ollama (model: {model_name}): {e}")
+                call_span.fail(e)
+                if _is_backend_failure(e):
+                    lease.mark_failed()
+                yield f"Sorry, I'm having trouble connecting to my brain ({model_name}) right now."
+            except (KeyError, IndexError) as e:
+                print(f"DataStructureError: Error parsing Ollama stream chunk structure (model: {model_name}): {e}")
+                call_span.fail(e)
+                yield f"Sorry, I received an unexpected response structure from my brain ({model_name})."
+            finally:
+                _record_llm_usage(call_span, model_name, _usage_from_response({}, _prompt_text(prompt, system, history), "".join(streamed)), first_byte)
@@ -0,0 +1,358 @@
+import asyncio
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager, asynccontextmanager
+
+import http_client
+
+LLM_EJECT_AFTER_FAILURES = int(os.getenv("LLM_EJECT_AFTER_FAILURES", "3"))  # Consecutive failures before a backend is ejected
+LLM_EJECT_SECONDS = float(os.getenv("LLM_EJECT_SECONDS", "30"))  # How long an ejected backend gets no traffic
+LLM_HEALTH_CHECK_INTERVAL = float(os.getenv("LLM_HEALTH_CHECK_INTERVAL", "10"))  # Seconds between probes of ejected backends
+LLM_LATENCY_SMOOTHING = 0.2  # Weight of the newest sample in the moving latency average
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # Calls in flight toward all backends at once; 0 = unlimited
+LLM_INTERACTIVE_RESERVED = int(os.getenv("LLM_INTERACTIVE_RESERVED", "1"))  # Slots of that limit only interactive calls may take
+LLM_PRIORITY_AGING_SECONDS = float(os.getenv("LLM_PRIORITY_AGING_SECONDS", "15"))  # Each this-many seconds of waiting raises a call one class
+
+# Dispatch order when calls have to wait, best first.
+PRIORITY_CLASSES = ('interactive', 'normal', 'background')
+
+_priority = contextvars.ContextVar('llm_priority', default='normal')
+
+
+@contextmanager
+def llm_priority(priority_class: str):
+    """
+    Runs the enclosed LLM calls at the given priority class. The class follows the context, so it
+    also applies to calls made deep inside e.g. the problem solver, including its worker threads
+    (which copy the submitting context).
+    """
+    if priority_class not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class '{priority_class}'.")
+    token = _priority.set(priority_class)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def parse_backend_urls(value: str) -> list[str]:
+    """Splits a comma-separated list of OpenAI-compatible base URLs."""
+    return [url.strip().rstrip("/") for url in (value or "").split(",") if url.strip()]
+
+
+class LLMBackend:
+    """One Ollama (OpenAI-compatible) endpoint and its load and health counters."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.avg_latency_ms = None
+
+    def is_available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def stats(self, now: float) -> dict:
+        return {
+            'url': self.url,
+            'outstanding': self.outstanding,
+            'requests': self.requests,
+            'failures': self.failures,
+            'avg_latency_ms': round(self.avg_latency_ms, 1) if self.avg_latency_ms is not None else None,
+            'healthy': self.is_available(now),
+            'ejected_for_seconds': round(self.ejected_until - now, 1) if not self.is_available(now) else 0,
+        }
+
+
+class BackendLease:
+    """A request's claim on a backend. Call mark_failed() if the backend (not the request) was at fault."""
+
+    def __init__(self, backend: LLMBackend):
+        self.backend = backend
+        self.url = backend.url
+        self.failed = False
+        self.started = time.monotonic()
+
+    def mark_failed(self):
+        self.failed = True
+
+
+class ModelPool:
+    def __init__(self, model_name: str, urls: list[str], max_concurrency: int = 0):
+        self.model_name = model_name
+        self.backends = [LLMBackend(url) for url in urls]
+        self.max_concurrency = max_concurrency  # 0 means unlimited
+        self.in_flight = 0
+
+
+class _Waiter:
+    """A call waiting for a slot. Its rank improves the longer it waits, so background calls cannot starve."""
+
+    def __init__(self, pool: ModelPool, priority_class: str, sequence: int, loop: asyncio.AbstractEventLoop = None):
+        self.pool = pool
+        self.priority_class = priority_class
+        self.rank = PRIORITY_CLASSES.index(priority_class)
+        self.sequence = sequence
+        self.enqueued_at = time.monotonic()
+        # An async_lease() waiter sleeps on its own Event in its event loop instead of the Condition.
+        self.loop = loop
+        self.event = asyncio.Event() if loop is not None else None
+
+    def wake(self):
+        if self.event is not None:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+    def effective_rank(self, now: float) -> float:
+        return self.rank - (now - self.enqueued_at) / LLM_PRIORITY_AGING_SECONDS
+
+
+class LLMRouter:
+    """
+    Routes LLM calls for each model across its list of backends.
+
+    Each call goes to the healthy backend with the fewest outstanding requests (ties go to the
+    lower moving-average latency). A backend that fails LLM_EJECT_AFTER_FAILURES times in a row is
+    ejected for LLM_EJECT_SECONDS and probed in the background until it answers again. If every
+    backend is ejected, the one closest to coming back is used rather than failing outright.
+    Per-model concurrency caps make callers wait for a slot, so e.g. a burst of thinker-heavy
+    evolution jobs cannot occupy every generator slot.
+
+    On top of that, LLM_MAX_CONCURRENCY bounds the calls in flight across all models. Waiting
+    calls are admitted by priority class (interactive, then normal, then background, FIFO
+    within a class), with aging so a long-waiting background call eventually goes first, and
+    LLM_INTERACTIVE_RESERVED slots are kept free for interactive calls.
+    """
+
+    def __init__(self, default_urls: list[str], max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.default_urls = default_urls
+        self.max_concurrency = max_concurrency
+        self._pools = {}
+        self._condition = threading.Condition()
+        self._health_thread = None
+        self._in_flight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_env(cls, default_url: str, model_env: dict):
+        """
+        Builds a router from `<ROLE>_BACKENDS` and `<ROLE>_MAX_CONCURRENCY` variables, where
+        model_env maps an env prefix (e.g. 'GEN_MODEL') to its model name.
+        """
+        router = cls(parse_backend_urls(default_url))
+        for prefix, model_name in model_env.items():
+            if not model_name:
+                continue
+            urls = parse_backend_urls(os.getenv(f"{prefix}_BACKENDS", "")) or router.default_urls
+            router.add_model(model_name, urls, int(os.getenv(f"{prefix}_MAX_CONCURRENCY", "0")))
+        return router
+
+    def add_model(self, model_name: str, urls: list[str], max_concurrency: int = 0):
+        with self._condition:
+            pool = self._pools.get(model_name)
+            if pool is None:
+                self._pools[model_name] = ModelPool(model_name, urls, max_concurrency)
+                return
+            # The same model serves several roles: pool the backends and keep the stricter cap.
+            known = {backend.url for backend in pool.backends}
+            pool.backends.extend(LLMBackend(url) for url in urls if url not in known)
+            caps = [cap for cap in (pool.max_concurrency, max_concurrency) if cap]
+            pool.max_concurrency = min(caps) if caps else 0
+
+    def _pool_locked(self, model_name: str) -> ModelPool:
+        pool = self._pools.get(model_name)
+        if pool is None:
+            pool = self._pools[model_name] = ModelPool(model_name, self.default_urls)
+        return pool
+
+    def _has_capacity_locked(self, pool: ModelPool, priority_class: str) -> bool:
+        if pool.max_concurrency and pool.in_flight >= pool.max_concurrency:
+            return False
+        if not self.max_concurrency:
+            return True
+        limit = self.max_concurrency
+        if priority_class != 'interactive':
+            limit = max(1, limit - LLM_INTERACTIVE_RESERVED)
+        return self._in_flight < limit
+
+    def _try_acquire_locked(self, waiter: _Waiter):
+        """
+        Claims a slot and the least-loaded backend for the waiter, or returns None if it has to keep
+        waiting: its model or the global limit is full, or a better-ranked waiter could run first.
+        """
+        pool = waiter.pool
+        if not self._has_capacity_locked(pool, waiter.priority_class):
+            return None
+        now = time.monotonic()
+        for other in sorted(self._waiters, key=lambda w: (w.effective_rank(now), w.sequence)):
+            if other is waiter:
+                break
+            if self._has_capacity_locked(other.pool, other.priority_class):
+                return None
+        candidates = [backend for backend in pool.backends if backend.is_available(now)]
+        if not candidates:
+            candidates = [min(pool.backends, key=lambda backend: backend.ejected_until)]
+        backend = min(
+            candidates,
+            key=lambda backend: (backend.outstanding, backend.avg_latency_ms if backend.avg_latency_ms is not None else 0.0),
+        )
+        pool.in_flight += 1
+        self._in_flight += 1
+        backend.outstanding += 1
+        backend.requests += 1
+        return BackendLease(backend)
+
+    def _release(self, pool: ModelPool, lease: BackendLease):
+        backend = lease.backend
+        latency_ms = (time.monotonic() - lease.started) * 1000
+        eject = False
+        with self._condition:
+            pool.in_flight -= 1
+            self._in_flight -= 1
+            backend.outstanding -= 1
+            if lease.failed:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= LLM_EJECT_AFTER_FAILURES and backend.is_available(time.monotonic()):
+                    backend.ejected_until = time.monotonic() + LLM_EJECT_SECONDS
+                    eject = True
+            else:
+                backend.consecutive_failures = 0
+                if backend.avg_latency_ms is None:
+                    backend.avg_latency_ms = latency_ms
+                else:
+                    backend.avg_latency_ms += LLM_LATENCY_SMOOTHING * (latency_ms - backend.avg_latency_ms)
+            self._notify_all_locked()
+        if eject:
+            print(f"LLM Router: Ejecting backend {backend.url} for {LLM_EJECT_SECONDS:.0f}s after {backend.consecutive_failures} consecutive failures.")
+            self._ensure_health_checks()
+
+    def _notify_all_locked(self):
+        """Wakes every waiter to re-check for a slot: threads on the Condition, async waiters through their loop."""
+        self._condition.notify_all()
+        for waiter in self._waiters:
+            waiter.wake()
+
+    def _enqueue_locked(self, model_name: str, priority: str, loop: asyncio.AbstractEventLoop = None) -> _Waiter:
+        waiter = _Waiter(self._pool_locked(model_name), priority or current_priority(), next(self._sequence), loop)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _dequeue_locked(self, waiter: _Waiter):
+        self._waiters.remove(waiter)
+        self._notify_all_locked() # The next waiter in line may be able to run now
+
+    @contextmanager
+    def lease(self, model_name: str, priority: str = None):
+        """
+        Blocks until the call may run, then yields a BackendLease for the chosen backend.
+        `priority` defaults to the class set by llm_priority() (or 'normal').
+        """
+        with self._condition:
+            waiter = self._enqueue_locked(model_name, priority)
+            try:
+                lease = self._try_acquire_locked(waiter)
+                while lease is None:
+                    self._condition.wait()
+                    lease = self._try_acquire_locked(waiter)
+            finally:
+                self._dequeue_locked(waiter)
+        try:
+            yield lease
+        except Exception: # Not BaseException: a consumer closing a stream early is not a backend failure
+            lease.mark_failed()
+            raise
+        finally:
+            self._release(waiter.pool, lease)
+
+    @asynccontextmanager
+    async def async_lease(self, model_name: str, priority: str = None):
+        """
+        lease() for the ASGI server. Waits for a slot without blocking the event loop: the waiter's
+        Event is set (from whichever thread frees a slot) whenever it should re-check.
+        """
+        with self._condition:
+            waiter = self._enqueue_locked(model_name, priority, asyncio.get_running_loop())
+        try:
+            while True:
+                with self._condition:
+                    waiter.event.clear() # Under the lock, so a wake-up after this check is not lost
+                    lease = self._try_acquire_locked(waiter)
+                if lease is not None:
+                    break
+                await waiter.event.wait()
+        finally:
+            with self._condition:
+                self._dequeue_locked(waiter)
+        try:
+            yield lease
+        except Exception: # Not BaseException: a consumer closing a stream early is not a backend failure
+            lease.mark_failed()
+            raise
+        finally:
+            self._release(waiter.pool, lease)
+
+    def _ensure_health_checks(self):
+        with self._condition:
+            if self._health_thread is None or not self._health_thread.is_alive():
+                self._health_thread = threading.Thread(target=self._health_loop, daemon=True, name="llm-health")
+                self._health_thread.start()
+
+    def _health_loop(self):
+        """Probes ejected backends until none are left, reinstating each one that answers."""
+        while True:
+            time.sleep(LLM_HEALTH_CHECK_INTERVAL)
+            with self._condition:
+                now = time.monotonic()
+                ejected = [backend for pool in self._pools.values() for backend in pool.backends if not backend.is_available(now)]
+            if not ejected:
+                return
+            for backend in ejected:
+                if self._probe(backend.url):
+                    with self._condition:
+                        backend.ejected_until = 0.0
+                        backend.consecutive_failures = 0
+                        self._notify_all_locked()
+                    print(f"LLM Router: Backend {backend.url} is healthy again.")
+
+    @staticmethod
+    def _probe(url: str) -> bool:
+        try:
+            return http_client.get(f"{url}/models", timeout=(2, 5)).status_code < 500
+        except Exception:
+            return False
+
+    def stats(self) -> dict:
+        """
+        Global and per-class queue state, plus per-model slot usage with each backend's queue
+        depth, latency and health.
+        """
+        with self._condition:
+            now = time.monotonic()
+            return {
+                'max_concurrency': self.max_concurrency or None,
+                'in_flight': self._in_flight,
+                'waiting': {
+                    priority_class: sum(1 for waiter in self._waiters if waiter.priority_class == priority_class)
+                    for priority_class in PRIORITY_CLASSES
+                },
+                'models': {
+                    model_name: {
+                        'max_concurrency': pool.max_concurrency or None,
+                        'in_flight': pool.in_flight,
+                        'waiting': sum(1 for waiter in self._waiters if waiter.pool is pool),
+                        'backends': [backend.stats(now) for backend in pool.backends],
+                    }
+                    for model_name, pool in self._pools.items()
+                },
+            }
@@ -1,55 +1,351 @@
 import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
 from contextlib import AsyncExitStack
 from typing import Optional
 
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "60"))  # Seconds a Flask thread waits for a tool call
+MCP_HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30"))  # Seconds between pings to the server
+MCP_HEALTH_CHECK_TIMEOUT = float(os.getenv("MCP_HEALTH_CHECK_TIMEOUT", "5"))  # A ping slower than this counts as dead
+MCP_RECONNECT_BACKOFF = 1.0  # First delay before reconnecting; doubles after each failed attempt
+MCP_RECONNECT_MAX_BACKOFF = 30.0
+MCP_TOOL_CATALOG_TTL = float(os.getenv("MCP_TOOL_CATALOG_TTL", "300"))  # Seconds before the cached tool list is re-fetched
+
+class ToolCatalog:
+    """
+    An immutable snapshot of a server's tools, with the NLU prompt section and a fingerprint
+    computed once per fetch instead of once per message. Iterates like the list of tool dicts.
+    """
+
+    def __init__(self, tools: list):
+        self.tools = tools  # [{'name', 'description', 'input_schema', 'is_mcp'}]
+        self.prompt_section = "\n".join(f"- {tool['name']}: {tool['description']}" for tool in tools)
+        self.fingerprint = hashlib.sha1(
+            json.dumps(sorted((tool['name'], tool['description'] or '', json.dumps(tool.get('input_schema') or {}, sort_keys=True)) for tool in tools)).encode("utf-8")
+        ).hexdigest()
+        self.fetched_at = time.monotonic()
+
+    def __iter__(self):
+        return iter(self.tools)
+
+    def __len__(self):
+        return len(self.tools)
+
+    def age_seconds(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+EMPTY_TOOL_CATALOG = ToolCatalog([])
+
+class EventLoopThread:
+    """One asyncio event loop running forever on a daemon thread. Started on first use."""
+
+    def __init__(self, name: str = "mcp-client-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True, name=self.name).start()
+            return self._loop
+
+    def submit(self, coro):
+        """Schedules a coroutine on the loop from any other thread. Returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop())
+
+    def is_started(self) -> bool:
+        return self._loop is not None
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
 class MCPClient:
-    """A client for interacting with a Model Context Protocol (MCP) server."""
+    """
+    A client for interacting with a Model Context Protocol (MCP) server.
+
+    The server session lives on a long-lived event loop running on a background thread (its own,
+    or one shared with other clients), so any thread can issue overlapping requests through the
+    thread-safe `submit()`/`run()` API (or the `*_sync` helpers) without creating an event loop
+    per call. A supervisor task pings the server periodically and restarts the server process
+    with exponential backoff if it dies or stops answering.
+    """
+
+    def __init__(self, name: str = "default", loop_thread: Optional[EventLoopThread] = None):
+        """
+        Initializes the MCPClient.
 
-    def __init__(self):
-        """Initializes the MCPClient."""
+        Args:
+            name: Label used in logs and by MCPRegistry to namespace this server's tools.
+            loop_thread: Event loop to run on. If omitted, the client starts its own.
+        """
+        self.name = name
         self.session: Optional[ClientSession] = None
-        self.exit_stack = AsyncExitStack()
+        self.server_script_path: Optional[str] = None
+        self.status = 'disconnected'  # 'connecting', 'connected', 'reconnecting' or 'disconnected'
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        self.last_health_check: Optional[float] = None
+        self._owns_loop = loop_thread is None
+        self._loop_thread = loop_thread or EventLoopThread()
+        self._manager_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._tool_catalog: Optional[ToolCatalog] = None
+        self._tool_catalog_stale = False  # Set by a tools/list_changed notification
+        self._catalog_lock = threading.Lock()
+        self._catalog_refresh = None  # Future of the in-flight catalog refresh, shared by concurrent callers
+        self._background_tasks = set()
+        self._call_count = 0
+        self._call_errors = 0
+        self._total_call_latency_ms = 0.0
+        self._last_call_latency_ms: Optional[float] = None
+
+    # --- Thread-safe API (callable from any thread except the client's own loop) ---
+
+    def submit(self, coro):
+        """Schedules a coroutine on the client's event loop. Returns a concurrent.futures.Future."""
+        return self._loop_thread.submit(coro)
+
+    def run(self, coro, timeout: float = MCP_CALL_TIMEOUT):
+        """Runs a coroutine on the client's event loop and blocks until it finishes or times out."""
+        return self.submit(coro).result(timeout)
+
+    def start(self, server_script_path: str):
+        """
+        Starts connecting to an MCP server in the background and returns immediately.
+        Returns a future that resolves once the first connection attempt has succeeded or failed.
+        """
+        self._validate_script_path(server_script_path)
+        return self.submit(self.connect(server_script_path))
+
+    def list_tools_sync(self, timeout: float = MCP_CALL_TIMEOUT):
+        return self.run(self.list_tools(), timeout)
+
+    def call_tool_sync(self, tool_name: str, arguments: dict, timeout: float = MCP_CALL_TIMEOUT):
+        return self.run(self.call_tool(tool_name, arguments), timeout)
+
+    def get_tool_catalog(self, timeout: float = MCP_CALL_TIMEOUT) -> ToolCatalog:
+        """
+        Returns the cached tool catalog. It is only re-fetched from the server when missing, older
+        than MCP_TOOL_CATALOG_TTL, or invalidated by a tools/list_changed notification; if that
+        re-fetch fails, the stale catalog is returned.
+        """
+        if not self.session:
+            return EMPTY_TOOL_CATALOG
+        catalog = self._tool_catalog
+        if catalog is not None and not self._tool_catalog_stale and catalog.age_seconds() < MCP_TOOL_CATALOG_TTL:
+            return catalog
+        try:
+            return self.refresh_tool_catalog(timeout)
+        except Exception as e:
+            print(f"MCP Client [{self.name}]: Could not refresh the tool catalog: {e}")
+            return catalog or EMPTY_TOOL_CATALOG
+
+    def refresh_tool_catalog(self, timeout: float = MCP_CALL_TIMEOUT) -> ToolCatalog:
+        """Re-fetches the tool catalog now. Concurrent callers share one request to the server."""
+        with self._catalog_lock:
+            if self._catalog_refresh is None or self._catalog_refresh.done():
+                self._catalog_refresh = self.submit(self.refresh_tools())
+            future = self._catalog_refresh
+        return future.result(timeout)
+
+    def close(self):
+        """Disconnects from the server and stops the event loop thread if the client owns it."""
+        if not self._loop_thread.is_started():
+            return
+        try:
+            self.run(self.disconnect(), timeout=MCP_HEALTH_CHECK_TIMEOUT + 5)
+        except Exception as e:
+            print(f"MCP Client [{self.name}]: Error while disconnecting: {e}")
+        if self._owns_loop:
+            self._loop_thread.stop()
+
+    def is_active(self) -> bool:
+        """True while the client is connected or trying to (re)connect."""
+        return self.status in ('connecting', 'connected', 'reconnecting')
+
+    def health(self) -> dict:
+        return {
+            'status': self.status,
+            'server_script_path': self.server_script_path,
+            'reconnects': self.reconnects,
+            'last_error': self.last_error,
+            'last_health_check': self.last_health_check,
+            'tools_cached': len(self._tool_catalog) if self._tool_catalog is not None else 0,
+            'tool_catalog_age_seconds': round(self._tool_catalog.age_seconds(), 1) if self._tool_catalog is not None else None,
+            'tool_calls': self._call_count,
+            'tool_call_errors': self._call_errors,
+            'avg_latency_ms': round(self._total_call_latency_ms / self._call_count, 1) if self._call_count else None,
+            'last_latency_ms': self._last_call_latency_ms,
+        }
+
+    # --- Coroutines (run on the client's loop) ---
+
+    @staticmethod
+    def _validate_script_path(server_script_path: str):
+        if not server_script_path.endswith((".py", ".js")):
+            raise ValueError("Server script must be a .py or .js file")
 
     async def connect(self, server_script_path: str):
         """
-        Connects to an MCP server using the specified server script.
+        Connects to an MCP server using the specified server script, and keeps the connection
+        alive until disconnect() is called. Must run on the client's own loop (use start()).
 
         Args:
             server_script_path: The path to the server script to connect to.
         """
-        if not server_script_path.endswith((".py", ".js")):
-            raise ValueError("Server script must be a .py or .js file")
+        self._validate_script_path(server_script_path)
+        if self._manager_task and not self._manager_task.done():
+            raise ConnectionError("MCP client is already connected.")
 
-        command = "python" if server_script_path.endswith(".py") else "node"
-        server_params = StdioServerParameters(
+        self.server_script_path = server_script_path
+        self.status = 'connecting'
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        first_attempt = asyncio.get_running_loop().create_future()
+        self._manager_task = asyncio.create_task(self._manage_connection(first_attempt))
+        await first_attempt
+
+    async def disconnect(self):
+        """Disconnects from the MCP server and cleans up resources."""
+        task = self._manager_task
+        if task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await task
+        self._manager_task = None
+
+    def _server_params(self) -> StdioServerParameters:
+        command = "python" if self.server_script_path.endswith(".py") else "node"
+        return StdioServerParameters(
             command=command,
-            args=[server_script_path],
+            args=[self.server_script_path],
             env=None,
         )
 
-        read_stream, write_stream = await self.exit_stack.enter_async_context(
-            stdio_client(server_params)
-        )
-        self.session = await self.exit_stack.enter_async_context(
-            ClientSession(read_stream, write_stream)
-        )
+    async def _manage_connection(self, first_attempt: asyncio.Future):
+        """
+        Owns the server process and session. The stdio transport must be entered and exited in
+        the same task, so this task holds it open while other tasks share `self.session`.
+        """
+        backoff = MCP_RECONNECT_BACKOFF
+        while not self._stopping:
+            try:
+                async with AsyncExitStack() as exit_stack:
+                    read_stream, write_stream = await exit_stack.enter_async_context(
+                        stdio_client(self._server_params())
+                    )
+                    session = await exit_stack.enter_async_context(
+                        ClientSession(read_stream, write_stream, message_handler=self._handle_server_message)
+                    )
+                    await session.initialize()
+                    self.session = session
+                    self.status = 'connected'
+                    self.last_error = None
+                    backoff = MCP_RECONNECT_BACKOFF
+                    print(f"MCP client [{self.name}] connected.")
+                    await self._refresh_tools_quietly()
+                    if not first_attempt.done():
+                        first_attempt.set_result(None)
+                    await self._supervise(session)
+            except Exception as e:
+                self.last_error = str(e)
+                if not first_attempt.done():
+                    # A server that never came up is a configuration problem; don't retry forever.
+                    self.status = 'disconnected'
+                    first_attempt.set_exception(e)
+                    return
+                print(f"MCP Client [{self.name}]: Connection lost: {e}")
+            finally:
+                self.session = None
 
-        await self.session.initialize()
-        print("MCP client connected.")
+            if self._stopping:
+                break
+            self.status = 'reconnecting'
+            self.reconnects += 1
+            print(f"MCP Client [{self.name}]: Reconnecting in {backoff:.0f}s...")
+            await self._sleep_unless_woken(backoff)
+            backoff = min(backoff * 2, MCP_RECONNECT_MAX_BACKOFF)
 
-    async def disconnect(self):
-        """Disconnects from the MCP server and cleans up resources."""
-        await self.exit_stack.aclose()
-        print("MCP client disconnected.")
+        self.status = 'disconnected'
+        self._tool_catalog = None
+        print(f"MCP client [{self.name}] disconnected.")
 
-    async def list_tools(self):
-        """Lists the available tools from the connected MCP server."""
+    async def _supervise(self, session: ClientSession):
+        """Returns when asked to stop; raises ConnectionError when the server stops answering pings."""
+        while True:
+            await self._sleep_unless_woken(MCP_HEALTH_CHECK_INTERVAL)
+            if self._stopping:
+                return
+            try:
+                await asyncio.wait_for(session.send_ping(), MCP_HEALTH_CHECK_TIMEOUT)
+            except Exception as e:
+                raise ConnectionError(f"Health check failed: {e!r}") from e
+            self.last_health_check = time.time()
+
+    async def _sleep_unless_woken(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _handle_server_message(self, message):
+        """Session message hook: a tools/list_changed notification invalidates and re-fetches the catalog."""
+        if isinstance(message, types.ServerNotification) and isinstance(message.root, types.ToolListChangedNotification):
+            print(f"MCP Client [{self.name}]: Server reported a tool list change.")
+            self._tool_catalog_stale = True
+            # Fetch from a separate task: awaiting a request here would block the session's receive loop.
+            task = asyncio.create_task(self._refresh_tools_quietly())
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def refresh_tools(self) -> ToolCatalog:
+        """Fetches the tool list from the server and replaces the cached catalog."""
+        tools = await self.list_tools()
+        catalog = ToolCatalog([{'name': tool.name, 'description': tool.description, 'input_schema': tool.inputSchema, 'is_mcp': True} for tool in tools])
+        if self._tool_catalog is None or self._tool_catalog.fingerprint != catalog.fingerprint:
+            print(f"MCP Client [{self.name}]: Tool catalog updated ({len(catalog)} tools).")
+        self._tool_catalog = catalog
+        self._tool_catalog_stale = False
+        return catalog
+
+    async def _refresh_tools_quietly(self):
+        try:
+            await self.refresh_tools()
+        except Exception as e:
+            print(f"MCP Client [{self.name}]: Could not fetch the tool catalog: {e}")
+
+    def _require_session(self) -> ClientSession:
         if not self.session:
+            if self.status == 'reconnecting':
+                raise ConnectionError("MCP server connection was lost; reconnecting.")
             raise ConnectionError("Not connected to an MCP server.")
-        response = await self.session.list_tools()
+        return self.session
+
+    def _check_health_soon(self):
+        """Wakes the supervisor so a failed request is followed by an immediate ping."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def list_tools(self):
+        """Lists the available tools from the connected MCP server."""
+        session = self._require_session()
+        try:
+            response = await session.list_tools()
+        except Exception:
+            self._check_health_soon()
+            raise
         return response.tools
 
     async def call_tool(self, tool_name: str, arguments: dict):
@@ -63,7 +359,17 @@ class MCPClient:
         Returns:
             The result of the tool call.
         """
-        if not self.session:
-            raise ConnectionError("Not connected to an MCP server.")
-        result = await self.session.call_tool(tool_name, arguments)
-        return result.content 
\ No newline at end of file
+        session = self._require_session()
+        start = time.perf_counter()
+        try:
+            result = await session.call_tool(tool_name, arguments)
+        except Exception:
+            self._call_errors += 1
+            self._check_health_soon()
+            raise
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            self._call_count += 1
+            self._total_call_latency_ms += latency_ms
+            self._last_call_latency_ms = round(latency_ms, 1)
+        return result.content
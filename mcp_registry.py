@@ -0,0 +1,155 @@
+import asyncio
+import os
+import re
+import threading
+from typing import Optional
+
+from mcp_client import MCPClient, EventLoopThread, ToolCatalog, MCP_CALL_TIMEOUT
+
+MCP_INTENT_PREFIX = "mcp_"
+
+
+def server_name_from_path(server_script_path: str) -> str:
+    """Derives a server name from its script file name, e.g. 'servers/Weather-Tools.py' -> 'weather_tools'."""
+    base = os.path.splitext(os.path.basename(server_script_path))[0]
+    return re.sub(r"[^a-z0-9]+", "_", base.lower()).strip("_") or "server"
+
+
+class MCPRegistry:
+    """
+    Manages connections to several MCP servers at once.
+
+    Every server gets its own MCPClient (and server process), all sharing one background event
+    loop. Their tool catalogs are merged under namespaced intents, `mcp_<server>_<tool>`, which
+    is what the NLU sees; calls are routed back to the owning server's session, and independent
+    calls run concurrently on the shared loop.
+    """
+
+    def __init__(self):
+        self._loop_thread = EventLoopThread(name="mcp-registry-loop")
+        self._clients = {}  # server name -> MCPClient
+        self._lock = threading.Lock()
+        self._merged_key = None  # (server, catalog fingerprint) pairs the merged catalog was built from
+        self._merged_catalog = ToolCatalog([])
+        self._routes = {}  # namespaced intent -> (server name, tool name)
+
+    def connect(self, server_script_path: str, name: Optional[str] = None) -> str:
+        """
+        Starts connecting to a server in the background and returns its name. Raises ValueError
+        for an invalid script path or a name that is already in use by an active connection.
+        """
+        name = name or server_name_from_path(server_script_path)
+        if not re.fullmatch(r"[a-z0-9_]+", name):
+            raise ValueError("Server name may only contain lowercase letters, digits and underscores.")
+        with self._lock:
+            client = self._clients.get(name)
+            if client is not None and client.is_active():
+                raise ValueError(f"An MCP server named '{name}' is already connected.")
+            client = MCPClient(name=name, loop_thread=self._loop_thread)
+            client.start(server_script_path)
+            self._clients[name] = client
+        return name
+
+    def disconnect(self, name: str) -> bool:
+        """Disconnects and forgets one server. Returns False if it was not registered."""
+        with self._lock:
+            client = self._clients.pop(name, None)
+        if client is None:
+            return False
+        client.close()
+        return True
+
+    def close(self):
+        for name in list(self._clients):
+            self.disconnect(name)
+        self._loop_thread.stop()
+
+    def servers(self) -> dict:
+        with self._lock:
+            return dict(self._clients)
+
+    def has_connected_servers(self) -> bool:
+        return any(client.session for client in self.servers().values())
+
+    def get_tool_catalog(self) -> ToolCatalog:
+        """
+        Merged catalog of every connected server's tools, named `mcp_<server>_<tool>`. It is
+        rebuilt only when one of the per-server catalogs (each cached by its MCPClient) changes.
+        """
+        catalogs = sorted((name, client.get_tool_catalog()) for name, client in self.servers().items())
+        key = tuple((name, catalog.fingerprint) for name, catalog in catalogs)
+        with self._lock:
+            if key == self._merged_key:
+                return self._merged_catalog
+            tools, routes = [], {}
+            for name, catalog in catalogs:
+                for tool in catalog:
+                    intent = f"{MCP_INTENT_PREFIX}{name}_{tool['name']}"
+                    routes[intent] = (name, tool['name'])
+                    tools.append({
+                        'name': intent,
+                        'description': tool['description'],
+                        'input_schema': tool.get('input_schema'),
+                        'is_mcp': True,
+                        'server': name,
+                        'tool': tool['name'],
+                    })
+            self._merged_catalog = ToolCatalog(tools)
+            self._routes = routes
+            self._merged_key = key
+            return self._merged_catalog
+
+    def refresh_tool_catalogs(self) -> ToolCatalog:
+        """Re-fetches every connected server's tools now and returns the merged catalog."""
+        for client in self.servers().values():
+            if client.session:
+                client.refresh_tool_catalog()
+        return self.get_tool_catalog()
+
+    def route(self, intent: str) -> tuple[MCPClient, str]:
+        """Maps a namespaced intent to (client, tool name). Raises ValueError for unknown tools."""
+        with self._lock:
+            target = self._routes.get(intent)
+        if target is None:
+            # The catalog may have changed since it was last merged.
+            self.get_tool_catalog()
+            with self._lock:
+                target = self._routes.get(intent)
+        if target is None:
+            raise ValueError(f"Unknown MCP tool '{intent}'.")
+        server, tool_name = target
+        client = self.servers().get(server)
+        if client is None:
+            raise ConnectionError(f"MCP server '{server}' is not connected.")
+        return client, tool_name
+
+    def call_tool(self, intent: str, arguments: dict, timeout: float = MCP_CALL_TIMEOUT):
+        """Calls a namespaced tool on the server that owns it."""
+        client, tool_name = self.route(intent)
+        return client.call_tool_sync(tool_name, arguments, timeout)
+
+    def call_tools(self, calls: list, timeout: float = MCP_CALL_TIMEOUT) -> list:
+        """
+        Runs independent (intent, arguments) calls concurrently, across servers and within one
+        session. Returns results in order; a failed call yields its exception instead of a result.
+        """
+        coroutines = []
+        for intent, arguments in calls:
+            try:
+                client, tool_name = self.route(intent)
+                coroutines.append(client.call_tool(tool_name, arguments))
+            except Exception as e:
+                coroutines.append(_raise(e))
+
+        async def gather():
+            return await asyncio.gather(*coroutines, return_exceptions=True)
+
+        return self._loop_thread.submit(gather()).result(timeout)
+
+    def health(self) -> dict:
+        """Per-server connection state, tool count and tool-call latency."""
+        return {name: client.health() for name, client in sorted(self.servers().items())}
+
+
+async def _raise(error: Exception):
+    raise error
@@ -1,6 +1,28 @@
+import hashlib
 import json
+import os
 import re
-from llm import get_ollama_response, THINKER_MODEL_NAME
+import threading
+import time
+import tracing
+from llm import stream_ollama_response, async_stream_ollama_response, THINKER_MODEL_NAME
+from intent_classifier import classify_with_rules, LocalIntentClassifier
+from ttl_cache import TTLCache
+from streaming_json import StreamingJSONObjectParser
+
+NLU_CACHE_SIZE = int(os.getenv("NLU_CACHE_SIZE", "512"))
+NLU_CACHE_TTL_SECONDS = float(os.getenv("NLU_CACHE_TTL_SECONDS", "3600"))
+# Constrain the THINKER's NLU answer to a JSON schema (intent enum, typed entities). Turn off for
+# backends that reject `response_format`.
+NLU_STRUCTURED_OUTPUT = os.getenv("NLU_STRUCTURED_OUTPUT", "true").lower() in ("1", "true", "yes")
+NLU_INCLUDE_REASONING = os.getenv("NLU_INCLUDE_REASONING", "false").lower() in ("1", "true", "yes")  # Ask for a (costly, unused) reasoning field
+
+# Filler words dropped when normalizing a message for the cache key, so that
+# "what's the weather in London" and "weather London?" share an entry.
+_CACHE_STOPWORDS = {
+    "a", "an", "the", "is", "are", "what", "whats", "what's", "how", "hows", "how's", "in", "for",
+    "at", "of", "me", "tell", "please", "can", "could", "you", "like", "today", "right", "now", "show",
+}
 
 # A dictionary defining the intents and the entities they might have.
 INTENT_DEFINITIONS = {
@@ -10,11 +32,17 @@ INTENT_DEFINITIONS = {
             "location": {
                 "type": "string",
                 "description": "The city or area to get the weather for, e.g., 'San Francisco'."
+            },
+            "locations": {
+                "type": "array",
+                "items": {"type": "string"},
+                "description": "Several cities or areas asked about at once, e.g., ['London', 'Paris', 'Tokyo']. Use `location` for a single place."
             }
         },
         "examples": [
             "What's the weather like in London today?",
-            "tell me the weather for Paris"
+            "tell me the weather for Paris",
+            "weather in London, Paris and Tokyo"
         ]
     },
     "search_web": {
@@ -31,11 +59,18 @@ INTENT_DEFINITIONS = {
         ]
     },
     "get_bible_verse": {
-        "description": "User wants to get a random Bible verse.",
-        "entities": {},
+        "description": "User wants a Bible verse: a random one, or a specific verse or passage.",
+        "entities": {
+            "reference": {
+                "type": "string",
+                "description": "The verse or passage asked for, e.g., 'John 3:16' or 'Psalm 23'. Omit it for a random verse."
+            }
+        },
         "examples": [
             "Read me a bible verse",
-            "Give me a random verse from the Bible"
+            "Give me a random verse from the Bible",
+            "Share some scripture with me",
+            "What does John 3:16 say?"
         ]
     },
     "nextcloud_list_files": {
@@ -120,124 +155,365 @@ INTENT_DEFINITIONS = {
         "entities": {},
         "examples": [
             "Hello, how are you?",
-            "What's your name?"
+            "What's your name?",
+            "Good morning Samantha",
+            "Thanks, that was helpful",
+            "Who are you?",
+            "Hi, how are you doing?",
+            "Thank you so much!",
+            "Nice to meet you",
+            "What can you do?",
+            "Good night",
+            "Tell me about yourself"
         ]
     }
 }
 
-def get_intent_and_entities(user_message: str, mcp_tools=None) -> tuple[str, dict]:
+def _intent_definitions_fingerprint() -> str:
+    return hashlib.sha1(json.dumps(INTENT_DEFINITIONS, sort_keys=True).encode("utf-8")).hexdigest()
+
+# Second-tier classifier, trained from the examples above and re-trained if INTENT_DEFINITIONS changes.
+_local_classifier = LocalIntentClassifier(INTENT_DEFINITIONS)
+_local_classifier_fingerprint = _intent_definitions_fingerprint()
+
+# Cache of LLM-tier results keyed on (normalized message, intent-set fingerprint).
+_nlu_cache = TTLCache(max_size=NLU_CACHE_SIZE, ttl_seconds=NLU_CACHE_TTL_SECONDS)
+_nlu_cache_fingerprint = None
+_fingerprint_lock = threading.Lock()
+
+# (intent-set fingerprint, system prompt, response format) for the LLM tier, rendered once per intent
+# set so the prompt prefix is byte-identical across calls.
+_nlu_llm_request = (None, None, None)
+
+# Output of the LLM tier: answers that could not be used, and tokens spent (one streamed delta is ~one token).
+_llm_output_stats = {'calls': 0, 'parse_failures': 0, 'output_tokens': 0, 'early_stops': 0}
+_llm_output_stats_lock = threading.Lock()
+
+# Which tier decided each message, and how long it took, so we can see how many THINKER calls are saved.
+_tier_stats = {tier: {'count': 0, 'total_latency_ms': 0.0} for tier in ('rules', 'local', 'cache', 'llm')}
+_tier_stats_lock = threading.Lock()
+
+def extract_current_message(user_message: str) -> str:
     """
-    Processes the user's message to determine intent and extract entities using an LLM,
-    including dynamically provided MCP tools.
+    Returns only the message the user is asking now.
+
+    Older web UI versions wrap each message in a `<History for context>` envelope; the fast-path
+    tiers must not match on URLs or keywords from earlier turns.
+    """
+    match = re.search(r'<User asks currently>(.*?)</User asks currently>', user_message, re.DOTALL)
+    return match.group(1).strip() if match else user_message.strip()
+
+def normalize_message(message: str) -> str:
+    """Lowercases, strips punctuation and filler words, and collapses whitespace."""
+    tokens = re.findall(r"[a-z0-9']+", message.lower())
+    return " ".join(token for token in tokens if token not in _CACHE_STOPWORDS)
+
+def _collapse_whitespace(message: str) -> str:
+    return " ".join(message.split())
+
+def _entities_in_message(entities: dict, message: str) -> bool:
+    """True when every entity value appears verbatim in `message`, so a cached answer can be reused for it."""
+    for value in entities.values():
+        for item in (value if isinstance(value, list) else [value]):
+            if item not in (None, "") and str(item) not in message:
+                return False
+    return True
+
+def _sync_intent_set(mcp_tools: list) -> str:
+    """
+    Returns the fingerprint of the current intent set (INTENT_DEFINITIONS plus MCP tools).
+
+    When it differs from the last one seen, the result cache is cleared, and the local classifier is
+    re-trained if INTENT_DEFINITIONS itself changed.
+    """
+    global _local_classifier, _local_classifier_fingerprint, _nlu_cache_fingerprint
+    definitions_fingerprint = _intent_definitions_fingerprint()
+    tools_fingerprint = getattr(mcp_tools, 'fingerprint', None) # Precomputed by a cached ToolCatalog
+    if tools_fingerprint is None:
+        tools_fingerprint = json.dumps(sorted((tool['name'], tool.get('description') or '') for tool in mcp_tools))
+    fingerprint = hashlib.sha1((definitions_fingerprint + tools_fingerprint).encode("utf-8")).hexdigest()
+
+    with _fingerprint_lock:
+        if definitions_fingerprint != _local_classifier_fingerprint:
+            print("NLU: INTENT_DEFINITIONS changed. Re-training the local classifier.")
+            _local_classifier = LocalIntentClassifier(INTENT_DEFINITIONS)
+            _local_classifier_fingerprint = definitions_fingerprint
+        if fingerprint != _nlu_cache_fingerprint:
+            if _nlu_cache_fingerprint is not None:
+                print("NLU: Intent set or MCP tool list changed. Invalidating the NLU cache.")
+            _nlu_cache.clear()
+            _nlu_cache_fingerprint = fingerprint
+    return fingerprint
+
+def _record_tier(tier: str, latency_ms: float):
+    with _tier_stats_lock:
+        _tier_stats[tier]['count'] += 1
+        _tier_stats[tier]['total_latency_ms'] += latency_ms
+
+def get_nlu_stats() -> dict:
+    """Returns per-tier decision counts and average latencies, plus the number of THINKER calls avoided."""
+    with _tier_stats_lock:
+        stats = {
+            tier: {
+                'count': data['count'],
+                'avg_latency_ms': round(data['total_latency_ms'] / data['count'], 3) if data['count'] else 0.0,
+            }
+            for tier, data in _tier_stats.items()
+        }
+    stats['thinker_calls_saved'] = stats['rules']['count'] + stats['local']['count'] + stats['cache']['count']
+    stats['cache_stats'] = _nlu_cache.stats()
+    with _llm_output_stats_lock:
+        calls = _llm_output_stats['calls']
+        stats['llm_output'] = {
+            **_llm_output_stats,
+            'parse_failure_rate': round(_llm_output_stats['parse_failures'] / calls, 4) if calls else 0.0,
+            'avg_output_tokens': round(_llm_output_stats['output_tokens'] / calls, 1) if calls else 0.0,
+            'structured_output': NLU_STRUCTURED_OUTPUT,
+        }
+    return stats
+
+def _classify_without_llm(current_message: str, mcp_tools, fingerprint: str):
+    """
+    Runs the tiers that need no model call: rules, the local classifier and the cache.
+    Returns (result, tier, confidence, cache_key); `result` is None when the LLM must decide.
+    """
+    result = classify_with_rules(current_message)
+    if result is not None:
+        return result, 'rules', 1.0, None
+    # The local classifier knows nothing about MCP tools, so it only runs when none are connected.
+    if not mcp_tools:
+        local_result = _local_classifier.classify(current_message)
+        if local_result is not None:
+            intent, entities, confidence = local_result
+            return (intent, entities), 'local', confidence, None
+    # Messages that differ only in case, punctuation or filler words share an entry, but its entities
+    # came from the first message: they are only reused when they appear verbatim in this one (or the
+    # message is the same). Messages with nothing left after normalizing are keyed on their own text.
+    message = _collapse_whitespace(current_message)
+    cache_key = (normalize_message(current_message) or message, fingerprint)
+    cached = _nlu_cache.get(cache_key)
+    if cached is not None:
+        intent, entities, source_message = cached
+        if source_message == message or _entities_in_message(entities, message):
+            return (intent, dict(entities)), 'cache', None, cache_key # Copy so callers can add defaults without touching the cache
+    return None, 'llm', None, cache_key
+
+def _finish_classification(result: tuple, tier: str, confidence, start: float) -> dict:
+    intent, entities = result
+    latency_ms = (time.perf_counter() - start) * 1000
+    _record_tier(tier, latency_ms)
+    print(f"NLU: intent '{intent}' decided by {tier} tier in {latency_ms:.1f} ms.")
+    return {
+        'intent': intent,
+        'entities': entities,
+        'tier': tier,
+        'confidence': confidence,
+        'latency_ms': round(latency_ms, 3),
+    }
+
+def classify_message(user_message: str, mcp_tools=None) -> dict:
+    """
+    Tiered NLU. Tries the deterministic rules, then the local statistical classifier, then the
+    cache of earlier LLM answers, and only calls the THINKER model when none of them can answer.
+
+    Returns a dict with `intent`, `entities`, `tier` ('rules', 'local', 'cache' or 'llm'),
+    `confidence` and `latency_ms`.
     """
     if mcp_tools is None:
         mcp_tools = []
 
-    # Dynamically create the intent list and formatting for the prompt
-    intent_list = "\n".join([f"- {name}: {details['description']}" for name, details in INTENT_DEFINITIONS.items()])
-    
-    if mcp_tools:
-        mcp_tool_list = "\n".join([f"- {tool['name']}: {tool['description']}" for tool in mcp_tools])
-        intent_list += "\n" + mcp_tool_list
+    with tracing.span('nlu') as nlu_span:
+        start = time.perf_counter()
+        fingerprint = _sync_intent_set(mcp_tools)
+        current_message = extract_current_message(user_message)
+        result, tier, confidence, cache_key = _classify_without_llm(current_message, mcp_tools, fingerprint)
+        if result is None:
+            system_prompt, response_format = _get_llm_nlu_request(mcp_tools, fingerprint)
+            parser, raw_response, output_tokens = StreamingJSONObjectParser(), [], 0
+            chunks = stream_ollama_response(_build_llm_nlu_prompt(user_message), model_name=THINKER_MODEL_NAME, priority='interactive',
+                                            system=system_prompt, response_format=response_format)
+            try:
+                for chunk in chunks:
+                    output_tokens += 1
+                    raw_response.append(chunk)
+                    if parser.feed(chunk).has('intent', 'entities'):
+                        break # Anything after the entities is not needed
+            finally:
+                chunks.close()
+            result = _parse_llm_nlu_response(parser, "".join(raw_response), output_tokens, mcp_tools, cache_key, current_message)
+        classification = _finish_classification(result, tier, confidence, start)
+        nlu_span.set(tier=tier, intent=classification['intent'])
+    return classification
 
-    json_format_description = """
-Respond with a single JSON object in the following format:
-{
-  "intent": "INTENT_NAME",
-  "entities": {
-    "entity_name_1": "value_1",
-    "entity_name_2": "value_2"
-  },
-  "confidence": 0.9,
-  "reasoning": "A brief explanation of why you chose this intent and entities."
-}
+async def classify_message_async(user_message: str, mcp_tools=None) -> dict:
+    """classify_message for the ASGI server: the LLM tier awaits the model instead of blocking a thread."""
+    if mcp_tools is None:
+        mcp_tools = []
 
-- "intent" must be ONE of the intent names listed above.
-- "entities" must be an object containing the extracted entities for that intent. If no entities are found for a given intent, provide an empty object {}.
-- For `query_youtube_video`, extract the `video_id` from the URL. The user's question is the part of the message that is not the URL.
-- For `nextcloud_list_files`, if no path is mentioned, the `path` entity should default to "/".
-"""
+    with tracing.span('nlu') as nlu_span:
+        start = time.perf_counter()
+        fingerprint = _sync_intent_set(mcp_tools)
+        current_message = extract_current_message(user_message)
+        result, tier, confidence, cache_key = _classify_without_llm(current_message, mcp_tools, fingerprint)
+        if result is None:
+            system_prompt, response_format = _get_llm_nlu_request(mcp_tools, fingerprint)
+            parser, raw_response, output_tokens = StreamingJSONObjectParser(), [], 0
+            chunks = async_stream_ollama_response(_build_llm_nlu_prompt(user_message), model_name=THINKER_MODEL_NAME, priority='interactive',
+                                                  system=system_prompt, response_format=response_format)
+            try:
+                async for chunk in chunks:
+                    output_tokens += 1
+                    raw_response.append(chunk)
+                    if parser.feed(chunk).has('intent', 'entities'):
+                        break
+            finally:
+                await chunks.aclose()
+            result = _parse_llm_nlu_response(parser, "".join(raw_response), output_tokens, mcp_tools, cache_key, current_message)
+        classification = _finish_classification(result, tier, confidence, start)
+        nlu_span.set(tier=tier, intent=classification['intent'])
+    return classification
 
-    prompt = f"""
-You are a highly intelligent Natural Language Understanding (NLU) engine. Your task is to analyze the user's message and determine their intent and any associated entities.
+def get_intent_and_entities(user_message: str, mcp_tools=None) -> tuple[str, dict]:
+    """
+    Processes the user's message to determine intent and extract entities, including dynamically
+    provided MCP tools. Cheap local tiers answer first; the LLM is used only when they are unsure.
+    """
+    result = classify_message(user_message, mcp_tools=mcp_tools)
+    return result['intent'], result['entities']
 
-Here are the possible intents:
-{intent_list}
+async def get_intent_and_entities_async(user_message: str, mcp_tools=None) -> tuple[str, dict]:
+    result = await classify_message_async(user_message, mcp_tools=mcp_tools)
+    return result['intent'], result['entities']
 
-{json_format_description}
+def _parse_llm_nlu_response(parser: StreamingJSONObjectParser, raw_response: str, output_tokens: int, mcp_tools, cache_key, current_message: str) -> tuple[str, dict]:
+    """Turns the THINKER's parsed answer into (intent, entities), records its stats, and caches it if it was usable."""
+    intent, entities, parsed_ok = _parse_intent_and_entities(parser, raw_response, mcp_tools)
+    with _llm_output_stats_lock:
+        _llm_output_stats['calls'] += 1
+        _llm_output_stats['output_tokens'] += output_tokens
+        if not parsed_ok:
+            _llm_output_stats['parse_failures'] += 1
+        elif not parser.complete:
+            _llm_output_stats['early_stops'] += 1
+    if parsed_ok:
+        _nlu_cache.set(cache_key, (intent, dict(entities), _collapse_whitespace(current_message)))
+    return intent, entities
 
----
-User message: "{user_message}"
----
+def _get_llm_nlu_request(mcp_tools: list, fingerprint: str) -> tuple[str, dict]:
+    """
+    Returns the (system prompt, response format) of the LLM tier for the current intent set. Both
+    only change with the intent set, so they are rendered once per fingerprint; the stable system
+    message can then stay in the backend's prompt cache across calls.
+    """
+    global _nlu_llm_request
+    cached_fingerprint, system_prompt, response_format = _nlu_llm_request
+    if cached_fingerprint != fingerprint:
+        system_prompt = _build_llm_nlu_system_prompt(mcp_tools)
+        response_format = _build_nlu_response_format(mcp_tools) if NLU_STRUCTURED_OUTPUT else None
+        _nlu_llm_request = (fingerprint, system_prompt, response_format)
+    return system_prompt, response_format
+
+def _build_nlu_response_format(mcp_tools: list) -> dict:
+    """
+    JSON schema for the THINKER's NLU answer: `intent` is an enum of every known intent and MCP
+    tool, and `entities` declares the typed entities they accept (MCP tools contribute the
+    properties of their input schemas). `intent` comes first so a streamed answer can be acted on
+    as soon as `entities` is complete.
+    """
+    intents = list(INTENT_DEFINITIONS) + [tool['name'] for tool in mcp_tools]
+    entity_properties = {}
+    for details in INTENT_DEFINITIONS.values():
+        for name, entity in details['entities'].items():
+            entity_properties.setdefault(name, {'type': entity.get('type', 'string'), **({'items': entity['items']} if 'items' in entity else {})})
+    for tool in mcp_tools:
+        for name, schema in ((tool.get('input_schema') or {}).get('properties') or {}).items():
+            if name not in entity_properties:
+                entity_properties[name] = {key: schema[key] for key in ('type', 'enum', 'items') if key in schema}
+            elif entity_properties[name].get('type') != schema.get('type'):
+                entity_properties[name] = {} # Intents disagree on the type; accept any value
+
+    properties = {
+        'intent': {'type': 'string', 'enum': intents},
+        'entities': {'type': 'object', 'properties': entity_properties},
+    }
+    if NLU_INCLUDE_REASONING:
+        properties['reasoning'] = {'type': 'string'}
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': 'nlu_result',
+            'schema': {
+                'type': 'object',
+                'properties': properties,
+                'required': list(properties),
+                'additionalProperties': False,
+            },
+        },
+    }
+
+def _build_llm_nlu_system_prompt(mcp_tools: list) -> str:
+    """Builds the THINKER's NLU instructions: everything except the user's message."""
 
-Now, provide the JSON output based on the user's message.
-"""
-    
-    # LLM call
-    raw_response = get_ollama_response(prompt, model_name=THINKER_MODEL_NAME)
-    
-    # Regex to find JSON object in the response, in case the LLM adds extra text.
-    json_match = re.search(r'\{.*\}', raw_response, re.DOTALL)
-    
-    if not json_match:
-        print(f"NLU Error: LLM did not return a valid JSON object. Response: {raw_response}")
-        return "casual_chat", {}
-
-    try:
-        parsed_json = json.loads(json_match.group(0))
-        
-        # Validate the structure
-        intent = parsed_json.get("intent", "casual_chat")
-        entities = parsed_json.get("entities", {})
-        
-        # Check if the returned intent is valid (either in predefined or MCP tools)
-        mcp_tool_names = [tool['name'] for tool in mcp_tools]
-        if intent not in INTENT_DEFINITIONS and intent not in mcp_tool_names:
-            print(f"NLU Warning: LLM returned an unknown intent '{intent}'. Defaulting to casual_chat.")
-            return "casual_chat", {}
-            
-        return intent, entities
-
-    except json.JSONDecodeError:
-        print(f"NLU Error: Failed to parse JSON from LLM response: {raw_response}")
-        return "casual_chat", {}
-
-def generate_nlu_prompt(user_message: str) -> str:
-    """Generates the full prompt for the LLM to perform NLU."""
-    
     # Dynamically create the intent list and formatting for the prompt
     intent_list = "\n".join([f"- {name}: {details['description']}" for name, details in INTENT_DEFINITIONS.items()])
     
-    json_format_description = """
-Respond with a single JSON object in the following format:
-{
+    if mcp_tools:
+        # A ToolCatalog from mcp_client carries this section pre-rendered.
+        mcp_tool_list = getattr(mcp_tools, 'prompt_section', None)
+        if mcp_tool_list is None:
+            mcp_tool_list = "\n".join([f"- {tool['name']}: {tool['description']}" for tool in mcp_tools])
+        intent_list += "\n" + mcp_tool_list
+
+    reasoning_field = ',\n  "reasoning": "A brief explanation of why you chose this intent and entities."' if NLU_INCLUDE_REASONING else ""
+    json_format_description = f"""
+Respond with a single JSON object in the following format, and nothing else:
+{{
   "intent": "INTENT_NAME",
-  "entities": {
+  "entities": {{
     "entity_name_1": "value_1",
     "entity_name_2": "value_2"
-  },
-  "confidence": 0.9,
-  "reasoning": "A brief explanation of why you chose this intent and entities."
-}
+  }}{reasoning_field}
+}}
 
 - "intent" must be ONE of the intent names listed above.
-- "entities" must be an object containing the extracted entities for that intent. If no entities are found for a given intent, provide an empty object {}.
+- "entities" must be an object containing the extracted entities for that intent. If no entities are found for a given intent, provide an empty object {{}}.
 - For `query_youtube_video`, extract the `video_id` from the URL. The user's question is the part of the message that is not the URL.
 - For `nextcloud_list_files`, if no path is mentioned, the `path` entity should default to "/".
 """
 
-    prompt = f"""
+    return f"""
 You are a highly intelligent Natural Language Understanding (NLU) engine. Your task is to analyze the user's message and determine their intent and any associated entities.
 
 Here are the possible intents:
 {intent_list}
 
 {json_format_description}
+The user's message follows. Provide the JSON output based on it.
+"""
 
----
-User message: "{user_message}"
----
+def _build_llm_nlu_prompt(user_message: str) -> str:
+    """The variable part of the NLU prompt, sent as the user message after the system prompt."""
+    return f'User message: "{user_message}"'
 
-Now, provide the JSON output based on the user's message.
-"""
-    return prompt 
\ No newline at end of file
+def _parse_intent_and_entities(parser: StreamingJSONObjectParser, raw_response: str, mcp_tools: list) -> tuple[str, dict, bool]:
+    """
+    Extracts intent and entities from the THINKER's answer, as decoded by the streaming parser
+    (which skips any text the model puts around the JSON object).
+    The trailing bool is False when the response could not be used, so fallbacks are never cached.
+    """
+    if parser.error or not parser.has('intent', 'entities'):
+        print(f"NLU Error: LLM did not return a valid JSON object ({parser.error or 'missing intent or entities'}). Response: {raw_response}")
+        return "casual_chat", {}, False
+
+    intent = parser.fields['intent']
+    entities = parser.fields['entities']
+    if not isinstance(entities, dict):
+        entities = {}
+
+    # Check if the returned intent is valid (either in predefined or MCP tools)
+    mcp_tool_names = [tool['name'] for tool in mcp_tools]
+    if not isinstance(intent, str) or (intent not in INTENT_DEFINITIONS and intent not in mcp_tool_names):
+        print(f"NLU Warning: LLM returned an unknown intent '{intent}'. Defaulting to casual_chat.")
+        return "casual_chat", {}, False
+
+    return intent, entities, True
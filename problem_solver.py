@@ -1,11 +1,159 @@
-from llm import get_ollama_response, GENERATOR_MODEL_NAME, THINKER_MODEL_NAME
+from llm import get_ollama_response, get_ollama_completion, GENERATOR_MODEL_NAME, THINKER_MODEL_NAME
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from difflib import SequenceMatcher
+import math
+import os
 import re
+import threading
+import time
+import tracing
 
 DEFAULT_NUM_INITIAL_IDEAS = 10
 DEFAULT_NUM_PROTOTYPES = 100 # Number of prototypes to generate for the selected idea
 MAX_EVOLUTION_STEPS = 42  # Number of times to iteratively refine the chosen prototype
+PROTOTYPE_BATCH_SIZE = int(os.getenv("PROTOTYPE_BATCH_SIZE", "10"))  # Prototypes requested per LLM call
+TOURNAMENT_GROUP_SIZE = int(os.getenv("TOURNAMENT_GROUP_SIZE", "8"))  # Prototypes judged together in one selection prompt
+PROBLEM_SOLVER_MAX_WORKERS = int(os.getenv("PROBLEM_SOLVER_MAX_WORKERS", "4"))  # Concurrent LLM calls per fan-out stage
+PROTOTYPE_SIMILARITY_THRESHOLD = 0.8  # Word-set Jaccard similarity above which two prototypes count as duplicates
 
-def generate_initial_ideas(user_query: str, num_ideas: int = DEFAULT_NUM_INITIAL_IDEAS, generator_model: str = GENERATOR_MODEL_NAME) -> list[str]:
+# Early stopping for the evolution loop
+EVOLUTION_CONVERGENCE_SIMILARITY = float(os.getenv("EVOLUTION_CONVERGENCE_SIMILARITY", "0.95"))  # Revisions this similar count as "no change"
+EVOLUTION_PATIENCE = int(os.getenv("EVOLUTION_PATIENCE", "2"))  # Consecutive stalled steps before stopping
+EVOLUTION_MIN_QUALITY_DELTA = float(os.getenv("EVOLUTION_MIN_QUALITY_DELTA", "0.5"))  # Thinker score gain (1-10 scale) that counts as progress
+EVOLUTION_TIME_BUDGET_SECONDS = float(os.getenv("EVOLUTION_TIME_BUDGET_SECONDS", "900"))  # Wall-clock budget per request, all stages included
+EVOLUTION_TOKEN_BUDGET = int(os.getenv("EVOLUTION_TOKEN_BUDGET", "250000"))  # Prompt + completion tokens of every LLM call of a request
+
+# Beam mode: evolve several prototypes side by side and periodically prune the weakest
+BEAM_MAX_WIDTH = int(os.getenv("BEAM_MAX_WIDTH", "8"))  # Upper bound on beam_width accepted per request
+BEAM_PRUNE_INTERVAL = int(os.getenv("BEAM_PRUNE_INTERVAL", "5"))  # Score and prune the beam every N steps
+
+def _parse_bool(value) -> bool:
+    """A JSON bool, or "true"/"false"/"1"/"0" (also as 1/0); anything else is invalid, since bool("false") is True."""
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "1"):
+        return True
+    if text in ("false", "0"):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+# Per-request overrides accepted from /chat's `evolution_options`, with the function each is coerced with.
+EVOLUTION_OPTION_TYPES = {
+    'max_steps': int,
+    'time_budget_seconds': float,
+    'token_budget': int,
+    'convergence_similarity': float,
+    'score_with_thinker': _parse_bool,
+    'beam_width': int,
+    'prune_interval': int,
+    'beam_concurrency': int,
+}
+
+def parse_evolution_options(raw_options) -> dict:
+    """Keeps only known evolution options and coerces them to the right type. Invalid values are dropped."""
+    options = {}
+    if not isinstance(raw_options, dict):
+        return options
+    for key, value_type in EVOLUTION_OPTION_TYPES.items():
+        if key not in raw_options:
+            continue
+        try:
+            options[key] = value_type(raw_options[key])
+        except (TypeError, ValueError):
+            print(f"Problem Solver: Ignoring invalid evolution option {key}={raw_options[key]!r}.")
+    if 'max_steps' in options:
+        options['max_steps'] = max(0, min(options['max_steps'], MAX_EVOLUTION_STEPS))
+    for key in ('beam_width', 'beam_concurrency'):
+        if key in options:
+            options[key] = max(1, min(options[key], BEAM_MAX_WIDTH))
+    if 'prune_interval' in options:
+        options['prune_interval'] = max(1, options['prune_interval'])
+    return options
+
+def _submit_in_context(pool: ThreadPoolExecutor, fn, *args):
+    """
+    Submits fn to the pool inside a copy of the caller's context, so worker threads keep the
+    caller's LLM priority class and scheduled-job binding (cancellation checkpoints, progress).
+    """
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+class EvolutionBudget:
+    """
+    Tracks the wall-clock time and tokens one request has spent against its limits. Every LLM call
+    of the solve is charged (ideas, approach, prototypes, tournament, evolution and scoring), but
+    only the evolution loop stops early once the budget is spent.
+    """
+
+    def __init__(self, time_budget_seconds: float = EVOLUTION_TIME_BUDGET_SECONDS, token_budget: int = EVOLUTION_TOKEN_BUDGET, started_at: float = None):
+        self.time_budget_seconds = time_budget_seconds
+        self.token_budget = token_budget
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        self.tokens_used = 0
+        self._lock = threading.Lock()  # Beam mode charges the budget from several threads
+
+    def charge(self, usage: dict):
+        with self._lock:
+            self.tokens_used += usage.get('total_tokens', 0)
+
+    def elapsed_seconds(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def exhausted_reason(self):
+        """Returns 'time_budget' or 'token_budget' once a limit is reached, otherwise None."""
+        if self.elapsed_seconds() >= self.time_budget_seconds:
+            return 'time_budget'
+        if self.tokens_used >= self.token_budget:
+            return 'token_budget'
+        return None
+
+def _complete(prompt: str, model_name: str, budget: EvolutionBudget = None, system: str = None) -> str:
+    """get_ollama_response that charges the call's tokens to `budget`, if one is given."""
+    response_text, usage = get_ollama_completion(prompt, model_name=model_name, system=system)
+    if budget is not None:
+        budget.charge(usage)
+    return response_text
+
+def _notify(progress_callback, event: str, **data):
+    """Reports a stage event to the caller's progress callback, if one was given."""
+    if progress_callback is not None:
+        progress_callback(event, **data)
+
+def revision_similarity(previous: str, current: str) -> float:
+    """Word-level similarity in [0, 1] between two revisions of a solution."""
+    return SequenceMatcher(None, previous.split(), current.split(), autojunk=False).ratio()
+
+def _parse_numbered_list(response_text: str, expected_count: int) -> list[str]:
+    """Extracts '1. ...' style items from an LLM response, falling back to non-empty lines."""
+    items = []
+    for line in response_text.split('\n'):
+        match = re.match(r"^\d+\.\s*(.+)", line.strip())
+        if match:
+            items.append(match.group(1).strip())
+            
+    if not items or len(items) < expected_count / 2:
+        items.extend([i.strip() for i in response_text.split('\n') if i.strip() and not i.strip().isnumeric()])
+        items = list(dict.fromkeys(items))
+    return items
+
+def _word_set(text: str) -> frozenset:
+    return frozenset(re.findall(r"[a-z0-9]+", text.lower()))
+
+def deduplicate_prototypes(prototypes: list[str], threshold: float = PROTOTYPE_SIMILARITY_THRESHOLD) -> list[str]:
+    """Drops prototypes whose wording is near-identical (Jaccard similarity >= threshold) to an earlier one."""
+    kept, kept_word_sets = [], []
+    for prototype in prototypes:
+        words = _word_set(prototype)
+        if not words:
+            continue
+        if any(len(words & other) / len(words | other) >= threshold for other in kept_word_sets):
+            continue
+        kept.append(prototype)
+        kept_word_sets.append(words)
+    return kept
+
+def generate_initial_ideas(user_query: str, num_ideas: int = DEFAULT_NUM_INITIAL_IDEAS, generator_model: str = GENERATOR_MODEL_NAME, budget: EvolutionBudget = None) -> list[str]:
     """Generates a list of initial broad ideas to solve the user's query."""
     prompt = (
         f"The user has the following query: \"{user_query}\".\n"
@@ -14,21 +162,13 @@ def generate_initial_ideas(user_query: str, num_ideas: int = DEFAULT_NUM_INITIAL
         f"Present each idea on a new line, starting with a number and a period (e.g., '1. ...', '2. ...')."
     )
     
-    response_text = get_ollama_response(prompt, model_name=generator_model)
-    ideas = []
-    for line in response_text.split('\n'):
-        match = re.match(r"^\d+\.\s*(.+)", line.strip())
-        if match:
-            ideas.append(match.group(1).strip())
-            
-    if not ideas or len(ideas) < num_ideas / 2:
-        ideas.extend([i.strip() for i in response_text.split('\n') if i.strip() and not i.strip().isnumeric()])
-        ideas = list(dict.fromkeys(ideas))
+    response_text = _complete(prompt, generator_model, budget)
+    ideas = _parse_numbered_list(response_text, num_ideas)
     if not ideas:
         return [response_text]
     return ideas[:num_ideas]
 
-def select_best_approach(user_query: str, initial_ideas: list[str], thinker_model: str = THINKER_MODEL_NAME) -> str:
+def select_best_approach(user_query: str, initial_ideas: list[str], thinker_model: str = THINKER_MODEL_NAME, budget: EvolutionBudget = None) -> str:
     """Selects the most promising conceptual approach from the initial ideas."""
     if not initial_ideas:
         # This case should ideally be handled by the orchestrator, 
@@ -47,95 +187,373 @@ def select_best_approach(user_query: str, initial_ideas: list[str], thinker_mode
         f"For example, if ideas were about fixing a bug, your output might be: 'Focus on reproducing the bug in a minimal environment and then use a debugger to trace the execution path.'"
     )
     
-    selected_approach_text = get_ollama_response(prompt, model_name=thinker_model)
+    selected_approach_text = _complete(prompt, thinker_model, budget)
     return selected_approach_text.strip()
 
 
-def generate_prototypes_for_approach(selected_approach: str, num_prototypes: int = DEFAULT_NUM_PROTOTYPES, generator_model: str = GENERATOR_MODEL_NAME) -> list[str]:
-    """Generates concrete prototypes or detailed implementations for a selected approach."""
-    prompt = (
+def _generate_prototype_batch(selected_approach: str, batch_size: int, batch_index: int, num_batches: int, generator_model: str, budget: EvolutionBudget) -> list[str]:
+    """Generates one batch of prototypes. Each batch is nudged towards a different angle to limit overlap."""
+    # The approach and instructions are shared by every batch; only the batch details vary.
+    system_prompt = (
         f"The chosen strategic approach to explore is: \"{selected_approach}\".\n"
-        f"Please generate {num_prototypes} distinct, concrete prototypes or detailed elaborations based on this approach. "
+        f"Generate distinct, concrete prototypes or detailed elaborations based on this approach. "
         f"Each prototype should be a specific way to implement or expand on the given approach. "
         f"Present each prototype on a new line, starting with a number and a period (e.g., '1. ...', '2. ...')."
         f"Make them practical and actionable examples."
     )
-    response_text = get_ollama_response(prompt, model_name=generator_model)
-    prototypes = []
-    for line in response_text.split('\n'):
-        match = re.match(r"^\d+\.\s*(.+)", line.strip())
-        if match:
-            prototypes.append(match.group(1).strip())
-            
-    if not prototypes or len(prototypes) < num_prototypes / 2:
-        prototypes.extend([i.strip() for i in response_text.split('\n') if i.strip() and not i.strip().isnumeric()])
-        prototypes = list(dict.fromkeys(prototypes))
+    prompt = f"Please generate {batch_size} prototypes."
+    if num_batches > 1:
+        prompt += (
+            f" This is batch {batch_index + 1} of {num_batches} generated in parallel, "
+            f"so favour less obvious angles that other batches are unlikely to cover."
+        )
+    response_text = _complete(prompt, generator_model, budget, system=system_prompt)
+    prototypes = _parse_numbered_list(response_text, batch_size)
     if not prototypes:
         return [response_text] # Return raw response as a single prototype if parsing fails
-    return prototypes[:num_prototypes]
+    return prototypes[:batch_size]
 
 
-def evolve_prototype_to_solution(user_query: str, selected_approach: str, prototypes: list[str], thinker_model: str = THINKER_MODEL_NAME, max_steps: int = MAX_EVOLUTION_STEPS) -> str:
-    """Selects the best prototype and iteratively evolves it into a final solution."""
-    if not prototypes:
-        return f"No prototypes were generated for the approach: '{selected_approach}'. Cannot evolve."
+def generate_prototypes_for_approach(selected_approach: str, num_prototypes: int = DEFAULT_NUM_PROTOTYPES, generator_model: str = GENERATOR_MODEL_NAME, max_workers: int = PROBLEM_SOLVER_MAX_WORKERS,
+                                     budget: EvolutionBudget = None) -> list[str]:
+    """
+    Generates concrete prototypes or detailed implementations for a selected approach.
 
-    # Step 1: Select the best initial prototype
-    prototypes_formatted = "\n".join([f"- Prototype {idx+1}: {p}" for idx, p in enumerate(prototypes)])
-    selection_prompt = (
+    Asking one completion for 100 prototypes usually gets truncated, so the request is split into
+    batches of PROTOTYPE_BATCH_SIZE that run concurrently, and near-duplicates are removed afterwards.
+    """
+    batch_sizes = [min(PROTOTYPE_BATCH_SIZE, num_prototypes - offset) for offset in range(0, num_prototypes, PROTOTYPE_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = [
+            _submit_in_context(pool, _generate_prototype_batch, selected_approach, size, index, len(batch_sizes), generator_model, budget)
+            for index, size in enumerate(batch_sizes)
+        ]
+        prototypes = [prototype for future in futures for prototype in future.result()]
+
+    unique_prototypes = deduplicate_prototypes(prototypes)
+    print(f"Problem Solver: {len(prototypes)} prototypes from {len(batch_sizes)} batches, {len(unique_prototypes)} after deduplication.")
+    return unique_prototypes[:num_prototypes]
+
+
+def _judge_prototype_group(user_query: str, selected_approach: str, group: list[str], thinker_model: str, budget: EvolutionBudget) -> str:
+    """Asks the thinker model to pick the most promising prototype from a small group."""
+    if len(group) == 1:
+        return group[0]
+    prototypes_formatted = "\n".join([f"- Prototype {idx+1}: {p}" for idx, p in enumerate(group)])
+    # Identical for every group of the tournament, so the backend can reuse it from its prompt cache.
+    system_prompt = (
         f"The user's original query is: \"{user_query}\".\n"
         f"The guiding conceptual approach chosen is: \"{selected_approach}\".\n\n"
-        f"Here are several prototypes based on this approach:\n{prototypes_formatted}\n\n"
-        f"Which single prototype is the most promising starting point to develop a full solution for the user's query? "
-        f"Respond with ONLY the full text of the chosen prototype."
+        f"You will be shown several prototypes based on this approach. "
+        f"Pick the single prototype that is the most promising starting point to develop a full solution for the user's query. "
+        f"Respond with ONLY the number of the chosen prototype."
     )
-    current_best_solution = get_ollama_response(selection_prompt, model_name=thinker_model).strip()
+    selection_prompt = f"Here are the prototypes:\n{prototypes_formatted}"
+    response_text = _complete(selection_prompt, thinker_model, budget, system=system_prompt)
+    match = re.search(r"\d+", response_text)
+    if match and 1 <= int(match.group(0)) <= len(group):
+        return group[int(match.group(0)) - 1]
+    print(f"Problem Solver: Could not parse tournament choice '{response_text[:50]}'. Advancing the first prototype.")
+    return group[0]
+
+
+def select_top_prototypes(user_query: str, selected_approach: str, prototypes: list[str], count: int = 1, thinker_model: str = THINKER_MODEL_NAME, group_size: int = TOURNAMENT_GROUP_SIZE, max_workers: int = PROBLEM_SOLVER_MAX_WORKERS,
+                          budget: EvolutionBudget = None) -> list[str]:
+    """
+    Picks the `count` best prototypes with a knockout tournament: small groups are judged
+    concurrently and each group's winner advances, so no single selection prompt has to hold every
+    prototype. The final round uses exactly `count` groups so that `count` winners remain.
+    """
+    contenders = list(prototypes)
+    count = max(1, count)
+    round_number = 1
+    group_size = max(2, group_size)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while len(contenders) > count:
+            num_groups = max(count, math.ceil(len(contenders) / group_size))
+            groups = [contenders[i::num_groups] for i in range(num_groups)]
+            print(f"Problem Solver: Tournament round {round_number}: {len(contenders)} prototypes in {len(groups)} groups.")
+            futures = [_submit_in_context(pool, _judge_prototype_group, user_query, selected_approach, group, thinker_model, budget) for group in groups]
+            contenders = [future.result() for future in futures]
+            round_number += 1
+    return contenders
+
+
+def select_best_prototype(user_query: str, selected_approach: str, prototypes: list[str], thinker_model: str = THINKER_MODEL_NAME, group_size: int = TOURNAMENT_GROUP_SIZE, max_workers: int = PROBLEM_SOLVER_MAX_WORKERS,
+                          budget: EvolutionBudget = None) -> str:
+    """Picks the single best prototype with a knockout tournament (see select_top_prototypes)."""
+    return select_top_prototypes(user_query, selected_approach, prototypes, count=1, thinker_model=thinker_model, group_size=group_size, max_workers=max_workers, budget=budget)[0]
+
+
+def _evolution_system_prompt(user_query: str, selected_approach: str) -> str:
+    """
+    The part of every refinement prompt that stays the same for a whole evolution run. It is sent
+    as the system message so the backend evaluates it once and reuses it from its prompt cache on
+    each of the up to MAX_EVOLUTION_STEPS steps (and for every beam candidate).
+    """
+    return (
+        f"The user's original query is: \"{user_query}\".\n"
+        f"The overall guiding approach is: \"{selected_approach}\".\n"
+        f"You will be given the current version of the proposed solution/answer. "
+        f"Please critically evaluate and refine this current version to make it a more complete, accurate, and helpful final answer to the user's original query. "
+        f"Incorporate any necessary details, improve clarity, and ensure it fully addresses the query. "
+        f"Your output should be the new, improved version of the solution/answer."
+    )
+
+
+def _evolve_once(user_query: str, selected_approach: str, current_solution: str, thinker_model: str) -> tuple[str, dict]:
+    """Runs one refinement step on a solution. Returns the revision and the call's token usage."""
+    evolution_prompt = f"The current version of the proposed solution/answer is:\n\"{current_solution}\""
+    return get_ollama_completion(evolution_prompt, model_name=thinker_model, system=_evolution_system_prompt(user_query, selected_approach))
+
+
+def _score_solution(user_query: str, solution: str, thinker_model: str, budget: EvolutionBudget):
+    """Asks the thinker model to rate a solution from 1 to 10. Returns None if no score can be parsed."""
+    system_prompt = (
+        f"The user's original query is: \"{user_query}\".\n"
+        f"Rate how complete, accurate, and helpful the proposed answer you are given is on a scale from 1 to 10. "
+        f"Respond with ONLY the number."
+    )
+    scoring_prompt = f"Here is a proposed answer:\n\"{solution}\""
+    response_text, usage = get_ollama_completion(scoring_prompt, model_name=thinker_model, system=system_prompt)
+    budget.charge(usage)
+    match = re.search(r"\d+(?:\.\d+)?", response_text)
+    return float(match.group(0)) if match else None
+
+
+def evolve_prototype_to_solution(user_query: str, selected_approach: str, prototypes: list[str], thinker_model: str = THINKER_MODEL_NAME, max_steps: int = MAX_EVOLUTION_STEPS,
+                                 budget: EvolutionBudget = None, convergence_similarity: float = EVOLUTION_CONVERGENCE_SIMILARITY, score_with_thinker: bool = False,
+                                 beam_width: int = 1, prune_interval: int = BEAM_PRUNE_INTERVAL, beam_concurrency: int = None, progress_callback=None) -> dict:
+    """
+    Selects the best prototype and iteratively evolves it into a final solution.
+
+    The loop stops early once successive revisions stop changing (or, with `score_with_thinker`,
+    stop improving in thinker-rated quality) for EVOLUTION_PATIENCE steps, or when the request's
+    time or token budget runs out. With `beam_width` > 1 the top prototypes are evolved side by
+    side instead (see _evolve_beam). `progress_callback(event, **data)` is told about every step.
+    Returns a dict with `solution`, `steps_run`, `stop_reason`,
+    `tokens_used` and `elapsed_seconds`.
+    """
+    budget = budget or EvolutionBudget()
+    if not prototypes:
+        return {
+            'solution': f"No prototypes were generated for the approach: '{selected_approach}'. Cannot evolve.",
+            'steps_run': 0,
+            'stop_reason': 'no_prototypes',
+            'tokens_used': budget.tokens_used,
+            'elapsed_seconds': round(budget.elapsed_seconds(), 2),
+        }
+
+    if beam_width > 1:
+        return _evolve_beam(user_query, selected_approach, prototypes, thinker_model, max_steps, budget, convergence_similarity,
+                            beam_width, prune_interval, beam_concurrency or beam_width, progress_callback)
+
+    # Step 1: Select the best initial prototype
+    with tracing.span('solver.prototype_selection', prototypes=len(prototypes)):
+        current_best_solution = select_best_prototype(user_query, selected_approach, prototypes, thinker_model=thinker_model, budget=budget).strip()
     print(f"Problem Solver: Initial best prototype selected: {current_best_solution[:100]}...")
+    _notify(progress_callback, 'prototype_selected')
+    best_score = _score_solution(user_query, current_best_solution, thinker_model, budget) if score_with_thinker else None
 
-    # Step 2: Iteratively evolve the selected prototype
+    # Step 2: Iteratively evolve the selected prototype until it converges or the budget runs out
+    steps_run = 0
+    stalled_steps = 0
+    stop_reason = 'max_steps'
     for i in range(max_steps):
+        exhausted = budget.exhausted_reason()
+        if exhausted:
+            stop_reason = exhausted
+            break
+
         print(f"Problem Solver: Evolution step {i+1}/{max_steps}...")
-        evolution_prompt = (
-            f"The user's original query is: \"{user_query}\".\n"
-            f"The overall guiding approach is: \"{selected_approach}\".\n"
-            f"The current version of the proposed solution/answer is:\n\"{current_best_solution}\"\n\n"
-            f"Please critically evaluate and refine this current version to make it a more complete, accurate, and helpful final answer to the user's original query. "
-            f"Incorporate any necessary details, improve clarity, and ensure it fully addresses the query. "
-            f"Your output should be the new, improved version of the solution/answer."
-        )
-        current_best_solution = get_ollama_response(evolution_prompt, model_name=thinker_model).strip()
-        print(f"Problem Solver: Evolved solution (step {i+1}): {current_best_solution[:100]}...")
-        
-    return current_best_solution
+        _notify(progress_callback, 'evolution_step', step=i+1, max_steps=max_steps)
+        with tracing.span('solver.evolution_step', step=i+1) as step_span:
+            evolved_solution, usage = _evolve_once(user_query, selected_approach, current_best_solution, thinker_model)
+            steps_run += 1
+            if not usage['total_tokens']:
+                # The call failed and returned an apology instead of a revision; keep the last good version.
+                print(f"Problem Solver: Evolution step {i+1} failed. Keeping the previous solution.")
+                stop_reason = 'llm_error'
+                break
+            budget.charge(usage)
+
+            similarity = revision_similarity(current_best_solution, evolved_solution)
+            step_span.set(similarity=round(similarity, 3))
+            step_stop_reason = 'converged' if similarity >= convergence_similarity else None
+            if score_with_thinker:
+                score = _score_solution(user_query, evolved_solution, thinker_model, budget)
+                step_span.set(score=score)
+                if score is not None and best_score is not None and score < best_score:
+                    # A worse revision is discarded rather than built upon.
+                    print(f"Problem Solver: Step {i+1} scored {score} < {best_score}. Discarding revision.")
+                    evolved_solution = current_best_solution
+                if score is not None and best_score is not None and score - best_score < EVOLUTION_MIN_QUALITY_DELTA:
+                    step_stop_reason = step_stop_reason or 'quality_plateau'
+                if score is not None and (best_score is None or score > best_score):
+                    best_score = score
+        current_best_solution = evolved_solution.strip()
+        print(f"Problem Solver: Evolved solution (step {i+1}, similarity {similarity:.2f}): {current_best_solution[:100]}...")
+
+        stalled_steps = stalled_steps + 1 if step_stop_reason else 0
+        if stalled_steps >= EVOLUTION_PATIENCE:
+            stop_reason = step_stop_reason
+            break
+
+    print(f"Problem Solver: Evolution stopped after {steps_run} steps ({stop_reason}).")
+    _notify(progress_callback, 'evolution_finished', steps_run=steps_run, stop_reason=stop_reason)
+    return {
+        'solution': current_best_solution,
+        'steps_run': steps_run,
+        'stop_reason': stop_reason,
+        'tokens_used': budget.tokens_used,
+        'elapsed_seconds': round(budget.elapsed_seconds(), 2),
+    }
+
+
+def _evolve_beam(user_query: str, selected_approach: str, prototypes: list[str], thinker_model: str, max_steps: int, budget: EvolutionBudget,
+                 convergence_similarity: float, beam_width: int, prune_interval: int, concurrency: int, progress_callback=None) -> dict:
+    """
+    Beam-style evolution. The top `beam_width` prototypes are refined concurrently, one step per
+    round, so the wall-clock cost stays close to the single-chain loop. Every `prune_interval`
+    steps the thinker model scores each candidate and the weaker half of the beam is dropped.
+    A candidate whose revisions converge, or whose evolution call fails, stops evolving but stays in the beam.
+    """
+    with tracing.span('solver.prototype_selection', prototypes=len(prototypes)):
+        starting_points = select_top_prototypes(user_query, selected_approach, prototypes, count=beam_width, thinker_model=thinker_model, budget=budget)
+    beam = [{'solution': s.strip(), 'stalled_steps': 0, 'active': True, 'failed': False, 'score': None} for s in starting_points]
+    print(f"Problem Solver: Beam evolution with {len(beam)} candidates, pruning every {prune_interval} steps.")
+    _notify(progress_callback, 'prototype_selected', candidates=len(beam))
+
+    def score_beam(pool):
+        futures = [_submit_in_context(pool, _score_solution, user_query, candidate['solution'], thinker_model, budget) for candidate in beam]
+        for candidate, future in zip(beam, futures):
+            score = future.result()
+            candidate['score'] = score if score is not None else 0.0
+
+    steps_run = 0
+    stop_reason = 'max_steps'
+    scored_at_step = None
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for i in range(max_steps):
+            exhausted = budget.exhausted_reason()
+            if exhausted:
+                stop_reason = exhausted
+                break
+            active = [candidate for candidate in beam if candidate['active']]
+            if not active:
+                # Only failed calls left nothing to evolve: report it like the single-chain loop does.
+                stop_reason = 'converged' if any(not candidate['failed'] for candidate in beam) else 'llm_error'
+                break
 
+            print(f"Problem Solver: Beam evolution step {i+1}/{max_steps} ({len(active)} active candidates)...")
+            _notify(progress_callback, 'evolution_step', step=i+1, max_steps=max_steps, active_candidates=len(active))
+            with tracing.span('solver.evolution_step', step=i+1, active_candidates=len(active)):
+                futures = [_submit_in_context(pool, _evolve_once, user_query, selected_approach, candidate['solution'], thinker_model) for candidate in active]
+                for candidate, future in zip(active, futures):
+                    evolved_solution, usage = future.result()
+                    if not usage['total_tokens']:
+                        candidate['active'] = False # Failed call; freeze this candidate at its last good version
+                        candidate['failed'] = True
+                        continue
+                    budget.charge(usage)
+                    similarity = revision_similarity(candidate['solution'], evolved_solution)
+                    candidate['solution'] = evolved_solution.strip()
+                    candidate['stalled_steps'] = candidate['stalled_steps'] + 1 if similarity >= convergence_similarity else 0
+                    if candidate['stalled_steps'] >= EVOLUTION_PATIENCE:
+                        candidate['active'] = False
+            steps_run += 1
+
+            if steps_run % prune_interval == 0 and len(beam) > 1:
+                with tracing.span('solver.beam_scoring', candidates=len(beam)):
+                    score_beam(pool)
+                scored_at_step = steps_run
+                beam.sort(key=lambda candidate: candidate['score'], reverse=True)
+                beam = beam[:math.ceil(len(beam) / 2)]
+                print(f"Problem Solver: Pruned beam to {len(beam)} candidates (best score {beam[0]['score']}).")
+
+        if len(beam) > 1 and scored_at_step != steps_run:
+            with tracing.span('solver.beam_scoring', candidates=len(beam)):
+                score_beam(pool)
+    best = max(beam, key=lambda candidate: candidate['score'] or 0.0)
+
+    print(f"Problem Solver: Beam evolution stopped after {steps_run} steps ({stop_reason}).")
+    _notify(progress_callback, 'evolution_finished', steps_run=steps_run, stop_reason=stop_reason)
+    return {
+        'solution': best['solution'],
+        'steps_run': steps_run,
+        'stop_reason': stop_reason,
+        'tokens_used': budget.tokens_used,
+        'elapsed_seconds': round(budget.elapsed_seconds(), 2),
+        'beam_width': len(starting_points),
+        'final_beam_size': len(beam),
+    }
+
+
+def solve_with_multi_step_refinement(user_query: str, evolution_options: dict = None, return_details: bool = False, progress_callback=None):
+    """
+    Orchestrates the multi-step LLM problem-solving approach.
+
+    `evolution_options` are per-request overrides (see EVOLUTION_OPTION_TYPES). Returns the final
+    solution text, or with `return_details=True` a dict with the `solution` and an `evolution`
+    summary (steps run, stop reason, tokens and time used). `progress_callback(event, **data)`, if
+    given, is called as each stage finishes (ideas_generated, approach_selected,
+    prototypes_generated, prototype_selected, evolution_step, evolution_finished).
+    """
+    options = parse_evolution_options(evolution_options)
+    budget = EvolutionBudget(
+        time_budget_seconds=options.get('time_budget_seconds', EVOLUTION_TIME_BUDGET_SECONDS),
+        token_budget=options.get('token_budget', EVOLUTION_TOKEN_BUDGET),
+    )
+
+    def finish(solution: str, evolution: dict = None):
+        if not return_details:
+            return solution
+        return {'solution': solution, 'evolution': evolution}
 
-def solve_with_multi_step_refinement(user_query: str) -> str:
-    """Orchestrates the multi-step LLM problem-solving approach."""
     print(f"Problem Solver: Stage 1 - Generating initial ideas for query: {user_query}")
-    initial_ideas = generate_initial_ideas(user_query)
+    with tracing.span('solver.ideas'):
+        initial_ideas = generate_initial_ideas(user_query, budget=budget)
     if not initial_ideas:
         print("Problem Solver: No initial ideas generated. Falling back to direct simple response.")
-        return get_ollama_response(user_query, model_name=GENERATOR_MODEL_NAME)
+        return finish(get_ollama_response(user_query, model_name=GENERATOR_MODEL_NAME))
     print(f"Problem Solver: Generated {len(initial_ideas)} initial ideas.")
+    _notify(progress_callback, 'ideas_generated', count=len(initial_ideas))
 
     print("Problem Solver: Stage 2 - Selecting best approach from initial ideas.")
-    selected_approach = select_best_approach(user_query, initial_ideas)
+    with tracing.span('solver.approach', ideas=len(initial_ideas)):
+        selected_approach = select_best_approach(user_query, initial_ideas, budget=budget)
     if not selected_approach or "No initial ideas provided" in selected_approach: # Basic check
         print(f"Problem Solver: Could not select a best approach. Original ideas: {initial_ideas}. Falling back.")
-        return get_ollama_response(user_query, model_name=THINKER_MODEL_NAME) # Fallback to thinker with original query
+        return finish(get_ollama_response(user_query, model_name=THINKER_MODEL_NAME)) # Fallback to thinker with original query
     print(f"Problem Solver: Selected approach: {selected_approach}")
+    _notify(progress_callback, 'approach_selected', approach=selected_approach)
 
     print("Problem Solver: Stage 3 - Generating prototypes for the selected approach.")
-    prototypes = generate_prototypes_for_approach(selected_approach)
+    with tracing.span('solver.prototypes'):
+        prototypes = generate_prototypes_for_approach(selected_approach, budget=budget)
     if not prototypes:
         print(f"Problem Solver: No prototypes generated for approach '{selected_approach}'. Using approach as response.")
-        return selected_approach # Or try to directly answer with thinker based on selected_approach
+        return finish(selected_approach) # Or try to directly answer with thinker based on selected_approach
     print(f"Problem Solver: Generated {len(prototypes)} prototypes.")
+    _notify(progress_callback, 'prototypes_generated', count=len(prototypes))
 
     print("Problem Solver: Stage 4 - Selecting and evolving the best prototype into a final solution.")
-    final_solution = evolve_prototype_to_solution(user_query, selected_approach, prototypes)
+    with tracing.span('solver.evolution') as evolution_span:
+        evolution = evolve_prototype_to_solution(
+            user_query, selected_approach, prototypes,
+            max_steps=options.get('max_steps', MAX_EVOLUTION_STEPS),
+            budget=budget,
+            convergence_similarity=options.get('convergence_similarity', EVOLUTION_CONVERGENCE_SIMILARITY),
+            score_with_thinker=options.get('score_with_thinker', False),
+            beam_width=options.get('beam_width', 1),
+            prune_interval=options.get('prune_interval', BEAM_PRUNE_INTERVAL),
+            beam_concurrency=options.get('beam_concurrency'),
+            progress_callback=progress_callback,
+        )
+        evolution_span.set(steps_run=evolution['steps_run'], stop_reason=evolution['stop_reason'])
     print("Problem Solver: Multi-step refinement complete.")
-    return final_solution
+    final_solution = evolution.pop('solution')
+    return finish(final_solution, evolution)
 
 # Old function, to be replaced by solve_with_multi_step_refinement
 # def solve_with_two_tier_llm(user_query: str) -> str:
@@ -0,0 +1,87 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+
+PROGRESS_EVENT_TTL_SECONDS = float(os.getenv("PROGRESS_EVENT_TTL_SECONDS", "3600"))  # How long a finished topic's events are kept
+MAX_EVENTS_PER_TOPIC = 500  # Oldest events are dropped beyond this; late subscribers still get the latest state
+
+FINAL_EVENTS = ('completed', 'failed', 'cancelled')
+
+
+class ProgressEventBus:
+    """
+    In-process publish/subscribe for task progress.
+
+    Each topic (an AutoSCI task ID) keeps an ordered list of events with increasing IDs, so a
+    subscriber can block until something newer than the last event it saw arrives, and a client
+    that reconnects can resume from its `Last-Event-ID`. Async subscribers wait on an asyncio.Event
+    instead of the Condition, so they hold no thread.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._topics = {}  # topic -> {'events': [...], 'closed_at': float or None}
+        self._ids = itertools.count(1)
+        self._async_waiters = {}  # topic -> {(event loop, asyncio.Event)}
+
+    def publish(self, topic: str, event: str, data: dict = None) -> dict:
+        """Appends an event to a topic and wakes subscribers. Final events close the topic."""
+        with self._condition:
+            self._evict_locked()
+            state = self._topics.setdefault(topic, {'events': [], 'closed_at': None})
+            record = {'id': next(self._ids), 'event': event, 'data': data or {}, 'time': time.time()}
+            state['events'].append(record)
+            del state['events'][:-MAX_EVENTS_PER_TOPIC]
+            if event in FINAL_EVENTS:
+                state['closed_at'] = time.monotonic()
+            self._condition.notify_all()
+            for loop, waiter in self._async_waiters.get(topic, ()):
+                loop.call_soon_threadsafe(waiter.set)
+            return record
+
+    def wait_for_events(self, topic: str, after_id: int = 0, timeout: float = 15.0) -> list:
+        """Returns events newer than after_id, blocking up to timeout seconds for one to arrive."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                events = self._events_after_locked(topic, after_id)
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self._condition.wait(remaining)
+
+    async def async_wait_for_events(self, topic: str, after_id: int = 0, timeout: float = 15.0) -> list:
+        """wait_for_events for the ASGI server: awaits an asyncio.Event that publish() sets through this loop."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Event())
+        with self._condition:
+            events = self._events_after_locked(topic, after_id)
+            if events:
+                return events
+            self._async_waiters.setdefault(topic, set()).add(subscriber)
+        try:
+            await asyncio.wait_for(subscriber[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                waiters = self._async_waiters[topic]
+                waiters.discard(subscriber)
+                if not waiters:
+                    del self._async_waiters[topic]
+        with self._condition:
+            return self._events_after_locked(topic, after_id)
+
+    def _events_after_locked(self, topic: str, after_id: int) -> list:
+        return [e for e in self._topics.get(topic, {}).get('events', []) if e['id'] > after_id]
+
+    def is_closed(self, topic: str) -> bool:
+        with self._condition:
+            state = self._topics.get(topic)
+            return bool(state and state['closed_at'] is not None)
+
+    def _evict_locked(self):
+        cutoff = time.monotonic() - PROGRESS_EVENT_TTL_SECONDS
+        for topic in [t for t, state in self._topics.items() if state['closed_at'] is not None and state['closed_at'] < cutoff]:
+            del self._topics[topic]
@@ -0,0 +1,73 @@
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the function, and callers
+    that arrive while it is running wait for and share its result (or exception) instead of
+    repeating the work.
+
+    Tracks how many calls were coalesced so callers can report the upstream calls saved.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> Future of the call in flight
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, function) -> tuple:
+        """
+        Returns (function(), False) for the first caller of `key`, and (the in-flight call's result,
+        True) for callers that joined it.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+        try:
+            result = function()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def do_many(self, keys, function) -> tuple[dict, set]:
+        """
+        do() for several keys at once: keys already in flight are joined, and `function(keys)` runs
+        once for the others and returns {key: result}. Returns ({key: result} for every key, the set
+        of keys that were joined).
+        """
+        with self._lock:
+            joined = {key: self._calls[key] for key in keys if key in self._calls}
+            led = {key: Future() for key in keys if key not in joined}
+            self._calls.update(led)
+            self.coalesced += len(joined)
+        results = {}
+        try:
+            if led:
+                results = dict(function(list(led)))
+        except BaseException as e:
+            for future in led.values():
+                future.set_exception(e)
+            raise
+        else:
+            for key, future in led.items():
+                future.set_result(results.get(key))
+        finally:
+            with self._lock:
+                for key in led:
+                    del self._calls[key]
+        for key, future in joined.items():
+            results[key] = future.result()
+        return results, set(joined)
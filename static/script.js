@@ -1,3 +1,8 @@
+// Messages shown in the chat box. They are kept in localStorage for display only; the server
+// keeps the conversation context for the session itself.
+let messagesHistory = [];
+const MAX_SAVED_MESSAGES = 100;
+
 document.addEventListener('DOMContentLoaded', () => {
     const userInput = document.getElementById('userInput');
     const sendButton = document.getElementById('sendButton');
@@ -16,9 +21,10 @@ document.addEventListener('DOMContentLoaded', () => {
     const caldavUserInput = document.getElementById('caldavUser');
     const caldavPassInput = document.getElementById('caldavPass');
     const numTheoriesInput = document.getElementById('numTheories');
+    const beamWidthInput = document.getElementById('beamWidth');
     const autosciButton = document.getElementById('autosciButton');
     const evolutionModeToggle = document.getElementById('evolutionModeToggle');
-    let messagesHistory = [];
+    const sessionId = getChatSessionId();
 
     // Cookie helper functions
     function setCookie(name, value, days) {
@@ -64,6 +70,7 @@ document.addEventListener('DOMContentLoaded', () => {
             setCookie('caldavUser', caldavUserInput.value, 365);
             setCookie('caldavPass', caldavPassInput.value, 365);
             setCookie('numTheories', numTheoriesInput.value, 365);
+            setCookie('beamWidth', beamWidthInput.value, 365);
             alert('Settings saved!');
             settingsModal.style.display = "none";
         };
@@ -78,6 +85,7 @@ document.addEventListener('DOMContentLoaded', () => {
         caldavUserInput.value = getCookie('caldavUser') || '';
         caldavPassInput.value = getCookie('caldavPass') || '';
         numTheoriesInput.value = getCookie('numTheories') || '1';
+        beamWidthInput.value = getCookie('beamWidth') || '1';
     }
     loadSettings();
 
@@ -153,13 +161,6 @@ document.addEventListener('DOMContentLoaded', () => {
         const userMessage = userInput.value.trim();
         if (!userMessage) return;
 
-        // History sent to server should not include the current message
-        const messageText = `<History for context>
-        ${JSON.stringify(messagesHistory)}
-        </History for context>
-        <User asks currently> ${userMessage}</User asks currently>
-        `;
-
         // Add user message to UI and history
         addMessageToChat('user', userMessage);
         userInput.value = '';
@@ -173,16 +174,32 @@ document.addEventListener('DOMContentLoaded', () => {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                message: messageText,
+                message: userMessage,
+                session_id: sessionId,
                 nextcloud_creds: nextcloudCreds,
                 caldav_creds: caldavCreds,
                 use_evolution_mode: evolutionModeToggle.checked,
-                num_theories: parseInt(numTheoriesInput.value || '1')
+                evolution_options: { beam_width: parseInt(beamWidthInput.value || '1') },
+                num_theories: parseInt(numTheoriesInput.value || '1'),
+                stream: true
             })
         })
-        .then(response => response.json())
+        .then(response => {
+            // Streamed replies arrive as NDJSON deltas; everything else is a single JSON object.
+            const contentType = response.headers.get('Content-Type') || '';
+            if (contentType.includes('application/x-ndjson')) {
+                return readChatStream(response, aiResponsePlaceholder).then(fullText => ({ response: fullText }));
+            }
+            return response.json();
+        })
         .then(data => {
-            if (data.action === 'autosci_initiate_prompt') {
+            if (data.error) {
+                // e.g. HTTP 429 when the AutoSCI queue is full
+                const retryHint = data.retry_after ? ` (try again in about ${data.retry_after} seconds)` : '';
+                aiResponsePlaceholder.innerHTML = `${data.error}${retryHint}`;
+                aiResponsePlaceholder.parentElement.classList.add('error-message');
+                speak(data.error);
+            } else if (data.action === 'autosci_initiate_prompt') {
                 // Handle AutoSCI initiation
                 const taskId = data.task_id;
                 const numTheories = parseInt(numTheoriesInput.value || '1');
@@ -210,37 +227,106 @@ document.addEventListener('DOMContentLoaded', () => {
         });
     }
 
+    async function readChatStream(response, placeholderElement) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let fullText = '';
+        let started = false;
+
+        const handleLine = (line) => {
+            if (!line.trim()) return;
+            const event = JSON.parse(line);
+            if (event.type === 'delta') {
+                if (!started) {
+                    // Swap the "Thinking..." placeholder for the first tokens.
+                    started = true;
+                    placeholderElement.parentElement.classList.remove('system-message');
+                }
+                fullText += event.content;
+                placeholderElement.innerHTML = fullText;
+                chatBox.scrollTop = chatBox.scrollHeight;
+            } else if (event.type === 'done') {
+                fullText = event.response;
+            } else if (event.type === 'error') {
+                throw new Error(event.error);
+            }
+        };
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop(); // Keep any partial line for the next chunk
+            lines.forEach(handleLine);
+        }
+        handleLine(buffer);
+        return fullText;
+    }
+
+    function describeAutosciEvent(event, totalTheories) {
+        const theory = totalTheories > 1 && event.theory_index !== undefined ? `Theory ${event.theory_index + 1}: ` : '';
+        switch (event.event) {
+            case 'snapshot':
+                if (event.queue_position) return `AutoSCI discovery queued... (position ${event.queue_position} in line)`;
+                return `AutoSCI discovery in progress... (${event.progress.completed}/${event.progress.total} theories completed)`;
+            case 'running':
+                return 'AutoSCI discovery started...';
+            case 'ideas_generated':
+                return `${theory}Generated ${event.count} initial ideas...`;
+            case 'approach_selected':
+                return `${theory}Selected an approach, building prototypes...`;
+            case 'prototypes_generated':
+                return `${theory}Generated ${event.count} prototypes, picking the best...`;
+            case 'prototype_selected':
+                return `${theory}Prototype selected, evolving it into a solution...`;
+            case 'evolution_step':
+                return `${theory}Refining the solution (step ${event.step}/${event.max_steps})...`;
+            case 'evolution_finished':
+                return `${theory}Refinement finished after ${event.steps_run} steps, writing up...`;
+            case 'theory_completed':
+                return `AutoSCI discovery in progress... (${event.completed}/${event.total} theories completed)`;
+            default:
+                return null;
+        }
+    }
+
     function pollAutosciStatus(taskId, placeholderElement, totalTheories) {
-        const pollInterval = setInterval(() => {
-            fetch(`/check_autosci_status/${taskId}`)
-                .then(response => response.json())
-                .then(statusData => {
-                    if (statusData.status === 'completed') {
-                        clearInterval(pollInterval);
-                        placeholderElement.innerHTML = statusData.response;
-                        placeholderElement.parentElement.classList.remove('system-message');
-                        updateAndSaveHistory({ role: 'assistant', content: statusData.response });
-                        speak(statusData.response);
-                    } else if (statusData.status === 'failed') {
-                        clearInterval(pollInterval);
-                        placeholderElement.innerHTML = `AutoSCI Error: ${statusData.error}`;
-                        placeholderElement.parentElement.classList.add('error-message');
-                        speak(`AutoSCI Error: ${statusData.error}`);
-                    } else if (statusData.status === 'running' && statusData.progress) {
-                        const { completed, total } = statusData.progress;
-                        placeholderElement.innerHTML = `AutoSCI discovery in progress... (${completed}/${total} theories completed)`;
-                    } else {
-                        placeholderElement.innerHTML = `AutoSCI discovery in progress...`;
-                    }
-                })
-                .catch(error => {
-                    clearInterval(pollInterval);
-                    console.error('AutoSCI Status Check Error:', error);
-                    placeholderElement.innerHTML = 'Sorry, something went wrong while checking the AutoSCI discovery status.';
-                    placeholderElement.parentElement.classList.add('error-message');
-                    speak(placeholderElement.textContent);
-                });
-        }, 3000); // Poll every 3 seconds
+        // Progress is pushed by the server over server-sent events; EventSource reconnects on its own
+        // and resumes from the last event it saw.
+        const events = new EventSource(`/autosci_events/${taskId}`);
+        let finished = false;
+
+        events.onmessage = (message) => {
+            const event = JSON.parse(message.data);
+            if (event.event === 'completed') {
+                finished = true;
+                events.close();
+                placeholderElement.innerHTML = event.result;
+                placeholderElement.parentElement.classList.remove('system-message');
+                updateAndSaveHistory({ role: 'assistant', content: event.result });
+                speak(event.result);
+            } else if (event.event === 'failed' || event.event === 'cancelled') {
+                finished = true;
+                events.close();
+                placeholderElement.innerHTML = `AutoSCI Error: ${event.error}`;
+                placeholderElement.parentElement.classList.add('error-message');
+                speak(`AutoSCI Error: ${event.error}`);
+            } else {
+                const text = describeAutosciEvent(event, totalTheories);
+                if (text) placeholderElement.innerHTML = text;
+            }
+        };
+
+        events.onerror = () => {
+            // A dropped connection is retried by the browser; only give up once it has closed for good.
+            if (finished || events.readyState !== EventSource.CLOSED) return;
+            console.error('AutoSCI event stream closed unexpectedly.');
+            placeholderElement.innerHTML = 'Sorry, something went wrong while checking the AutoSCI discovery status.';
+            placeholderElement.parentElement.classList.add('error-message');
+            speak(placeholderElement.textContent);
+        };
     }
 
     function getNextcloudCredentials() {
@@ -263,7 +349,17 @@ document.addEventListener('DOMContentLoaded', () => {
     loadChatHistory();
 });
 
+function getChatSessionId() {
+    let sessionId = localStorage.getItem('chatSessionId');
+    if (!sessionId) {
+        sessionId = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        localStorage.setItem('chatSessionId', sessionId);
+    }
+    return sessionId;
+}
+
 function saveChatHistory() {
+    messagesHistory = messagesHistory.slice(-MAX_SAVED_MESSAGES);
     localStorage.setItem('chatHistory', JSON.stringify(messagesHistory));
 }
 
@@ -0,0 +1,109 @@
+import json
+
+
+class StreamingJSONObjectParser:
+    """
+    Incremental parser for one JSON object arriving in chunks (e.g. streamed LLM output).
+
+    Feed it text as it arrives; every top-level field is decoded as soon as its value is complete,
+    so a caller can stop reading once the fields it needs are in, without waiting for the rest of
+    the object. Text before the first '{' (e.g. a model's preamble) is skipped.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        self.complete = False  # The closing brace of the object has been seen
+        self.error = None  # Set when a field value is not valid JSON
+        self._position = 0  # Index into _text of the next character to scan
+        self._text = ""
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expecting = 'key'  # 'key', 'colon', 'value' or 'comma', for the top level only
+        self._string_start = None
+        self._key = None
+        self._value_start = None
+        self._value_is_scalar = False
+
+    def has(self, *names) -> bool:
+        return all(name in self.fields for name in names)
+
+    def feed(self, chunk: str) -> "StreamingJSONObjectParser":
+        if self.complete or self.error or not chunk:
+            return self
+        self._text += chunk
+        while self._position < len(self._text) and not self.complete and not self.error:
+            self._scan(self._text[self._position], self._position)
+            self._position += 1
+        return self
+
+    def _scan(self, char: str, index: int):
+        if not self._started:
+            if char == '{':
+                self._started = True
+                self._depth = 1
+            return
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif char == '\\':
+                self._escape = True
+            elif char == '"':
+                self._in_string = False
+                if self._depth == 1:
+                    self._end_top_level_string(index)
+            return
+
+        if self._depth == 1 and self._value_is_scalar and (char in ',}' or char.isspace()):
+            self._finish_value(index)
+        if char == '"':
+            self._in_string = True
+            if self._depth == 1:
+                self._string_start = index
+                if self._expecting == 'value':
+                    self._value_start = index
+        elif char in '{[':
+            if self._depth == 1 and self._expecting == 'value':
+                self._value_start = index
+            self._depth += 1
+        elif char in '}]':
+            self._depth -= 1
+            if self._depth == 1 and self._value_start is not None:
+                self._finish_value(index + 1)
+            elif self._depth == 0:
+                self.complete = True
+        elif self._depth == 1:
+            if char == ':' and self._expecting == 'colon':
+                self._expecting = 'value'
+            elif char == ',':
+                self._expecting = 'key'
+            elif not char.isspace() and self._expecting == 'value' and self._value_start is None:
+                self._value_start = index # A number, true, false or null
+                self._value_is_scalar = True
+
+    def _end_top_level_string(self, index: int):
+        if self._expecting == 'key':
+            self._key = json.loads(self._text[self._string_start:index + 1])
+            self._expecting = 'colon'
+        elif self._expecting == 'value':
+            self._finish_value(index + 1)
+
+    def _finish_value(self, end: int):
+        raw = self._text[self._value_start:end]
+        self._value_start = None
+        self._value_is_scalar = False
+        self._expecting = 'comma'
+        try:
+            self.fields[self._key] = json.loads(raw)
+        except json.JSONDecodeError as e:
+            self.error = f"Invalid JSON for field '{self._key}': {e}"
+
+
+def parse_json_object(text: str) -> dict:
+    """
+    Parses the first JSON object in `text`, ignoring text around it. Returns its fields, or None if
+    no complete, valid object was found.
+    """
+    parser = StreamingJSONObjectParser().feed(text)
+    return parser.fields if parser.complete and not parser.error else None
@@ -0,0 +1,171 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+AUTOSCI_DB_PATH = os.getenv("AUTOSCI_DB_PATH", "autosci_tasks.db")
+AUTOSCI_TASK_TTL_SECONDS = float(os.getenv("AUTOSCI_TASK_TTL_SECONDS", "86400"))  # Finished tasks are evicted after this long
+
+ACTIVE_STATUSES = ('pending', 'running')
+FINISHED_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+class SQLiteTaskStore:
+    """
+    SQLite-backed persistence for AutoSCI tasks. Uses WAL journaling so status reads never block
+    writers, and `BEGIN IMMEDIATE` transactions so concurrent theory threads cannot interleave updates.
+
+    A task has a status ('pending', 'running', 'completed', 'failed' or 'cancelled'), a number of theories it
+    is waiting for, the per-theory results recorded so far, and a combined result or error once it
+    finishes.
+    """
+
+    def __init__(self, db_path: str = AUTOSCI_DB_PATH):
+        self.db_path = db_path
+        self._thread_local = threading.local()
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS tasks (
+                    task_id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    total_theories INTEGER NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS theories (
+                    task_id TEXT NOT NULL REFERENCES tasks(task_id) ON DELETE CASCADE,
+                    theory_index INTEGER NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    PRIMARY KEY (task_id, theory_index)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_finished ON tasks (status, finished_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._thread_local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._thread_local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _load_task(self, conn, task_id: str):
+        row = conn.execute("SELECT * FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        if row is None:
+            return None
+        task = dict(row)
+        task['theories'] = [
+            {key: value for key, value in dict(theory).items() if key != 'task_id' and value is not None}
+            for theory in conn.execute("SELECT * FROM theories WHERE task_id = ? ORDER BY theory_index", (task_id,))
+        ]
+        return task
+
+    def create_task(self, task_id: str, total_theories: int, status: str = 'running'):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO tasks (task_id, status, total_theories, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (task_id, status, total_theories, now, now),
+            )
+
+    def get_task(self, task_id: str):
+        """Returns the task as a dict (including its `theories`), or None if it does not exist."""
+        return self._load_task(self._connection(), task_id)
+
+    def transition(self, task_id: str, from_statuses: tuple, to_status: str, **fields) -> bool:
+        """Atomically moves a task to `to_status` if it is currently in one of `from_statuses`."""
+        now = time.time()
+        assignments = {'status': to_status, 'updated_at': now, **fields}
+        if to_status in FINISHED_STATUSES:
+            assignments['finished_at'] = now
+        set_clause = ", ".join(f"{column} = ?" for column in assignments)
+        placeholders = ", ".join("?" for _ in from_statuses)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE tasks SET {set_clause} WHERE task_id = ? AND status IN ({placeholders})",
+                (*assignments.values(), task_id, *from_statuses),
+            )
+            return cursor.rowcount == 1
+
+    def record_theory(self, task_id: str, theory_index: int, result: str = None, error: str = None, combine=None):
+        """
+        Atomically stores one theory's outcome and finishes the task when appropriate: any error
+        fails it, and once every theory has a result `combine(results)` builds the final result.
+        Returns the updated task dict.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO theories (task_id, theory_index, result, error) VALUES (?, ?, ?, ?)",
+                (task_id, theory_index, result, error),
+            )
+            task = self._load_task(conn, task_id)
+            if task is None or task['status'] in FINISHED_STATUSES:
+                return task
+            if error is not None:
+                # If any theory fails, mark the whole task as failed
+                conn.execute(
+                    "UPDATE tasks SET status = 'failed', error = ?, updated_at = ?, finished_at = ? WHERE task_id = ?",
+                    (f"Theory {theory_index} failed: {error}", now, now, task_id),
+                )
+            elif len(task['theories']) >= task['total_theories']:
+                results = [theory.get('result', '') for theory in task['theories']]
+                combined = combine(results) if combine else "\n\n".join(results)
+                conn.execute(
+                    "UPDATE tasks SET status = 'completed', result = ?, updated_at = ?, finished_at = ? WHERE task_id = ?",
+                    (combined, now, now, task_id),
+                )
+            else:
+                conn.execute("UPDATE tasks SET status = 'running', updated_at = ? WHERE task_id = ?", (now, task_id))
+            return self._load_task(conn, task_id)
+
+    def delete_task(self, task_id: str):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+
+    def evict_expired(self, ttl_seconds: float = AUTOSCI_TASK_TTL_SECONDS) -> int:
+        """Deletes finished tasks older than ttl_seconds. Returns how many were removed."""
+        cutoff = time.time() - ttl_seconds
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM tasks WHERE status IN ('completed', 'failed', 'cancelled') AND finished_at < ?",
+                (cutoff,),
+            )
+            return cursor.rowcount
+
+    def recover_inflight(self) -> list:
+        """Returns (task_id, missing_theory_indices) for every task that was still active, for resubmission."""
+        recovered = []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT task_id, total_theories FROM tasks WHERE status IN ('pending', 'running')"
+            ).fetchall()
+            for row in rows:
+                done = {
+                    theory['theory_index']
+                    for theory in conn.execute("SELECT theory_index FROM theories WHERE task_id = ?", (row['task_id'],))
+                }
+                missing = [index for index in range(row['total_theories']) if index not in done]
+                recovered.append((row['task_id'], missing))
+        return recovered
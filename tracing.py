@@ -0,0 +1,310 @@
+import bisect
+import contextvars
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "300"))  # Spans kept in one request's timing breakdown
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)  # Seconds
+METRIC_PREFIX = "samantha_"
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span_id = contextvars.ContextVar("current_span_id", default=None)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Histogram:
+    """A Prometheus histogram family: cumulative buckets, sum and count per label set."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_items = sorted(self._series.items())
+            series_items = [(key, list(series)) for key, series in series_items]
+        for key, series in series_items:
+            labels = tuple(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', _format_value(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {series[-1]}")
+        return lines
+
+
+class Counter:
+    """A Prometheus counter family."""
+
+    def __init__(self, name: str, help_text: str, label_names: tuple):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_format_labels(tuple(zip(self.label_names, key)))} {_format_value(value)}" for key, value in items)
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Holds the metric families and renders them in the Prometheus text exposition format.
+    Collectors registered with add_gauge_collector() contribute point-in-time gauges (queue
+    depths, sessions, ...) computed at scrape time.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._gauge_collectors = []
+
+    def histogram(self, name: str, help_text: str, label_names: tuple = ()) -> Histogram:
+        metric = Histogram(METRIC_PREFIX + name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, label_names: tuple = ()) -> Counter:
+        metric = Counter(METRIC_PREFIX + name, help_text, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def add_gauge_collector(self, collect):
+        """`collect()` returns [(name, help, [(labels dict, value), ...]), ...]."""
+        self._gauge_collectors.append(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collect in self._gauge_collectors:
+            try:
+                gauges = collect()
+            except Exception as e:
+                print(f"Tracing: Gauge collector failed: {e}")
+                continue
+            for name, help_text, samples in gauges:
+                lines.append(f"# HELP {METRIC_PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {METRIC_PREFIX}{name} gauge")
+                lines.extend(f"{METRIC_PREFIX}{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+span_duration = metrics.histogram("span_duration_seconds", "Duration of traced operations by span name.", ("span",))
+span_errors = metrics.counter("span_errors_total", "Traced operations that raised, by span name.", ("span",))
+chat_duration = metrics.histogram("chat_request_duration_seconds", "End-to-end /chat latency by intent.", ("intent",))
+llm_duration = metrics.histogram("llm_call_duration_seconds", "LLM call latency by model.", ("model",))
+llm_time_to_first_byte = metrics.histogram(
+    "llm_time_to_first_byte_seconds", "Time from sending an LLM request to its first streamed delta (to the whole response if not streamed).", ("model",)
+)
+llm_tokens = metrics.counter("llm_tokens_total", "Tokens processed by LLM calls, by model and kind (prompt or completion).", ("model", "kind"))
+
+
+class Span:
+    """One timed operation. `attributes` end up in the request's timing breakdown."""
+
+    def __init__(self, name: str, trace, parent_id, attributes: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = next(trace._ids) if trace is not None else None
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.started) * 1000, 3)
+
+    def fail(self, error: Exception):
+        span_errors.inc(span=self.name)
+        self.attributes['error'] = type(error).__name__
+
+    def end(self):
+        """Stops the clock and records the span; later calls do nothing."""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.started
+        span_duration.observe(self.duration, span=self.name)
+        if self.trace is not None:
+            self.trace._record(self)
+
+
+class Trace:
+    """
+    The finished spans of one request. It is bound to a context variable, so spans opened anywhere the
+    request's context reaches (NLU, LLM calls, integrations, the solver's worker threads) are
+    collected here.
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.dropped_spans = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activated(self):
+        """Makes this the current trace for the enclosed code (e.g. a streamed response body)."""
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def iterate(self, chunks):
+        """
+        Yields from `chunks` with this trace active only while the next item is produced, so spans
+        opened by a lazily consumed generator (a streamed reply) land here without the context
+        variable being held across yields.
+        """
+        iterator = iter(chunks)
+        try:
+            while True:
+                with self.activated():
+                    try:
+                        chunk = next(iterator)
+                    except StopIteration:
+                        return
+                yield chunk
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close() # Frees a streamed call's backend slot if the client went away
+
+    async def aiterate(self, chunks):
+        """iterate() for async generators."""
+        iterator = chunks.__aiter__()
+        try:
+            while True:
+                with self.activated():
+                    try:
+                        chunk = await iterator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                yield chunk
+        finally:
+            if hasattr(iterator, 'aclose'):
+                await iterator.aclose()
+
+    def _record(self, span: Span):
+        with self._lock:
+            if len(self.spans) < TRACE_MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped_spans += 1
+
+    def finish(self, **attributes):
+        """Ends the trace once; the root duration goes to span_duration_seconds{span=<name>}."""
+        if self.duration is not None:
+            return
+        self.attributes.update(attributes)
+        self.duration = time.perf_counter() - self.started
+        span_duration.observe(self.duration, span=self.name)
+
+    def breakdown(self) -> dict:
+        """Per-request timings: every span with its offset, duration and attributes, plus totals per span name."""
+        total = self.duration if self.duration is not None else time.perf_counter() - self.started
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.started)
+        by_name = {}
+        for span in spans:
+            entry = by_name.setdefault(span.name, {'count': 0, 'total_ms': 0.0})
+            entry['count'] += 1
+            entry['total_ms'] = round(entry['total_ms'] + span.duration * 1000, 3)
+        return {
+            'total_ms': round(total * 1000, 3),
+            'by_span': by_name,
+            'spans': [
+                {
+                    'id': span.span_id,
+                    'parent': span.parent_id,
+                    'name': span.name,
+                    'start_ms': round((span.started - self.started) * 1000, 3),
+                    'duration_ms': round(span.duration * 1000, 3),
+                    **span.attributes,
+                }
+                for span in spans
+            ],
+            'dropped_spans': self.dropped_spans,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def start_span(name: str, **attributes) -> Span:
+    """
+    Starts a span under the current trace and span without making it the current span. Meant for
+    leaf operations that outlive a single block, such as a streamed LLM response; call end() on it.
+    """
+    return Span(name, _current_trace.get(), _current_span_id.get(), dict(attributes))
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the enclosed code as `name`: always into span_duration_seconds, and into the current
+    request's trace if there is one. Spans opened inside become its children. Yields the Span so
+    callers can add attributes as they learn them.
+    """
+    current = start_span(name, **attributes)
+    token = _current_span_id.set(current.span_id)
+    try:
+        yield current
+    except Exception as e:
+        current.fail(e)
+        raise
+    finally:
+        _current_span_id.reset(token)
+        current.end()